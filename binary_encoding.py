@@ -0,0 +1,195 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+Encodes response data as MessagePack or CBOR, for clients that ask for
+application/msgpack or application/cbor in their Accept header. The
+encoded data has the same structure as the JSON, and follows the same
+policy (see json_encoding), except that Decimals are written as 64-bit
+floats, which is what a JSON client would parse them as. Map keys are
+sorted, so a value always encodes the same.
+
+Each format can also join values it has already encoded into an array,
+so encoded spots can be cached and spliced into lists like spot JSON.
+"""
+
+from decimal import Decimal
+import datetime
+import struct
+
+
+class BinaryFormat(object):
+    """ Encodes the JSON types in a binary format. Subclasses give the
+    encodings of the constants and of each header.
+    """
+    name = None
+    media_type = None
+
+    NIL = None
+    TRUE = None
+    FALSE = None
+
+    def encode(self, value):
+        chunks = []
+        self._encode(value, chunks.append)
+        return ''.join(chunks)
+
+    def array(self, fragments):
+        """Joins encoded values into an encoded array of them."""
+        return self.array_header(len(fragments)) + ''.join(fragments)
+
+    def _encode(self, value, write):
+        if value is None:
+            write(self.NIL)
+        elif value is True:
+            write(self.TRUE)
+        elif value is False:
+            write(self.FALSE)
+        elif isinstance(value, (int, long)):
+            write(self.integer(value))
+        elif isinstance(value, (float, Decimal)):
+            write(self.double(float(value)))
+        elif isinstance(value, basestring):
+            self._encode_string(value, write)
+        elif isinstance(value, (list, tuple)):
+            write(self.array_header(len(value)))
+            for item in value:
+                self._encode(item, write)
+        elif isinstance(value, dict):
+            write(self.map_header(len(value)))
+            for key in sorted(value):
+                # JSON object keys are always strings
+                self._encode_string(key if isinstance(key, basestring) else unicode(key), write)
+                self._encode(value[key], write)
+        elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            self._encode_string(value.isoformat(), write)
+        else:
+            raise TypeError("%r is not serializable" % (value,))
+
+    def _encode_string(self, value, write):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        write(self.string_header(len(value)))
+        write(value)
+
+    def integer(self, value):
+        raise NotImplementedError
+
+    def double(self, value):
+        raise NotImplementedError
+
+    def string_header(self, length):
+        raise NotImplementedError
+
+    def array_header(self, length):
+        raise NotImplementedError
+
+    def map_header(self, length):
+        raise NotImplementedError
+
+
+class MessagePack(BinaryFormat):
+    """ MessagePack, with strings in the str family. """
+    name = 'msgpack'
+    media_type = 'application/msgpack'
+
+    NIL = '\xc0'
+    TRUE = '\xc3'
+    FALSE = '\xc2'
+
+    def integer(self, value):
+        if 0 <= value < 0x80:
+            return chr(value)
+        if -0x20 <= value < 0:
+            return struct.pack('>b', value)
+        if value > 0:
+            for code, fmt in (('\xcc', '>B'), ('\xcd', '>H'), ('\xce', '>I'), ('\xcf', '>Q')):
+                if value < 1 << (struct.calcsize(fmt) * 8):
+                    return code + struct.pack(fmt, value)
+        else:
+            for code, fmt in (('\xd0', '>b'), ('\xd1', '>h'), ('\xd2', '>i'), ('\xd3', '>q')):
+                if value >= -1 << (struct.calcsize(fmt) * 8 - 1):
+                    return code + struct.pack(fmt, value)
+        raise ValueError("%s is out of range" % value)
+
+    def double(self, value):
+        return '\xcb' + struct.pack('>d', value)
+
+    def string_header(self, length):
+        if length < 0x20:
+            return chr(0xa0 | length)
+        return self._header(length, '\xd9', '\xda', '\xdb')
+
+    def array_header(self, length):
+        if length < 0x10:
+            return chr(0x90 | length)
+        return self._header(length, None, '\xdc', '\xdd')
+
+    def map_header(self, length):
+        if length < 0x10:
+            return chr(0x80 | length)
+        return self._header(length, None, '\xde', '\xdf')
+
+    def _header(self, length, code8, code16, code32):
+        if code8 is not None and length < 0x100:
+            return code8 + struct.pack('>B', length)
+        if length < 0x10000:
+            return code16 + struct.pack('>H', length)
+        return code32 + struct.pack('>I', length)
+
+
+class CBOR(BinaryFormat):
+    """ CBOR (RFC 7049), with strings as text strings. """
+    name = 'cbor'
+    media_type = 'application/cbor'
+
+    NIL = '\xf6'
+    TRUE = '\xf5'
+    FALSE = '\xf4'
+
+    def integer(self, value):
+        if value >= 0:
+            return self._head(0, value)
+        return self._head(1, -1 - value)
+
+    def double(self, value):
+        return '\xfb' + struct.pack('>d', value)
+
+    def string_header(self, length):
+        return self._head(3, length)
+
+    def array_header(self, length):
+        return self._head(4, length)
+
+    def map_header(self, length):
+        return self._head(5, length)
+
+    def _head(self, major_type, argument):
+        major_type <<= 5
+        if argument < 24:
+            return chr(major_type | argument)
+        for extra, fmt in ((24, '>B'), (25, '>H'), (26, '>I'), (27, '>Q')):
+            if argument < 1 << (struct.calcsize(fmt) * 8):
+                return chr(major_type | extra) + struct.pack(fmt, argument)
+        raise ValueError("%s is out of range" % argument)
+
+
+FORMATS = (MessagePack(), CBOR())
+
+# Media types clients may ask for each format by
+MEDIA_TYPES = {
+    'application/msgpack': FORMATS[0],
+    'application/x-msgpack': FORMATS[0],
+    'application/cbor': FORMATS[1],
+}
+
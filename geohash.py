@@ -0,0 +1,147 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+    Description
+    =================================================================
+    Geohash encoding, and covering a latitude/longitude box with
+    geohash cells. Spots store the geohash of their location in an
+    indexed column, and a box search first narrows the spots to the
+    cells covering the box.
+"""
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_PRECISION = 12
+
+# Sorts after every geohash character, so [prefix, prefix + END) is
+# every geohash starting with prefix
+END = '~'
+
+
+def encode(latitude, longitude, precision=MAX_PRECISION):
+    """Returns the geohash of a point, with precision characters."""
+    latitude = float(latitude)
+    longitude = float(longitude)
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            value, value_range = longitude, lon_range
+        else:
+            value, value_range = latitude, lat_range
+
+        middle = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Returns the (height, width) in degrees of a cell with precision
+    characters."""
+    bits = 5 * precision
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def precision_for_zoom(zoom):
+    """Returns the geohash precision whose cells are about a quarter of
+    a map tile wide at a web map zoom level."""
+    precision = 1
+    while precision < MAX_PRECISION and (5 * (precision + 1) + 1) // 2 <= zoom + 2:
+        precision += 1
+    return precision
+
+
+def cover(south, west, north, east, max_cells=32):
+    """Returns the geohash prefixes of the cells covering a box, using
+    the most precise cells that need no more than max_cells. A box where
+    west > east crosses the antimeridian."""
+    south, west, north, east = float(south), float(west), float(north), float(east)
+    south = max(south, -90.0)
+    north = min(north, 90.0)
+    if west > east:
+        boxes = [(west, 180.0), (-180.0, east)]
+    else:
+        boxes = [(max(west, -180.0), min(east, 180.0))]
+
+    cells = ['']
+    for precision in range(1, MAX_PRECISION + 1):
+        grids = [_grid(south, box_west, north, box_east, precision) for box_west, box_east in boxes]
+        if sum(len(rows) * len(cols) for rows, cols in grids) > max_cells:
+            break
+
+        height, width = cell_size(precision)
+        found = set()
+        for rows, cols in grids:
+            for row in rows:
+                for col in cols:
+                    found.add(encode(-90.0 + (row + 0.5) * height, -180.0 + (col + 0.5) * width, precision))
+        cells = sorted(found)
+
+    return cells
+
+
+def ranges(cells):
+    """Merges geohash cells that are next to each other in sorted order
+    into (start, stop) ranges, with every geohash in a cell falling in
+    start <= geohash < stop."""
+    merged = []
+    previous = None
+    for cell in sorted(cells):
+        value = _value(cell)
+        if previous is not None and len(cell) == len(previous[0]) and value == previous[1] + 1:
+            merged[-1] = (merged[-1][0], cell + END)
+        else:
+            merged.append((cell, cell + END))
+        previous = (cell, value)
+
+    return merged
+
+
+def _value(cell):
+    value = 0
+    for char in cell:
+        value = value * 32 + BASE32.index(char)
+    return value
+
+
+def _grid(south, west, north, east, precision):
+    """The row and column numbers of the cells with precision characters
+    in a box that doesn't cross the antimeridian."""
+    height, width = cell_size(precision)
+
+    first_row = int((south + 90.0) // height)
+    last_row = min(int((north + 90.0) // height), int(180.0 / height) - 1)
+    first_col = int((west + 180.0) // width)
+    last_col = min(int((east + 180.0) // width), int(360.0 / width) - 1)
+
+    return range(first_row, last_row + 1), range(first_col, last_col + 1)
@@ -0,0 +1,30 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+The default JSON encoder, using simplejson, which writes Decimals
+itself (in its C speedups, when they are built). The encoders are made
+once, rather than on every call as simplejson.dumps does when it is
+given any options.
+"""
+from spotseeker_server.json_encoding import default
+import simplejson as json
+
+_encoder = json.JSONEncoder(use_decimal=True, default=default)
+_pretty_encoder = json.JSONEncoder(use_decimal=True, default=default, sort_keys=True, indent=4 * ' ')
+
+
+def encode(value, pretty=False):
+    if pretty:
+        return _pretty_encoder.encode(value)
+    return _encoder.encode(value)
@@ -0,0 +1,79 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+A JSON encoder using only the standard library's json module, for
+deployments without simplejson's C speedups. The json module has no
+option for Decimals, so each is handed back to it as a float that
+is written with the Decimal's own digits. The C encoder formats floats
+itself, so the pure Python encoder is always used, which makes this the
+slowest of the encoders.
+"""
+from spotseeker_server.json_encoding import default
+from decimal import Decimal
+import json
+from json.encoder import _make_iterencode, encode_basestring, encode_basestring_ascii, FLOAT_REPR, INFINITY
+
+
+class _DecimalNumber(float):
+    """A float written with the digits of the Decimal it was made from."""
+    def __new__(cls, value):
+        number = float.__new__(cls, value)
+        number.digits = str(value)
+        return number
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return _DecimalNumber(value)
+    return default(value)
+
+
+def _floatstr(value):
+    if isinstance(value, _DecimalNumber):
+        return value.digits
+    if value != value or value in (INFINITY, -INFINITY):
+        raise ValueError("Out of range float values are not JSON compliant: %r" % value)
+    return FLOAT_REPR(value)
+
+
+class _Encoder(json.JSONEncoder):
+    def iterencode(self, o, _one_shot=False):
+        # The C encoder formats floats itself, so always use the pure
+        # Python one, with a float formatter that knows Decimals
+        markers = {} if self.check_circular else None
+        if self.encoding != 'utf-8':
+            encoding = self.encoding
+            default = self.default
+
+            def _default(o):
+                if isinstance(o, str):
+                    o = o.decode(encoding)
+                return default(o)
+        else:
+            _default = self.default
+        if self.ensure_ascii:
+            _encoder = encode_basestring_ascii
+        else:
+            _encoder = encode_basestring
+        return _make_iterencode(markers, _default, _encoder, self.indent, _floatstr, self.key_separator, self.item_separator, self.sort_keys, self.skipkeys, _one_shot)(o, 0)
+
+
+_encoder = _Encoder(default=_default)
+_pretty_encoder = _Encoder(default=_default, sort_keys=True, indent=4, separators=(',', ': '))
+
+
+def encode(value, pretty=False):
+    if pretty:
+        return _pretty_encoder.encode(value)
+    return _encoder.encode(value)
@@ -0,0 +1,67 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+A JSON encoder using ujson, when it is installed. ujson would write
+Decimals as rounded floats and datetimes as timestamps, so the value is
+walked first, and numbers other than ints are handed to ujson as objects
+whose __json__ returns their exact text. ujson writes no spaces between
+items, so its output is smaller but not byte for byte the default
+encoder's. Pretty output, which ujson can't sort the keys of, comes from
+the default encoder. The walk costs about as much as ujson saves, so
+with simplejson's C speedups built this is rarely faster; it is for
+comparing with benchmark_json_encoders on your own spots.
+"""
+from spotseeker_server.json_encoding import default, get_encoder, DEFAULT_ENCODER
+from decimal import Decimal
+import ujson
+
+
+class _Number(object):
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __json__(self):
+        return self.text
+
+
+_PLAIN = frozenset((str, unicode, int, long, bool, type(None)))
+
+
+def _prepare(value):
+    kind = type(value)
+    if kind in _PLAIN:
+        return value
+    if kind is dict:
+        return dict((key, item if type(item) in _PLAIN else _prepare(item)) for key, item in value.iteritems())
+    if kind is list or kind is tuple:
+        return [item if type(item) in _PLAIN else _prepare(item) for item in value]
+    if isinstance(value, Decimal):
+        return _Number(str(value))
+    if isinstance(value, float):
+        if value != value or value in (float('inf'), float('-inf')):
+            raise ValueError("Out of range float values are not JSON compliant: %r" % value)
+        return _Number(repr(value))
+    if isinstance(value, dict):
+        return _prepare(dict(value))
+    if isinstance(value, (list, tuple)):
+        return _prepare(list(value))
+    return _prepare(default(value))
+
+
+def encode(value, pretty=False):
+    if pretty:
+        return get_encoder(DEFAULT_ENCODER).encode(value, True)
+    return ujson.dumps(_prepare(value), escape_forward_slashes=False)
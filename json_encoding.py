@@ -0,0 +1,75 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+Encodes the JSON sent in responses, including the cached spot JSON,
+with the encoder module named by SPOTSEEKER_JSON_ENCODER:
+
+SPOTSEEKER_JSON_ENCODER = 'spotseeker_server.json_encoders.simplejson_encoder'
+
+An encoder module defines encode(value, pretty=False), which returns a
+str. Every encoder must follow the same policy, so the output only
+changes with the encoder in its whitespace (manage.py
+benchmark_json_encoders checks an encoder's output against the default
+one's):
+
+ - Decimals are numbers with exactly their own digits, so
+   Decimal('47.65500000') is written 47.65500000, never rounded through
+   a float.
+ - datetimes, dates and times are ISO 8601 strings.
+ - Other values JSON has no type for raise a TypeError.
+ - Pretty output has sorted keys, is indented by four spaces, and
+   separates items with ',' and keys with ': '.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+import datetime
+
+DEFAULT_ENCODER = 'spotseeker_server.json_encoders.simplejson_encoder'
+
+# The encoders that ship with the server; ujson_encoder needs ujson
+ENCODERS = (
+    DEFAULT_ENCODER,
+    'spotseeker_server.json_encoders.stdlib_encoder',
+    'spotseeker_server.json_encoders.ujson_encoder',
+)
+
+
+def get_encoder(module=None):
+    """Returns the encoder module named, or by default the one set by
+    SPOTSEEKER_JSON_ENCODER."""
+    if module is None:
+        module = getattr(settings, 'SPOTSEEKER_JSON_ENCODER', DEFAULT_ENCODER)
+    try:
+        mod = import_module(module)
+    except ImportError, e:
+        raise ImproperlyConfigured('Error importing module %s: "%s"' %
+                                   (module, e))
+
+    if not hasattr(mod, 'encode'):
+        raise ImproperlyConfigured('Module "%s" does not define a "encode" method.' % module)
+    return mod
+
+
+def encode(value, pretty=False):
+    """Encodes value as JSON with the configured encoder."""
+    return get_encoder().encode(value, pretty)
+
+
+def default(value):
+    """The encoders' hook for values JSON has no type for."""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError("%r is not JSON serializable" % (value,))
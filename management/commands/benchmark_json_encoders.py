@@ -0,0 +1,104 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+This provides a management command to django's manage.py called
+benchmark_json_encoders that times JSON encoder modules (see
+spotseeker_server.json_encoding) on the spots in the database, encoding
+each spot's JSON on its own as the spot cache does. A plain
+simplejson.dumps is timed too, for comparison. By default every encoder
+that ships with the server and can be imported here is timed. Each
+encoder's output is checked against the default encoder's, so one that
+breaks the output format is reported.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from spotseeker_server.models import Spot
+from spotseeker_server import json_encoding
+import simplejson as json
+import time
+
+
+class Command(BaseCommand):
+    help = 'Times JSON encoders on the spots in the database'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--encoders',
+                    dest='encoders',
+                    default=None,
+                    help='Comma separated encoder modules to time (default: the shipped ones and the configured one)'),
+        make_option('--limit',
+                    dest='limit',
+                    type='int',
+                    default=1000,
+                    help='Number of spots to encode'),
+        make_option('--repeat',
+                    dest='repeat',
+                    type='int',
+                    default=20,
+                    help='Number of times each spot is encoded'),
+    )
+
+    def handle(self, *args, **options):
+        if options['encoders']:
+            encoders = [json_encoding.get_encoder(module.strip()) for module in options['encoders'].split(',')]
+        else:
+            encoders = []
+            for module in json_encoding.ENCODERS:
+                try:
+                    encoders.append(json_encoding.get_encoder(module))
+                except ImproperlyConfigured, e:
+                    self.stdout.write("Skipping %s: %s\n" % (module, e))
+            configured = json_encoding.get_encoder()
+            if configured not in encoders:
+                encoders.append(configured)
+
+        spots = Spot.objects.json_for(Spot.objects.order_by('pk')[:options['limit']])
+        if not spots:
+            raise CommandError("There are no spots to encode; try 'manage.py create_sample_spots'")
+
+        default_encoder = json_encoding.get_encoder(json_encoding.DEFAULT_ENCODER)
+        expected = [default_encoder.encode(spot) for spot in spots]
+        expected_pretty = [default_encoder.encode(spot, True) for spot in spots]
+
+        self.stdout.write("Encoding %s spots, %s times each\n" % (len(spots), options['repeat']))
+        self._report("simplejson.dumps", json.dumps, spots, expected, options['repeat'])
+        for encoder in encoders:
+            matches = self._report(encoder.__name__, encoder.encode, spots, expected, options['repeat'])
+            if matches and [encoder.encode(spot, True) for spot in spots] != expected_pretty:
+                self.stdout.write("    pretty output differs from the default encoder's\n")
+
+    def _canonical(self, spot_json):
+        # Decoding Decimals keeps their digits, so only whitespace is lost
+        return json.dumps(json.loads(spot_json, use_decimal=True), use_decimal=True, sort_keys=True)
+
+    def _report(self, name, encode, spots, expected, repeat):
+        start = time.time()
+        for i in range(repeat):
+            for spot in spots:
+                encode(spot)
+        elapsed = (time.time() - start) / (repeat * len(spots))
+
+        encoded = [encode(spot) for spot in spots]
+        matches = encoded == expected
+        if matches:
+            note = ""
+        elif map(self._canonical, encoded) == map(self._canonical, expected):
+            matches = True
+            note = ", same output but for whitespace"
+        else:
+            note = ", DIFFERENT output"
+        size = sum(len(spot_json) for spot_json in encoded) / len(spots)
+        self.stdout.write("%-55s %8.1fus per spot, %6d bytes%s\n" % (name, elapsed * 1000000, size, note))
+        return matches
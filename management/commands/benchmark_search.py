@@ -0,0 +1,102 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+This provides a management command to django's manage.py called
+benchmark_search that times a small bounding-box search against growing
+numbers of spots, once with the geohash narrowing and once with only the
+latitude/longitude ranges. The spots are created in a test database
+that is destroyed afterwards. With --live they are created in the
+configured database instead, in a transaction that is rolled back.
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from south.management.commands import patch_for_test_db_setup
+from optparse import make_option
+from spotseeker_server.models import Spot
+from spotseeker_server.views.search import SearchView
+from spotseeker_server import geohash
+from decimal import Decimal
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Times bounding-box spot searches with and without the geohash index'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes',
+                    dest='sizes',
+                    default='1000,10000,50000',
+                    help='Comma separated numbers of spots to search'),
+        make_option('--repeat',
+                    dest='repeat',
+                    type='int',
+                    default=20,
+                    help='Number of searches timed for each size'),
+        make_option('--live',
+                    action='store_true',
+                    dest='live',
+                    default=False,
+                    help='Create the spots in the configured database, and roll them back, instead of in a test database'),
+    )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        if options['live']:
+            self._benchmark(sizes, options['repeat'])
+            return
+
+        patch_for_test_db_setup()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self._benchmark(sizes, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _benchmark(self, sizes, repeat):
+        view = SearchView()
+
+        # A box of about 100m on a side, somewhere in the middle of the spots
+        south, west, north, east = "47.6550", "-122.3100", "47.6559", "-122.3087"
+
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            created = 0
+            for size in sorted(sizes):
+                spots = []
+                for i in range(created, size):
+                    latitude = Decimal("%.8f" % random.uniform(47.5, 47.8))
+                    longitude = Decimal("%.8f" % random.uniform(-122.45, -122.15))
+                    spots.append(Spot(name="benchmark %s" % i,
+                                      latitude=latitude,
+                                      longitude=longitude,
+                                      geohash=geohash.encode(latitude, longitude)))
+                Spot.objects.bulk_create(spots)
+                created = size
+
+                with_geohash = self._time(repeat, lambda: view.filter_box(Spot.objects.all(), south, west, north, east))
+                without_geohash = self._time(repeat, lambda: Spot.objects.filter(longitude__gte=west, longitude__lte=east, latitude__gte=south, latitude__lte=north))
+
+                self.stdout.write("%8d spots: geohash %.2fms, lat/lon only %.2fms\n" % (size, with_geohash * 1000, without_geohash * 1000))
+        finally:
+            transaction.rollback()
+            transaction.leave_transaction_management()
+
+    def _time(self, repeat, make_query):
+        start = time.time()
+        for i in range(repeat):
+            list(make_query().values_list('pk', flat=True))
+        return (time.time() - start) / repeat
@@ -0,0 +1,39 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+This provides a management command to django's manage.py called
+build_search_snapshot that writes the search snapshot file that server
+processes memory-map when SPOTSEEKER_SEARCH_SNAPSHOT_FILE is set. Run
+it from cron to publish new versions; the old file is replaced in one
+rename, and each process switches to the new file on its next search.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from spotseeker_server.search_snapshot import write_snapshot_file
+
+
+class Command(BaseCommand):
+    help = 'Writes the spot search snapshot file'
+    args = '[path]'
+
+    def handle(self, *args, **options):
+        if args:
+            path = args[0]
+        else:
+            path = getattr(settings, 'SPOTSEEKER_SEARCH_SNAPSHOT_FILE', None)
+        if not path:
+            raise CommandError("Give a path, or set SPOTSEEKER_SEARCH_SNAPSHOT_FILE")
+
+        count = write_snapshot_file(path)
+        self.stdout.write("Wrote %s spots to %s\n" % (count, path))
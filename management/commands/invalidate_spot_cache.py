@@ -0,0 +1,28 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+This provides a management command to django's manage.py called
+invalidate_spot_cache that invalidates every cached spot JSON, for
+example after a bulk import, without flushing the rest of the cache.
+"""
+from django.core.management.base import BaseCommand
+from spotseeker_server.models import bump_spot_cache_generation
+
+
+class Command(BaseCommand):
+    help = 'Invalidates all of the cached spot JSON by starting a new cache generation'
+
+    def handle(self, *args, **options):
+        generation = bump_spot_cache_generation()
+        self.stdout.write("Spot cache generation: %s\n" % generation)
@@ -23,7 +23,10 @@
         proper exception is thrown on an invalid image type.
 """
 
-from django.db import models
+from django.db import models, DatabaseError
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.conf import settings
 from django.db.models import Sum, Count
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.core.validators import validate_slug
@@ -39,9 +42,19 @@ import random
 from PIL import Image
 from cStringIO import StringIO
 import oauth_provider.models
+from spotseeker_server import geohash
+from spotseeker_server import opening_hours
+from spotseeker_server import json_encoding
+from spotseeker_server import binary_encoding
+import simplejson as json
 from django.core.cache import cache
 import re
+from collections import namedtuple
 from functools import wraps
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
 
 
 def update_etag(func):
@@ -54,6 +67,192 @@ def update_etag(func):
     return wraps(func)(_newETag)
 
 
+# Bump this whenever the cached spot JSON changes shape, so entries
+# written by an older deploy are never read.
+SPOT_CACHE_VERSION = 1
+
+
+def _spot_cache_prefix():
+    return getattr(settings, 'SPOTSEEKER_CACHE_PREFIX', 'spotseeker')
+
+
+def _spot_cache_generation_key():
+    return '%s:spot:generation' % _spot_cache_prefix()
+
+
+def _search_cache_generation_key():
+    return '%s:search:generation' % _spot_cache_prefix()
+
+
+# Generations are kept for a year, rather than the cache's default
+# timeout, so every cached spot isn't invalidated at once when one
+# expires. A lost generation restarts from the time in microseconds,
+# which is past any generation bumped from an earlier start unless it
+# was bumped more than a million times a second on average.
+CACHE_GENERATION_TIMEOUT = 365 * 24 * 60 * 60
+
+
+def _new_cache_generation():
+    return int(time.time() * 1000000)
+
+
+def _cache_generation(key):
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _new_cache_generation(), CACHE_GENERATION_TIMEOUT)
+        generation = cache.get(key, _new_cache_generation())
+    return generation
+
+
+def _bump_cache_generation(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _new_cache_generation(), CACHE_GENERATION_TIMEOUT)
+        return cache.get(key)
+
+
+def spot_cache_generation():
+    """Returns the current spot cache generation, starting a new one if
+    there is none (or it was evicted). New generations start from the
+    current time in microseconds, so they don't reuse an older
+    generation's keys (see CACHE_GENERATION_TIMEOUT)."""
+    return _cache_generation(_spot_cache_generation_key())
+
+
+def bump_spot_cache_generation():
+    """Invalidates every cached spot at once by moving to a new
+    generation. The old entries are left to expire."""
+    return _bump_cache_generation(_spot_cache_generation_key())
+
+
+def search_cache_generation():
+    """Returns the current generation of cached search results, which
+    moves on whenever any spot changes."""
+    return _cache_generation(_search_cache_generation_key())
+
+
+def bump_search_cache_generation():
+    """Invalidates every cached search result."""
+    return _bump_cache_generation(_search_cache_generation_key())
+
+
+def search_cache_key(query_key, generation=None):
+    """Returns the cache key for the ids of the spots found by a search,
+    given a canonical form of its parameters."""
+    if generation is None:
+        generation = search_cache_generation()
+    return '%s:search:v%d:g%d:%s' % (_spot_cache_prefix(), SPOT_CACHE_VERSION, generation, hashlib.sha1(query_key).hexdigest())
+
+
+def spot_cache_key(spot_id, generation=None):
+    """Returns the cache key for a spot's JSON. Pass generation when
+    building many keys, to avoid looking it up for each one."""
+    if generation is None:
+        generation = spot_cache_generation()
+    return '%s:spot:v%d:g%d:%s' % (_spot_cache_prefix(), SPOT_CACHE_VERSION, generation, spot_id)
+
+
+def spot_binary_cache_key(spot_id, format_name, generation=None):
+    """Returns the cache key for a spot encoded in the named binary
+    format (see binary_encoding)."""
+    if generation is None:
+        generation = spot_cache_generation()
+    return '%s:spot:v%d:g%d:%s:%s' % (_spot_cache_prefix(), SPOT_CACHE_VERSION, generation, format_name, spot_id)
+
+
+def spot_list_entry_cache_key(spot_id, generation=None):
+    """Returns the cache key for a spot's entry in v2 spot lists (see
+    SpotListTables.template)."""
+    if generation is None:
+        generation = spot_cache_generation()
+    return '%s:spot:v%d:g%d:list:%s' % (_spot_cache_prefix(), SPOT_CACHE_VERSION, generation, spot_id)
+
+
+def _spot_encoding_cache_keys(spot_id, generation):
+    """The keys of the encodings of a spot made from its JSON."""
+    keys = [spot_list_entry_cache_key(spot_id, generation)]
+    keys.extend(spot_binary_cache_key(spot_id, binary_format.name, generation) for binary_format in binary_encoding.FORMATS)
+    return keys
+
+
+def _spot_cache_keys(spot_id):
+    """The keys of every encoding of a spot in the current generation."""
+    generation = spot_cache_generation()
+    return [spot_cache_key(spot_id, generation)] + _spot_encoding_cache_keys(spot_id, generation)
+
+
+def spot_stale_cache_key(spot_id):
+    """Returns the cache key for the last JSON built for a spot, kept
+    across generations so it can be served while the spot is rebuilt.
+    Only used when SPOTSEEKER_SPOT_CACHE_SINGLE_FLIGHT is on."""
+    return '%s:spot:v%d:stale:%s' % (_spot_cache_prefix(), SPOT_CACHE_VERSION, spot_id)
+
+
+def compressed_cache_key(etag, encoding, format_name='json', generation=None):
+    """Returns the cache key for the compressed body of a response
+    with the given ETag, in the given Content-Encoding and format (json
+    or the name of a binary format). It is tied to the spot cache
+    generation, as the body is made from spot JSON."""
+    if generation is None:
+        generation = spot_cache_generation()
+    return '%s:compressed:v%d:g%d:%s:%s:%s' % (_spot_cache_prefix(), SPOT_CACHE_VERSION, generation, format_name, encoding, etag)
+
+
+# Totals for this process, by the same names as the json_for stats
+SPOT_CACHE_STATS = {
+    'hits': 0,
+    'misses': 0,
+    'stale': 0,
+    'rebuilds': 0,
+}
+_spot_cache_stats_lock = threading.Lock()
+
+
+def spot_cache_stats():
+    """Returns a copy of this process's spot cache totals: the spots
+    found in the cache (hits), missing from it (misses), served stale
+    while another request rebuilt them (stale), and rebuilt from the
+    database (rebuilds)."""
+    with _spot_cache_stats_lock:
+        return dict(SPOT_CACHE_STATS)
+
+
+def _spot_cache_single_flight():
+    return getattr(settings, 'SPOTSEEKER_SPOT_CACHE_SINGLE_FLIGHT', False)
+
+
+# The top level names in a spot's JSON, which a fields parameter can
+# pick from, and those whose keys can also be picked one by one
+SPOT_JSON_FIELDS = (
+    'id', 'uri', 'etag', 'name', 'type', 'location', 'capacity',
+    'display_access_restrictions', 'images', 'available_hours',
+    'organization', 'manager', 'extended_info', 'last_modified',
+    'external_id',
+)
+SPOT_JSON_KEYED_FIELDS = ('location', 'available_hours', 'extended_info')
+
+
+def parse_spot_fields(value):
+    """Parses a comma separated list of names from SPOT_JSON_FIELDS, each
+    of which may name one of its keys after a dot (for example
+    extended_info.noise_level). Returns a dict of the names, each with a
+    set of the keys asked for, or None for the whole value. Raises
+    ValueError for anything else."""
+    fields = {}
+    for field in value.split(','):
+        name, dot, key = field.strip().partition('.')
+        if name not in SPOT_JSON_FIELDS or (dot and (not key or name not in SPOT_JSON_KEYED_FIELDS)):
+            raise ValueError("Unknown field: %s" % field.strip())
+        if not dot:
+            fields[name] = None
+        elif name not in fields:
+            fields[name] = set([key])
+        elif fields[name] is not None:
+            fields[name].add(key)
+    return fields
+
+
 class SpotType(models.Model):
     """ The type of Spot.
     """
@@ -63,6 +262,421 @@ class SpotType(models.Model):
         return self.name
 
 
+class SpotManager(models.Manager):
+    """ Adds bulk JSON serialization to Spot.objects.
+    """
+    # Keep the IN lists well under the SQLite (999) and Oracle (1000)
+    # limits on the number of values.
+    JSON_BATCH_SIZE = 500
+
+    # How long a rebuild may hold a spot's lock, and how long other
+    # requests wait for it when there is no stale JSON to serve.
+    REBUILD_LOCK_TIMEOUT = 10
+    REBUILD_WAIT_TRIES = 5
+    REBUILD_WAIT_INTERVAL = 0.05
+
+    def json_for(self, spots, stats=None):
+        """ Returns the json_data_structure of every spot in spots (a
+        QuerySet or any iterable of Spot), in the same order.
+
+        If stats is a dict, the cache 'hits', 'misses', 'stale' and
+        'rebuilds' counts are stored in it.
+        """
+        return [json.loads(encoded, use_decimal=True) for encoded in self.encoded_json_for(spots, stats)]
+
+    def encoded_json_for(self, spots, stats=None, fields=None):
+        """ Like json_for, but returns each spot already encoded as a
+        JSON string, ready to be spliced into a response body.
+
+        With fields (see parse_spot_fields), only those parts of each
+        spot are loaded and built. This sparse JSON isn't cached.
+
+        The cache holds the encoded JSON of each spot. Cached entries
+        are read with a single get_many; the misses are built with a
+        fixed number of queries per JSON_BATCH_SIZE spots and written
+        back with set_many.
+
+        With SPOTSEEKER_SPOT_CACHE_SINGLE_FLIGHT on, the last JSON
+        built for each spot is also kept. Each missing spot is then
+        rebuilt by only one request at a time, while the others serve
+        the stale JSON (or briefly wait for it), and stale JSON is
+        served when the database fails during a rebuild.
+        """
+        spots = list(spots)
+        if fields is not None:
+            built = self.build_encoded_json(spots, fields)
+            return [built[spot.pk] for spot in spots if spot.pk in built]
+
+        counts = {'hits': 0, 'misses': 0, 'stale': 0, 'rebuilds': 0}
+
+        generation = spot_cache_generation()
+        keys = dict((spot.pk, spot_cache_key(spot.pk, generation)) for spot in spots)
+
+        cached = cache.get_many(keys.values())
+        found = {}
+        misses = []
+        for spot in spots:
+            if cached.get(keys[spot.pk]):
+                found[spot.pk] = cached[keys[spot.pk]]
+            else:
+                misses.append(spot)
+
+        counts['hits'] = len(spots) - len(misses)
+        counts['misses'] = len(misses)
+
+        if misses and _spot_cache_single_flight():
+            found.update(self._single_flight_encoded_json(misses, generation, counts))
+        elif misses:
+            built = self.build_encoded_json(misses)
+            self.cache_encoded_json(built, generation)
+            counts['rebuilds'] = len(built)
+            found.update(built)
+
+        logger.debug("spot json cache: %(hits)d hits, %(misses)d misses, %(stale)d stale, %(rebuilds)d rebuilds", counts)
+        with _spot_cache_stats_lock:
+            for name, count in counts.items():
+                SPOT_CACHE_STATS[name] += count
+        if stats is not None:
+            stats.update(counts)
+
+        # A spot deleted since it was found has no JSON
+        return [found[spot.pk] for spot in spots if spot.pk in found]
+
+    def encoded_binary_for(self, spots, binary_format, fields=None):
+        """ Like encoded_json_for, but returns each spot encoded in a
+        binary format (see binary_encoding). Whole spots are cached in
+        each format next to their JSON, and the misses are encoded from
+        their JSON.
+        """
+        spots = list(spots)
+        if fields is not None:
+            return [binary_format.encode(json.loads(spot_json)) for spot_json in self.encoded_json_for(spots, fields=fields)]
+
+        generation = spot_cache_generation()
+        keys = dict((spot.pk, spot_binary_cache_key(spot.pk, binary_format.name, generation)) for spot in spots)
+
+        found = cache.get_many(keys.values())
+        misses = [spot for spot in spots if keys[spot.pk] not in found]
+        if misses:
+            built = {}
+            for spot_json in self.encoded_json_for(misses):
+                spot_data = json.loads(spot_json)
+                built[keys[spot_data['id']]] = binary_format.encode(spot_data)
+            cache.set_many(built)
+            found.update(built)
+
+        # A spot deleted since it was found has no encoding
+        return [found[keys[spot.pk]] for spot in spots if keys[spot.pk] in found]
+
+    def list_entries_for(self, spots, fields=None):
+        """ Like encoded_json_for, but returns each spot's entry for
+        a v2 spot list, as a template for SpotListTables.encoded_entries.
+        Whole spots' entries are cached next to their JSON, and the
+        misses are made from their JSON.
+        """
+        spots = list(spots)
+        if fields is not None:
+            return [SpotListTables.template(spot_json) for spot_json in self.encoded_json_for(spots, fields=fields)]
+
+        generation = spot_cache_generation()
+        keys = dict((spot.pk, spot_list_entry_cache_key(spot.pk, generation)) for spot in spots)
+
+        found = cache.get_many(keys.values())
+        misses = [spot for spot in spots if keys[spot.pk] not in found]
+        if misses:
+            built = {}
+            for spot_json in self.encoded_json_for(misses):
+                template = SpotListTables.template(spot_json)
+                built[keys[template.spot_id]] = template
+            cache.set_many(built)
+            found.update(built)
+
+        # A spot deleted since it was found has no entry
+        return [found[keys[spot.pk]] for spot in spots if keys[spot.pk] in found]
+
+    def iter_list_entries(self, query=None, fields=None):
+        """ Yields the v2 list entries of every spot in query, a batch
+        at a time (see iter_batches).
+        """
+        for batch in self.iter_batches(query):
+            yield self.list_entries_for(batch, fields=fields)
+
+    def iter_batches(self, query=None):
+        """ Yields every spot in query (all spots by default) in lists
+        of up to JSON_BATCH_SIZE, ordered by id. Each batch is a separate
+        query on the id, so only one batch of spots is held in memory at
+        a time.
+        """
+        if query is None:
+            query = self.all()
+        query = query.order_by('pk')
+
+        last_pk = None
+        while True:
+            batch = query
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch[:self.JSON_BATCH_SIZE])
+            if batch:
+                yield batch
+                last_pk = batch[-1].pk
+            if len(batch) < self.JSON_BATCH_SIZE:
+                return
+
+    def iter_encoded_json(self, query=None, fields=None):
+        """ Yields the encoded JSON of every spot in query, a batch at
+        a time (see iter_batches).
+        """
+        for batch in self.iter_batches(query):
+            yield self.encoded_json_for(batch, fields=fields)
+
+    def _single_flight_encoded_json(self, spots, generation, counts):
+        """Gets the encoded JSON for spots missing from the cache,
+        protecting the database from concurrent rebuilds. Each spot has
+        its own rebuild lock. The spots locked by another request are
+        served stale, or waited for briefly, and the rest are built in
+        one batch.
+
+        The cache API has no add_many, so each missing spot costs a
+        cache.add round trip for its lock. A cold list then makes one
+        round trip per spot rather than the single get_many and
+        set_many of the plain cache; a lock for the whole batch wouldn't
+        stop other requests with overlapping batches from rebuilding the
+        same spots."""
+        locks = {}
+        locked = []
+        for spot in spots:
+            lock_key = spot_cache_key(spot.pk, generation) + ':lock'
+            if cache.add(lock_key, 1, self.REBUILD_LOCK_TIMEOUT):
+                locks[spot.pk] = lock_key
+            else:
+                # Someone else is rebuilding it
+                locked.append(spot)
+
+        found = {}
+        if locked:
+            stale = cache.get_many([spot_stale_cache_key(spot.pk) for spot in locked])
+            for spot in locked:
+                if spot_stale_cache_key(spot.pk) in stale:
+                    found[spot.pk] = stale[spot_stale_cache_key(spot.pk)]
+            counts['stale'] += len(found)
+            waiting = [spot for spot in locked if spot.pk not in found]
+
+            for i in range(self.REBUILD_WAIT_TRIES):
+                if not waiting:
+                    break
+                time.sleep(self.REBUILD_WAIT_INTERVAL)
+                keys = dict((spot_cache_key(spot.pk, generation), spot) for spot in waiting)
+                for key, spot_json in cache.get_many(keys.keys()).items():
+                    if spot_json:
+                        found[keys[key].pk] = spot_json
+                waiting = [spot for spot in waiting if spot.pk not in found]
+        else:
+            waiting = []
+
+        # Spots that took too long are built here anyway
+        spots = [spot for spot in spots if spot.pk in locks] + waiting
+        if not spots:
+            return found
+
+        try:
+            built = self.build_encoded_json(spots)
+        except DatabaseError:
+            stale = cache.get_many([spot_stale_cache_key(spot.pk) for spot in spots])
+            if len(stale) < len(spots):
+                raise
+            logger.warning("serving stale spot json after a database error", exc_info=True)
+            counts['stale'] += len(spots)
+            found.update((spot.pk, stale[spot_stale_cache_key(spot.pk)]) for spot in spots)
+            return found
+        finally:
+            if locks:
+                cache.delete_many(locks.values())
+
+        self.cache_encoded_json(built, generation)
+        counts['rebuilds'] += len(built)
+        found.update(built)
+        return found
+
+    def build_encoded_json(self, spots, fields=None):
+        """ Builds the encoded JSON of spots from the database, without
+        reading or writing the cache. Returns a dict keyed by spot id.
+        Only the given fields are built, if any (see parse_spot_fields).
+
+        spots may also hold other objects with a pk, such as the spots
+        found in the search snapshot; those are loaded as Spots first.
+        """
+        spots = list(spots)
+        encoder = json_encoding.get_encoder()
+        encoded = {}
+        for start in range(0, len(spots), self.JSON_BATCH_SIZE):
+            batch = spots[start:start + self.JSON_BATCH_SIZE]
+            if any(not isinstance(spot, Spot) for spot in batch):
+                loaded = self.in_bulk([spot.pk for spot in batch])
+                batch = [loaded[spot.pk] for spot in batch if spot.pk in loaded]
+            for spot, spot_json in zip(batch, self._build_json(batch, fields)):
+                encoded[spot.pk] = encoder.encode(spot_json)
+        return encoded
+
+    def cache_encoded_json(self, encoded, generation=None):
+        """ Writes encoded spot JSON, a dict keyed by spot id, to the
+        cache. Only call this with data that has been committed.
+        """
+        if generation is None:
+            generation = spot_cache_generation()
+        cache.set_many(dict((spot_cache_key(spot_id, generation), spot_json) for spot_id, spot_json in encoded.items()))
+
+        if _spot_cache_single_flight():
+            cache.set_many(
+                dict((spot_stale_cache_key(spot_id), spot_json) for spot_id, spot_json in encoded.items()),
+                getattr(settings, 'SPOTSEEKER_SPOT_CACHE_STALE_TIMEOUT', 24 * 60 * 60)
+            )
+
+    def _build_json(self, spots, fields=None):
+        """Loads the related rows of all the spots at once, and builds
+        their JSON. With fields, only the related rows they need are
+        loaded."""
+        spot_ids = [spot.pk for spot in spots]
+
+        def wanted(name):
+            return fields is None or name in fields
+
+        def keys(name):
+            return fields[name] if fields is not None else None
+
+        types = dict((spot_id, []) for spot_id in spot_ids)
+        if wanted('type'):
+            spot_types = Spot.spottypes.through.objects.filter(spot__in=spot_ids).order_by('id')
+            for spot_id, name in spot_types.values_list('spot_id', 'spottype__name'):
+                types[spot_id].append(name)
+
+        extended_info = dict((spot_id, {}) for spot_id in spot_ids)
+        if wanted('extended_info'):
+            info = SpotExtendedInfo.objects.filter(spot__in=spot_ids)
+            if keys('extended_info') is not None:
+                info = info.filter(key__in=keys('extended_info'))
+            for spot_id, key, value in info.values_list('spot_id', 'key', 'value'):
+                extended_info[spot_id][key] = value
+
+        available_hours = {}
+        if wanted('available_hours'):
+            days = [day for day in SpotAvailableHours.DAY_CHOICES if keys('available_hours') is None or day[1] in keys('available_hours')]
+            for spot_id in spot_ids:
+                available_hours[spot_id] = dict((day[1], []) for day in days)
+
+            hours = SpotAvailableHours.objects.filter(spot__in=spot_ids, day__in=[day[0] for day in days]).order_by('start_time')
+            for window in hours:
+                available_hours[window.spot_id][window.get_day_display()].append(window.json_data_structure())
+
+        images = dict((spot_id, []) for spot_id in spot_ids)
+        if wanted('images'):
+            for img in SpotImage.objects.filter(spot__in=spot_ids).order_by('display_index'):
+                images[img.spot_id].append(img.json_data_structure())
+
+        return [
+            spot._json_data_structure(
+                types[spot.pk],
+                extended_info[spot.pk],
+                available_hours.get(spot.pk),
+                images[spot.pk],
+                fields
+            ) for spot in spots
+        ]
+
+
+# A spot's encoded v2 list entry, split around its references to the
+# lookup tables: pieces has one more string than refs has (table, value)
+# pairs, and the entry is the pieces joined by the refs' indexes
+SpotListEntry = namedtuple('SpotListEntry', ('spot_id', 'pieces', 'refs'))
+
+
+class SpotListTables(object):
+    """ Builds the entries of a v2 spot list, where the type names,
+    building names and extended info keys repeated across spots are
+    kept once in lookup tables and referenced by their index. Each
+    spot's uri is left out, as it is the uri_prefix and its id.
+
+    The indexes depend on the other spots in the list, so each spot's
+    entry is encoded once as a SpotListEntry (see template), which is
+    cached, and the indexes are filled in for each list.
+    """
+    TABLES = ('types', 'buildings', 'extended_info_keys')
+
+    def __init__(self):
+        self.tables = dict((name, []) for name in self.TABLES)
+        self.indexes = dict((name, {}) for name in self.TABLES)
+
+    def index(self, table, value):
+        indexes = self.indexes[table]
+        if value not in indexes:
+            indexes[value] = len(self.tables[table])
+            self.tables[table].append(value)
+        return indexes[value]
+
+    @staticmethod
+    def _entry(spot_json, index):
+        """The v2 list entry for the json_data_structure of a spot, or
+        just the fields of it that were built, with the references made
+        by index(table, value)."""
+        entry = dict(spot_json)
+        entry.pop('uri', None)
+        if 'type' in entry:
+            entry['type'] = [index('types', name) for name in entry['type']]
+        if 'location' in entry and 'building_name' in entry['location']:
+            entry['location'] = dict(entry['location'])
+            entry['location']['building_name'] = index('buildings', entry['location']['building_name'])
+        if 'extended_info' in entry:
+            entry['extended_info'] = [[index('extended_info_keys', key), value] for key, value in sorted(entry['extended_info'].items())]
+        return entry
+
+    @classmethod
+    def template(cls, spot_json):
+        """The SpotListEntry for a spot's encoded JSON. Each reference
+        to a table is encoded as a marker string, which is then cut out.
+        A marker can't be found inside another string, as the encoded
+        quote before it would be escaped there."""
+        encoder = json_encoding.get_encoder()
+        spot_data = json.loads(spot_json, use_decimal=True)
+        refs = []
+
+        def marker(table, value):
+            refs.append((table, value))
+            return u'\x00%d\x00' % (len(refs) - 1)
+
+        encoded = encoder.encode(cls._entry(spot_data, marker))
+        found = []
+        for number, ref in enumerate(refs):
+            encoded_marker = encoder.encode(u'\x00%d\x00' % number)
+            start = encoded.index(encoded_marker)
+            found.append((start, start + len(encoded_marker), ref))
+        found.sort()
+
+        pieces = []
+        last = 0
+        for start, end, ref in found:
+            pieces.append(encoded[last:start])
+            last = end
+        pieces.append(encoded[last:])
+        return SpotListEntry(spot_data.get('id'), tuple(pieces), tuple(ref for start, end, ref in found))
+
+    def encoded_entries(self, templates):
+        """The encoded v2 list entries for a list of SpotListEntry."""
+        index = self.index
+        encoded = []
+        for template in templates:
+            parts = [template.pieces[0]]
+            for (table, value), piece in zip(template.refs, template.pieces[1:]):
+                parts.append(str(index(table, value)))
+                parts.append(piece)
+            encoded.append(''.join(parts))
+        return encoded
+
+    def json_data_structure(self):
+        data = dict(self.tables)
+        data['uri_prefix'] = reverse('spot-search') + '/'
+        return data
+
+
 class Spot(models.Model):
     """ Represents a place for students to study.
     """
@@ -79,77 +693,120 @@ class Spot(models.Model):
     organization = models.CharField(max_length=50, blank=True)
     manager = models.CharField(max_length=50, blank=True)
     etag = models.CharField(max_length=40)
-    last_modified = models.DateTimeField(auto_now=True, auto_now_add=True)
+    last_modified = models.DateTimeField(auto_now=True, auto_now_add=True, db_index=True)
     external_id = models.CharField(max_length=100, null=True, blank=True, default=None, unique=True, validators=[validate_slug])
+    geohash = models.CharField(max_length=geohash.MAX_PRECISION, blank=True, editable=False, db_index=True)
+
+    objects = SpotManager()
 
     def __unicode__(self):
         return self.name
 
     @update_etag
     def save(self, *args, **kwargs):
-        cache.delete(self.pk)
+        if self.latitude is None or self.longitude is None:
+            self.geohash = ''
+        else:
+            self.geohash = geohash.encode(self.latitude, self.longitude)
+
+        cache.delete_many(_spot_cache_keys(self.pk))
         super(Spot, self).save(*args, **kwargs)
 
     def rest_url(self):
         return reverse('spot', kwargs={'spot_id': self.pk})
 
     def json_data_structure(self):
-        spot_json = cache.get(self.pk)
-        if not spot_json:
-            extended_info = {}
-            info = SpotExtendedInfo.objects.filter(spot=self)
-            for attr in info:
-                extended_info[attr.key] = attr.value
-
-            available_hours = {
-                'monday': [],
-                'tuesday': [],
-                'wednesday': [],
-                'thursday': [],
-                'friday': [],
-                'saturday': [],
-                'sunday': [],
-            }
-
-            hours = SpotAvailableHours.objects.filter(spot=self).order_by('start_time')
-            for window in hours:
-                available_hours[window.get_day_display()].append(window.json_data_structure())
-
-            images = []
-            for img in SpotImage.objects.filter(spot=self).order_by('display_index'):
-                images.append(img.json_data_structure())
-            types = []
-            for t in self.spottypes.all():
-                types.append(t.name)
-
-            spot_json = {
-                "id": self.pk,
-                "uri": self.rest_url(),
-                "etag": self.etag,
-                "name": self.name,
+        return Spot.objects.json_for([self])[0]
+
+    def encoded_json_data_structure(self, fields=None):
+        """Returns json_data_structure already encoded as JSON, with only
+        the given fields if any (see parse_spot_fields)."""
+        return Spot.objects.encoded_json_for([self], fields=fields)[0]
+
+    def refresh_cached_json(self):
+        """Rebuilds the cached JSON from the database. Call this after
+        changes to the spot have been committed, so readers never have
+        to rebuild it."""
+        self.changes_committed(Spot.objects.build_encoded_json(Spot.objects.filter(pk=self.pk)))
+
+    def changes_committed(self, encoded=None):
+        """Call this once changes to the spot have been committed. It
+        writes through the spot's encoded JSON (a dict keyed by spot id,
+        as build_encoded_json returns), if given, and invalidates cached
+        searches and encodings of the spot made while the changes were
+        uncommitted, which save() can't."""
+        generation = spot_cache_generation()
+        stale = _spot_encoding_cache_keys(self.pk, generation)
+        if encoded:
+            Spot.objects.cache_encoded_json(encoded, generation)
+        else:
+            stale.append(spot_cache_key(self.pk, generation))
+        cache.delete_many(stale)
+        bump_search_cache_generation()
+
+    def _json_data_structure(self, types, extended_info, available_hours, images, fields=None):
+        """Builds the JSON for this spot from its already loaded related
+        rows. See SpotManager.json_for."""
+        if fields is not None:
+            return self._sparse_json_data_structure(fields, {
                 "type": types,
-                "location": {
-                    # If any changes are made to this location dict, MAKE SURE to reflect those changes in the
-                    # location_descriptors list in views/schema_gen.py
-                    "latitude": self.latitude,
-                    "longitude": self.longitude,
-                    "height_from_sea_level": self.height_from_sea_level,
-                    "building_name": self.building_name,
-                    "floor": self.floor,
-                    "room_number": self.room_number,
-                },
-                "capacity": self.capacity,
-                "display_access_restrictions": self.display_access_restrictions,
-                "images": images,
-                "available_hours": available_hours,
-                "organization": self.organization,
-                "manager": self.manager,
                 "extended_info": extended_info,
-                "last_modified": self.last_modified.isoformat(),
-                "external_id": self.external_id
-            }
-            cache.add(self.pk, spot_json)
-        return spot_json
+                "available_hours": available_hours,
+                "images": images,
+            })
+
+        return {
+            "id": self.pk,
+            "uri": self.rest_url(),
+            "etag": self.etag,
+            "name": self.name,
+            "type": types,
+            "location": self._location_json_data_structure(),
+            "capacity": self.capacity,
+            "display_access_restrictions": self.display_access_restrictions,
+            "images": images,
+            "available_hours": available_hours,
+            "organization": self.organization,
+            "manager": self.manager,
+            "extended_info": extended_info,
+            "last_modified": self.last_modified.isoformat(),
+            "external_id": self.external_id
+        }
+
+    def _location_json_data_structure(self):
+        return {
+            # If any changes are made to this location dict, MAKE SURE to reflect those changes in the
+            # location_descriptors list in views/schema_gen.py
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "height_from_sea_level": self.height_from_sea_level,
+            "building_name": self.building_name,
+            "floor": self.floor,
+            "room_number": self.room_number,
+        }
+
+    def _sparse_json_data_structure(self, fields, related):
+        """Builds only the given fields of the JSON for this spot, taking
+        the related rows from the related dict."""
+        data = {}
+        for name, keys in fields.items():
+            if name in related:
+                value = related[name]
+            elif name == "id":
+                value = self.pk
+            elif name == "uri":
+                value = self.rest_url()
+            elif name == "location":
+                value = self._location_json_data_structure()
+            elif name == "last_modified":
+                value = self.last_modified.isoformat()
+            else:
+                value = getattr(self, name)
+
+            if keys is not None:
+                value = dict((key, value[key]) for key in keys if key in value)
+            data[name] = value
+        return data
 
     def update_rating(self):
         data = SpaceReview.objects.filter(space=self, is_published=True, is_deleted=False).aggregate(total=Sum('rating'), count=Count('rating'))
@@ -179,7 +836,7 @@ class Spot(models.Model):
 
 
     def delete(self, *args, **kwargs):
-        cache.delete(self.pk)
+        cache.delete_many(_spot_cache_keys(self.pk) + [spot_stale_cache_key(self.pk)])
         super(Spot, self).delete(*args, **kwargs)
 
     @staticmethod
@@ -190,6 +847,37 @@ class Spot(models.Model):
             return Spot.objects.get(pk=spot_id)
 
 
+class SpotTombstone(models.Model):
+    """ Records that a Spot was deleted, so clients syncing the changes
+    since some time (see AllSpotsView) can remove it too.
+    """
+    spot_id = models.IntegerField()
+    deleted = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __unicode__(self):
+        return "%s deleted %s" % (self.spot_id, self.deleted)
+
+
+@receiver(post_delete, sender=Spot, dispatch_uid='spotseeker_server.models.create_spot_tombstone')
+def _create_spot_tombstone(sender, **kwargs):
+    """Leave a tombstone for every deleted spot, including those deleted
+    in bulk through a QuerySet"""
+    SpotTombstone.objects.create(spot_id=kwargs['instance'].pk)
+
+
+
+@receiver(m2m_changed, sender=Spot.spottypes.through, dispatch_uid='spotseeker_server.models.spot_types_changed')
+def _spot_types_changed(sender, **kwargs):
+    """Update the etag and last_modified of spots whose types change"""
+    if kwargs['action'] not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not kwargs['reverse']:
+        kwargs['instance'].save()
+    elif kwargs['pk_set']:
+        for spot in Spot.objects.filter(pk__in=kwargs['pk_set']):
+            spot.save()
+
+
 class FavoriteSpot(models.Model):
     """ A FavoriteSpot associates a User and Spot.
     """
@@ -251,6 +939,39 @@ class SpotAvailableHours(models.Model):
         super(SpotAvailableHours, self).save(*args, **kwargs)
 
 
+
+class SpotOpenIntervalManager(models.Manager):
+    def rebuild(self, spot_id):
+        """Replaces the open intervals of a spot with ones computed from
+        its current available hours."""
+        hours = SpotAvailableHours.objects.filter(spot=spot_id).values_list('day', 'start_time', 'end_time')
+        intervals = opening_hours.intervals(hours)
+
+        self.filter(spot=spot_id).delete()
+        self.bulk_create([SpotOpenInterval(spot_id=spot_id, start=start, end=end) for start, end in intervals])
+
+
+class SpotOpenInterval(models.Model):
+    """ A stretch of minutes of the week (see opening_hours) a Spot is
+    continuously open, precomputed from its SpotAvailableHours so that
+    open_now, open_at and open_until searches are one indexed lookup.
+    """
+    spot = models.ForeignKey(Spot)
+    start = models.IntegerField(db_index=True)
+    end = models.IntegerField(db_index=True)
+
+    objects = SpotOpenIntervalManager()
+
+    def __unicode__(self):
+        return "%s: %s-%s" % (self.spot_id, self.start, self.end)
+
+
+@receiver(post_save, sender=SpotAvailableHours, dispatch_uid='spotseeker_server.models.rebuild_open_intervals_save')
+@receiver(post_delete, sender=SpotAvailableHours, dispatch_uid='spotseeker_server.models.rebuild_open_intervals_delete')
+def _rebuild_open_intervals(sender, **kwargs):
+    """Keep the open intervals in step with the available hours"""
+    SpotOpenInterval.objects.rebuild(kwargs['instance'].spot_id)
+
 class SpotExtendedInfo(models.Model):
     """ Additional institution-provided metadata about a spot. If providing custom metadata, you should provide a validator for that data, as well.
     """
@@ -310,7 +1031,7 @@ class SpotImage(models.Model):
             "modification_date": self.modification_date.isoformat(),
             "upload_user": self.upload_user,
             "upload_application": self.upload_application,
-            "thumbnail_root": reverse('spot-image-thumb', kwargs={'spot_id': self.spot.pk, 'image_id': self.pk}).rstrip('/'),
+            "thumbnail_root": reverse('spot-image-thumb', kwargs={'spot_id': self.spot_id, 'image_id': self.pk}).rstrip('/'),
             "description": self.description,
             "display_index": self.display_index
         }
@@ -331,17 +1052,33 @@ class SpotImage(models.Model):
         self.content_type = SpotImage.CONTENT_TYPES[img.format]
         self.width, self.height = img.size
 
-        cache.delete(self.spot.pk)
+        self.spot.save()  # Update the etag and last_modified on the spot
         super(SpotImage, self).save(*args, **kwargs)
 
     @update_etag
     def delete(self, *args, **kwargs):
         self.image.delete(save=False)
-        cache.delete(self.spot.pk)
+        self.spot.save()  # Update the etag and last_modified on the spot
         super(SpotImage, self).delete(*args, **kwargs)
 
     def rest_url(self):
-        return reverse('spot-image', kwargs={'spot_id': self.spot.pk, 'image_id': self.pk})
+        return reverse('spot-image', kwargs={'spot_id': self.spot_id, 'image_id': self.pk})
+
+
+@receiver(post_save, sender=Spot, dispatch_uid='spotseeker_server.models.search_changed_spot_save')
+@receiver(post_delete, sender=Spot, dispatch_uid='spotseeker_server.models.search_changed_spot_delete')
+@receiver(post_save, sender=SpotAvailableHours, dispatch_uid='spotseeker_server.models.search_changed_hours_save')
+@receiver(post_delete, sender=SpotAvailableHours, dispatch_uid='spotseeker_server.models.search_changed_hours_delete')
+@receiver(post_save, sender=SpotExtendedInfo, dispatch_uid='spotseeker_server.models.search_changed_info_save')
+@receiver(post_delete, sender=SpotExtendedInfo, dispatch_uid='spotseeker_server.models.search_changed_info_delete')
+@receiver(post_save, sender=SpotImage, dispatch_uid='spotseeker_server.models.search_changed_image_save')
+@receiver(post_delete, sender=SpotImage, dispatch_uid='spotseeker_server.models.search_changed_image_delete')
+def _search_changed(sender, **kwargs):
+    """Any change to a spot can change search results. This runs before
+    the change is committed, so a search in between can still cache the
+    old results; the views bump the generation again once they commit
+    (see Spot.changes_committed)."""
+    bump_search_cache_generation()
 
 
 class TrustedOAuthClient(models.Model):
@@ -0,0 +1,98 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+    Description
+    =================================================================
+    Available hours as minute-of-week intervals. The week starts at
+    midnight on Sunday. Each spot's hours are merged into the intervals
+    it is continuously open, so "open from X until Y" is one containment
+    test: start <= X and end >= Y.
+"""
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+DAY_NUMBERS = {'su': 0, 'm': 1, 't': 2, 'w': 3, 'th': 4, 'f': 5, 'sa': 6}
+
+
+def minute_of_week(day, time):
+    """The minute of the week at a time of day (a datetime.time or
+    "HH:MM" string) on a day ('su', 'm', ...)."""
+    if isinstance(time, basestring):
+        hour, minute = time.split(':')[:2]
+        hour, minute = int(hour), int(minute)
+    else:
+        hour, minute = time.hour, time.minute
+    return DAY_NUMBERS[day] * MINUTES_PER_DAY + hour * 60 + minute
+
+
+def intervals(hours):
+    """Returns the (start, end) minute-of-week intervals a spot is open,
+    from (day, start_time, end_time) available hours.
+
+    Hours closing at 23:59 or later run until midnight, so they join
+    hours opening at midnight the next day. An interval open over the
+    end of the week ends after MINUTES_PER_WEEK, and is also returned
+    shifted back a week so a search starting early in the week finds
+    it. A spot open all week has the single interval
+    (-MINUTES_PER_WEEK, 2 * MINUTES_PER_WEEK).
+    """
+    spans = []
+    for day, start_time, end_time in hours:
+        start = minute_of_week(day, start_time)
+        if start_time.second or start_time.microsecond:
+            # Not open for the whole first minute
+            start += 1
+        if (end_time.hour, end_time.minute) >= (23, 59):
+            end = (DAY_NUMBERS[day] + 1) * MINUTES_PER_DAY
+        else:
+            end = minute_of_week(day, end_time)
+        spans.append((start, end))
+    spans.sort()
+
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    if merged and merged[0][0] == 0 and merged[-1][1] == MINUTES_PER_WEEK:
+        if len(merged) == 1:
+            return [(-MINUTES_PER_WEEK, 2 * MINUTES_PER_WEEK)]
+        # Open over the end of the week
+        first = merged.pop(0)
+        last = merged.pop()
+        merged.append((last[0], first[1] + MINUTES_PER_WEEK))
+
+    result = []
+    for start, end in merged:
+        result.append((start, end))
+        if end > MINUTES_PER_WEEK:
+            result.append((start - MINUTES_PER_WEEK, end - MINUTES_PER_WEEK))
+    return result
+
+
+def window(at_day, at_time, until_day=None, until_time=None):
+    """Returns the (start, end) interval a spot has to be open for, to be
+    open at a time, or from a time until another. A window that ends
+    before it starts runs over the end of the week."""
+    start = minute_of_week(at_day, at_time)
+    if until_day is None:
+        return start, start + 1
+
+    end = minute_of_week(until_day, until_time)
+    if end < start:
+        end += MINUTES_PER_WEEK
+    return start, end
@@ -0,0 +1,603 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+
+    Description
+    =================================================================
+    An in-memory, columnar copy of the searchable fields of every spot,
+    used by SearchView when SPOTSEEKER_SEARCH_SNAPSHOT is on. Each spot
+    has a position in the columns, and a set of spots is a bitset (a
+    Python int) of positions, so filters combine with & and |.
+
+    The snapshot is brought up to date before each search from the
+    spots changed since it was last refreshed (by last_modified) and
+    the SpotTombstones left since then, looking back by
+    SPOTSEEKER_SYNC_OVERLAP as sync tokens do.
+
+    With SPOTSEEKER_SEARCH_SNAPSHOT_FILE set, the bulk of the snapshot
+    is a file written by the build_search_snapshot management command
+    and memory-mapped read-only, so every server process shares one copy
+    in the page cache. The file's spots take the first positions, and
+    only the spots changed since it was written are held in each
+    process. A new file is picked up on the next search after it
+    replaces the old one. The file also holds the spots in latitude and
+    in capacity order, and the open intervals by start, so box, capacity
+    and hours filters binary search the file instead of reading through
+    it.
+
+    Searches refresh the snapshot under its lock and then run against a
+    view() of it, so the file is searched without holding the lock.
+"""
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from spotseeker_server.models import Spot, SpotExtendedInfo, SpotOpenInterval, SpotTombstone
+from collections import namedtuple
+from array import array
+from datetime import datetime, timedelta
+from decimal import Decimal
+import simplejson as json
+import binascii
+import copy
+import calendar
+import mmap
+import os
+import struct
+import threading
+import time
+
+# What a search gets back for each spot: enough to rank, filter, and
+# find the spot JSON in the cache
+SnapshotSpot = namedtuple('SnapshotSpot', ['pk', 'latitude', 'longitude', 'capacity', 'etag', 'last_modified'])
+
+
+def positions(bits):
+    """The positions of the set bits, lowest first."""
+    return [i for i, bit in enumerate(reversed(bin(bits)[2:])) if bit == '1']
+
+
+def _bitset(flags):
+    """A bitset with the bit at each position set where flags is true."""
+    digits = ''.join(flag and '1' or '0' for flag in reversed(flags))
+    return int(digits or '0', 2)
+
+
+def _positions_bitset(positions, size):
+    """A bitset with the given positions, all below size, set."""
+    data = bytearray((size + 7) // 8)
+    for i in positions:
+        data[-1 - (i >> 3)] |= 1 << (i & 7)
+    if not data:
+        return 0
+    return int(binascii.hexlify(data), 16)
+
+
+class SpotSnapshot(object):
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.file_stat = None
+        self.clear()
+
+    def clear(self, base=None):
+        """Empties the snapshot, leaving only the spots in base (a
+        SnapshotFile) if one is given."""
+        self.base = base
+        self.offset = base.count if base else 0
+        self.position = {}
+        self.spots = []
+        self.latitude = array('d')
+        self.longitude = array('d')
+        self.building_name = []
+        self.intervals = []
+        self.types = {}
+        self.extended_info = {}
+        self.alive = (1 << self.offset) - 1
+        self.count = self.offset
+        self.last_modified = base.last_modified if base else None
+        self.last_deleted = base.last_deleted if base else None
+
+    def view(self):
+        """A copy of the snapshot as it is now, which later refreshes
+        leave alone, to search without holding the lock. Only the spots
+        held in memory are copied; the file is shared."""
+        with self.lock:
+            view = copy.copy(self)
+            view.position = dict(self.position)
+            view.spots = list(self.spots)
+            view.latitude = array('d', self.latitude)
+            view.longitude = array('d', self.longitude)
+            view.building_name = list(self.building_name)
+            view.intervals = list(self.intervals)
+            view.types = dict(self.types)
+            view.extended_info = dict(self.extended_info)
+            return view
+
+    def refresh(self):
+        """Brings the snapshot up to date with the database."""
+        with self.lock:
+            path = getattr(settings, 'SPOTSEEKER_SEARCH_SNAPSHOT_FILE', None)
+            if path and self._file_changed(path):
+                self._open(path)
+            elif not self.loaded:
+                self._reload()
+
+            if not self._update():
+                # Spots went without tombstones (e.g. a rolled back
+                # transaction), or too many positions are unused
+                self._rebuild(path)
+
+    def _file_changed(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return (stat.st_ino, stat.st_mtime, stat.st_size) != self.file_stat
+
+    def _open(self, path):
+        try:
+            base = SnapshotFile(path)
+        except ValueError:
+            # Written by an older version of the server
+            write_snapshot_file(path)
+            base = SnapshotFile(path)
+        stat = os.stat(path)
+        self.clear(base)
+        self.file_stat = (stat.st_ino, stat.st_mtime, stat.st_size)
+        self.loaded = True
+
+    def _rebuild(self, path):
+        """Starts again from the file, if there is one, or else from the
+        database. A file that is out of date in the same way is
+        rewritten first."""
+        if path and os.path.exists(path):
+            self._open(path)
+            if not self._update():
+                write_snapshot_file(path)
+                self._open(path)
+                self._update()
+        else:
+            self._reload()
+
+    def _reload(self):
+        """Loads every spot from the database, leaving out any file."""
+        self.clear()
+        self.last_deleted = SpotTombstone.objects.aggregate(last=Max('deleted'))['last']
+        self._load(Spot.objects.order_by('pk').values_list('pk', flat=True))
+        self.loaded = True
+
+    def _update(self):
+        """Applies the changes since the snapshot was last refreshed, and
+        returns whether it then holds as many spots as the database,
+        without too many unused positions."""
+        # Looking back by the sync overlap catches changes committed
+        # late by a transaction that stamped them earlier; the spots
+        # that haven't changed since are skipped by their etags
+        overlap = timedelta(seconds=getattr(settings, 'SPOTSEEKER_SYNC_OVERLAP', 60))
+        deleted = SpotTombstone.objects.all()
+        if self.last_deleted:
+            deleted = deleted.filter(deleted__gte=self.last_deleted - overlap)
+        for spot_id, when in deleted.values_list('spot_id', 'deleted'):
+            self._remove(spot_id)
+            self.last_deleted = max(self.last_deleted, when) if self.last_deleted else when
+
+        changed = Spot.objects.all()
+        if self.last_modified:
+            changed = changed.filter(last_modified__gte=self.last_modified - overlap)
+        self._load([spot_id for spot_id, etag in changed.values_list('pk', 'etag') if not self._current(spot_id, etag)])
+
+        count = Spot.objects.aggregate(count=Count('id'))['count']
+        return self.count == count and len(self.spots) <= 2 * self.count + 1000
+
+    def _position(self, spot_id):
+        if spot_id in self.position:
+            return self.position[spot_id]
+        if self.base:
+            i = self.base.position(spot_id)
+            if i is not None and self.alive & (1 << i):
+                return i
+        return None
+
+    def _spot(self, i):
+        if i < self.offset:
+            return self.base.spot(i)
+        return self.spots[i - self.offset]
+
+    def _current(self, spot_id, etag):
+        i = self._position(spot_id)
+        return i is not None and self._spot(i).etag == etag
+
+    def _remove(self, spot_id):
+        i = self._position(spot_id)
+        if i is None:
+            return
+        self.position.pop(spot_id, None)
+        mask = ~(1 << i)
+        self.alive &= mask
+        self.count -= 1
+        if i >= self.offset:
+            for index in (self.types, self.extended_info):
+                for key in index.keys():
+                    index[key] &= mask
+
+    def _load(self, spot_ids):
+        """(Re)loads the spots with the given ids."""
+        spot_ids = list(spot_ids)
+        for start in range(0, len(spot_ids), Spot.objects.JSON_BATCH_SIZE):
+            self._load_batch(spot_ids[start:start + Spot.objects.JSON_BATCH_SIZE])
+
+    def _load_batch(self, spot_ids):
+        rows = Spot.objects.filter(pk__in=spot_ids).order_by('pk').values_list(*(SnapshotSpot._fields + ('building_name',)))
+        loaded = []
+        for row in rows:
+            spot = SnapshotSpot._make(row[:-1])
+            self._remove(spot.pk)
+            i = self.offset + len(self.spots)
+            self.position[spot.pk] = i
+            self.spots.append(spot)
+            self.latitude.append(float('nan') if spot.latitude is None else float(spot.latitude))
+            self.longitude.append(float('nan') if spot.longitude is None else float(spot.longitude))
+            self.building_name.append(row[-1])
+            self.intervals.append([])
+            self.alive |= 1 << i
+            self.count += 1
+            if self.last_modified is None or spot.last_modified > self.last_modified:
+                self.last_modified = spot.last_modified
+            loaded.append(spot.pk)
+
+        spot_types = Spot.spottypes.through.objects.filter(spot__in=loaded)
+        for spot_id, name in spot_types.values_list('spot_id', 'spottype__name'):
+            self.types[name] = self.types.get(name, 0) | 1 << self.position[spot_id]
+
+        info = SpotExtendedInfo.objects.filter(spot__in=loaded)
+        for spot_id, key, value in info.values_list('spot_id', 'key', 'value'):
+            self.extended_info[(key, value)] = self.extended_info.get((key, value), 0) | 1 << self.position[spot_id]
+
+        open_intervals = SpotOpenInterval.objects.filter(spot__in=loaded)
+        for spot_id, start, end in open_intervals.values_list('spot_id', 'start', 'end'):
+            self.intervals[self.position[spot_id] - self.offset].append((start, end))
+
+    def _combine(self, base_bits, flags):
+        """Joins a bitset of the file's spots with flags for the spots
+        held in memory."""
+        return base_bits | (_bitset(flags) << self.offset)
+
+    def get(self, bits):
+        """The SnapshotSpots in a bitset, ordered by id."""
+        return sorted((self._spot(i) for i in positions(bits & self.alive)), key=lambda spot: spot.pk)
+
+    def types_of(self, spots):
+        """The names of the types of each spot, a dict keyed by spot id."""
+        types = dict((spot.pk, []) for spot in spots)
+        names = set(self.types)
+        if self.base:
+            names.update(self.base.types)
+        for name in names:
+            for i in positions(self.with_types([name]) & self.alive):
+                spot_id = self._spot(i).pk
+                if spot_id in types:
+                    types[spot_id].append(name)
+        return types
+
+    def with_types(self, names):
+        bits = 0
+        for name in names:
+            bits |= self.types.get(name, 0)
+            if self.base:
+                bits |= self.base.bitset(self.base.types.get(name))
+        return bits
+
+    def with_extended_info(self, key, values):
+        bits = 0
+        for value in values:
+            bits |= self.extended_info.get((key, value), 0)
+            if self.base:
+                bits |= self.base.bitset(self.base.extended_info.get((key, value)))
+        return bits
+
+    def with_building_names(self, names):
+        names = set(names)
+        base_bits = 0
+        if self.base:
+            codes = set(code for code, name in enumerate(self.base.buildings) if name in names)
+            base_bits = _bitset([code in codes for code in self.base.column('building')])
+        return self._combine(base_bits, [name in names for name in self.building_name])
+
+    def with_ids(self, spot_ids):
+        bits = 0
+        for spot_id in spot_ids:
+            i = self._position(spot_id)
+            if i is not None:
+                bits |= 1 << i
+        return bits
+
+    def with_capacity(self, minimum):
+        """Spots with at least minimum capacity, or no capacity given."""
+        base_bits = 0
+        if self.base:
+            base_bits = self.base.with_capacity(minimum)
+        return self._combine(base_bits, [spot.capacity is None or spot.capacity >= minimum for spot in self.spots])
+
+    def open_for(self, start, end):
+        """Spots open for the whole of a minute-of-week window."""
+        base_bits = 0
+        if self.base:
+            base_bits = self.base.open_for(start, end)
+        return self._combine(base_bits, [any(s <= start and e >= end for s, e in intervals) for intervals in self.intervals])
+
+    def in_box(self, south, west, north, east):
+        """Spots inside a latitude/longitude box, which crosses the
+        antimeridian if west > east."""
+        south, west, north, east = float(south), float(west), float(north), float(east)
+        if west > east:
+            in_longitude = lambda lon: lon >= west or lon <= east
+        else:
+            in_longitude = lambda lon: west <= lon <= east
+
+        base_bits = 0
+        if self.base:
+            base_bits = self.base.in_box(south, north, in_longitude)
+        return self._combine(base_bits, [south <= lat <= north and in_longitude(lon) for lat, lon in zip(self.latitude, self.longitude)])
+
+
+class SnapshotFile(object):
+    """ A snapshot written by write_snapshot_file, memory-mapped
+    read-only. After a JSON header with the type, building and extended
+    info names and the offsets of everything else, the spots are stored
+    a column at a time in id order, followed by their positions in
+    latitude order (those without a latitude last) and in capacity
+    order, the open intervals in order of their start, and a bitset for
+    each type and extended info value.
+    """
+    MAGIC = 'SPOTSNAP'
+    VERSION = 2
+    PREAMBLE = struct.Struct('<8sII')
+    COLUMNS = [
+        ('pk', 'q'),
+        ('latitude', 'd'),
+        ('longitude', 'd'),
+        ('capacity', 'q'),
+        ('building', 'I'),
+        ('etag', '40s'),
+        ('last_modified', 'd'),
+        ('by_latitude', 'I'),
+        ('by_capacity', 'I'),
+    ]
+    INTERVAL_COLUMNS = [('position', 'I'), ('start', 'i'), ('end', 'i')]
+    NO_CAPACITY = -2 ** 63
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_size = self.PREAMBLE.unpack_from(self.map, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError("%s is not a version %s spot search snapshot" % (path, self.VERSION))
+        header = json.loads(self.map[self.PREAMBLE.size:self.PREAMBLE.size + header_size])
+
+        self.count = header['count']
+        self.located_count = header['located_count']
+        self.interval_count = header['interval_count']
+        self.last_modified = parse_datetime(header['last_modified']) if header['last_modified'] else None
+        self.last_deleted = parse_datetime(header['last_deleted']) if header['last_deleted'] else None
+        self.buildings = header['buildings']
+        self.types = dict(header['types'])
+        self.extended_info = dict(((key, value), offset) for key, value, offset in header['extended_info'])
+        self.offsets = header['offsets']
+        self.bitset_size = header['bitset_size']
+        self.formats = dict(self.COLUMNS + self.INTERVAL_COLUMNS)
+        self.structs = dict((name, struct.Struct('<' + fmt)) for name, fmt in self.formats.items())
+
+    def column(self, name):
+        """Every value in a column, as a tuple."""
+        count = self.interval_count if name in dict(self.INTERVAL_COLUMNS) else self.count
+        return struct.unpack_from(_column_format(self.formats[name], count), self.map, self.offsets[name])
+
+    def value(self, name, i):
+        fmt = self.structs[name]
+        return fmt.unpack_from(self.map, self.offsets[name] + i * fmt.size)[0]
+
+    def values(self, name, start, stop):
+        """The values in a column from start up to stop, as a tuple."""
+        if stop <= start:
+            return ()
+        fmt = self.structs[name]
+        return struct.unpack_from(_column_format(self.formats[name], stop - start), self.map, self.offsets[name] + start * fmt.size)
+
+    def _bisect(self, order, name, value, high, right=False):
+        """The index of the first entry of order (a column of positions,
+        sorted by their values in column name), up to high, whose value
+        is not less than value (or, with right, greater than it)."""
+        low = 0
+        while low < high:
+            middle = (low + high) // 2
+            found = self.value(name, self.value(order, middle) if order else middle)
+            if found < value or (right and found == value):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def in_box(self, south, north, in_longitude):
+        """The bitset of the spots between south and north with a
+        longitude in_longitude accepts."""
+        start = self._bisect('by_latitude', 'latitude', south, self.located_count)
+        stop = self._bisect('by_latitude', 'latitude', north, self.located_count, right=True)
+        return _positions_bitset((i for i in self.values('by_latitude', start, stop) if in_longitude(self.value('longitude', i))), self.count)
+
+    def with_capacity(self, minimum):
+        """The bitset of the spots with at least minimum capacity, or no
+        capacity given."""
+        unknown = self._bisect('by_capacity', 'capacity', self.NO_CAPACITY, self.count, right=True)
+        start = max(unknown, self._bisect('by_capacity', 'capacity', minimum, self.count))
+        return _positions_bitset(self.values('by_capacity', 0, unknown) + self.values('by_capacity', start, self.count), self.count)
+
+    def open_for(self, start, end):
+        """The bitset of the spots open for the whole of a minute-of-week
+        window."""
+        stop = self._bisect(None, 'start', start, self.interval_count, right=True)
+        ends = self.values('end', 0, stop)
+        return _positions_bitset((i for i, e in zip(self.values('position', 0, stop), ends) if e >= end), self.count)
+
+    def bitset(self, offset):
+        if offset is None or not self.bitset_size:
+            return 0
+        return int(binascii.hexlify(self.map[offset:offset + self.bitset_size]), 16)
+
+    def position(self, spot_id):
+        """The position of a spot, by a binary search of the ids."""
+        low = self._bisect(None, 'pk', spot_id, self.count)
+        if low < self.count and self.value('pk', low) == spot_id:
+            return low
+        return None
+
+    def spot(self, i):
+        latitude = self.value('latitude', i)
+        longitude = self.value('longitude', i)
+        capacity = self.value('capacity', i)
+        return SnapshotSpot(
+            pk=self.value('pk', i),
+            latitude=None if latitude != latitude else Decimal("%.8f" % latitude),
+            longitude=None if longitude != longitude else Decimal("%.8f" % longitude),
+            capacity=None if capacity == self.NO_CAPACITY else capacity,
+            etag=self.value('etag', i).rstrip('\0'),
+            last_modified=_from_timestamp(self.value('last_modified', i)),
+        )
+
+
+def _column_format(fmt, count):
+    if fmt.endswith('s'):
+        # A count before s is the length of one string
+        return '<' + fmt * count
+    return '<%d%s' % (count, fmt)
+
+
+def _timestamp(value):
+    if timezone.is_aware(value):
+        seconds = calendar.timegm(value.utctimetuple())
+    else:
+        seconds = time.mktime(value.timetuple())
+    return seconds + value.microsecond / 1e6
+
+
+def _from_timestamp(value):
+    if settings.USE_TZ:
+        return datetime.utcfromtimestamp(value).replace(tzinfo=timezone.utc)
+    return datetime.fromtimestamp(value)
+
+
+def write_snapshot_file(path):
+    """ Writes a snapshot of every spot in the database to path, for
+    SnapshotFile. The new file replaces any old one with a rename, so
+    readers see either all of the old snapshot or all of the new one.
+    Returns the number of spots written.
+    """
+    snapshot = SpotSnapshot()
+    snapshot._reload()
+    spots = snapshot.spots
+    bitset_size = (len(spots) + 7) // 8
+
+    buildings = sorted(set(snapshot.building_name))
+    building_codes = dict((name, code) for code, name in enumerate(buildings))
+    intervals = sorted(((i, start, end) for i, spot_intervals in enumerate(snapshot.intervals) for start, end in spot_intervals), key=lambda interval: interval[1])
+    located = [i for i, latitude in enumerate(snapshot.latitude) if latitude == latitude]
+    unlocated = [i for i, latitude in enumerate(snapshot.latitude) if latitude != latitude]
+    capacities = [SnapshotFile.NO_CAPACITY if spot.capacity is None else spot.capacity for spot in spots]
+
+    columns = {
+        'pk': [spot.pk for spot in spots],
+        'latitude': list(snapshot.latitude),
+        'longitude': list(snapshot.longitude),
+        'capacity': capacities,
+        'building': [building_codes[name] for name in snapshot.building_name],
+        'etag': [str(spot.etag) for spot in spots],
+        'last_modified': [_timestamp(spot.last_modified) for spot in spots],
+        'by_latitude': sorted(located, key=lambda i: snapshot.latitude[i]) + unlocated,
+        'by_capacity': sorted(range(len(spots)), key=lambda i: capacities[i]),
+        'position': [interval[0] for interval in intervals],
+        'start': [interval[1] for interval in intervals],
+        'end': [interval[2] for interval in intervals],
+    }
+
+    blocks = []
+    for name, fmt in SnapshotFile.COLUMNS + SnapshotFile.INTERVAL_COLUMNS:
+        blocks.append((name, struct.pack(_column_format(fmt, len(columns[name])), *columns[name])))
+    for name, bits in sorted(snapshot.types.items()):
+        blocks.append((('type', name), _bitset_bytes(bits, bitset_size)))
+    for (key, value), bits in sorted(snapshot.extended_info.items()):
+        blocks.append((('extended_info', key, value), _bitset_bytes(bits, bitset_size)))
+
+    header = {
+        'count': len(spots),
+        'located_count': len(located),
+        'interval_count': len(intervals),
+        'last_modified': snapshot.last_modified.isoformat() if snapshot.last_modified else None,
+        'last_deleted': snapshot.last_deleted.isoformat() if snapshot.last_deleted else None,
+        'buildings': buildings,
+        'bitset_size': bitset_size,
+    }
+
+    # The offsets in the header depend on the size of the header, so
+    # pad it out until they fit
+    header_size = 0
+    while True:
+        offset = SnapshotFile.PREAMBLE.size + header_size
+        header.update(offsets={}, types=[], extended_info=[])
+        for name, data in blocks:
+            if isinstance(name, tuple) and name[0] == 'type':
+                header['types'].append([name[1], offset])
+            elif isinstance(name, tuple):
+                header['extended_info'].append([name[1], name[2], offset])
+            else:
+                header['offsets'][name] = offset
+            offset += len(data)
+
+        encoded = json.dumps(header)
+        if len(encoded) <= header_size:
+            break
+        header_size = len(encoded) + 64
+
+    temp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(SnapshotFile.PREAMBLE.pack(SnapshotFile.MAGIC, SnapshotFile.VERSION, header_size))
+        f.write(encoded.ljust(header_size))
+        for name, data in blocks:
+            f.write(data)
+    os.rename(temp_path, path)
+
+    return len(spots)
+
+
+def _bitset_bytes(bits, size):
+    if not size:
+        return ''
+    return binascii.unhexlify('%0*x' % (size * 2, bits))
+
+
+_snapshot = SpotSnapshot()
+
+
+def get_snapshot():
+    """The process's snapshot. Hold its lock while refreshing it, and
+    search a view() of it."""
+    return _snapshot
+
+
+def reset_snapshot():
+    """Forgets the process's snapshot, so the next search rebuilds it."""
+    with _snapshot.lock:
+        _snapshot.loaded = False
+        _snapshot.file_stat = None
+        _snapshot.clear()
@@ -0,0 +1,305 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from spotseeker_server.models import Spot, SpotType, SpotExtendedInfo, SpotManager
+from spotseeker_server.binary_encoding import MessagePack, CBOR
+from spotseeker_server.views import rest_dispatch
+from spotseeker_server import models
+from django.core import cache
+from mock import patch
+from contextlib import contextmanager
+from decimal import Decimal
+import simplejson as json
+import datetime
+import struct
+import zlib
+
+
+def decode_msgpack(data):
+    """ Decodes the MessagePack the server writes. """
+    def read(offset):
+        code = ord(data[offset])
+        if code < 0x80:
+            return code, offset + 1
+        if code >= 0xe0:
+            return code - 0x100, offset + 1
+        if 0x80 <= code < 0x90:
+            return read_map(code & 0x0f, offset + 1)
+        if 0x90 <= code < 0xa0:
+            return read_array(code & 0x0f, offset + 1)
+        if 0xa0 <= code < 0xc0:
+            return read_string(code & 0x1f, offset + 1)
+        constants = {0xc0: None, 0xc2: False, 0xc3: True}
+        if code in constants:
+            return constants[code], offset + 1
+        fmt = {0xcb: '>d', 0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q', 0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+               0xd9: '>B', 0xda: '>H', 0xdb: '>I', 0xdc: '>H', 0xdd: '>I', 0xde: '>H', 0xdf: '>I'}[code]
+        size = struct.calcsize(fmt)
+        value = struct.unpack(fmt, data[offset + 1:offset + 1 + size])[0]
+        offset += 1 + size
+        if code in (0xd9, 0xda, 0xdb):
+            return read_string(value, offset)
+        if code in (0xdc, 0xdd):
+            return read_array(value, offset)
+        if code in (0xde, 0xdf):
+            return read_map(value, offset)
+        return value, offset
+
+    def read_string(length, offset):
+        return data[offset:offset + length].decode('utf-8'), offset + length
+
+    def read_array(length, offset):
+        items = []
+        for i in range(length):
+            item, offset = read(offset)
+            items.append(item)
+        return items, offset
+
+    def read_map(length, offset):
+        items, offset = read_array(length * 2, offset)
+        return dict(zip(items[::2], items[1::2])), offset
+
+    value, offset = read(0)
+    assert offset == len(data)
+    return value
+
+
+def decode_cbor(data):
+    """ Decodes the CBOR the server writes. """
+    def read(offset):
+        major_type, argument = ord(data[offset]) >> 5, ord(data[offset]) & 0x1f
+        offset += 1
+        if major_type == 7:
+            if argument == 27:
+                return struct.unpack('>d', data[offset:offset + 8])[0], offset + 8
+            return {20: False, 21: True, 22: None}[argument], offset
+        if argument >= 24:
+            fmt = {24: '>B', 25: '>H', 26: '>I', 27: '>Q'}[argument]
+            size = struct.calcsize(fmt)
+            argument = struct.unpack(fmt, data[offset:offset + size])[0]
+            offset += size
+        if major_type == 0:
+            return argument, offset
+        if major_type == 1:
+            return -1 - argument, offset
+        if major_type == 3:
+            return data[offset:offset + argument].decode('utf-8'), offset + argument
+        items = []
+        for i in range(argument * 2 if major_type == 5 else argument):
+            item, offset = read(offset)
+            items.append(item)
+        if major_type == 5:
+            return dict(zip(items[::2], items[1::2])), offset
+        return items, offset
+
+    value, offset = read(0)
+    assert offset == len(data)
+    return value
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok',
+                   SPOTSEEKER_BINARY_RESPONSES=True)
+class BinaryResponseTest(TestCase):
+    """ Tests MessagePack and CBOR responses chosen by the Accept header.
+    """
+
+    def setUp(self):
+        self.cache = cache.get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        with self.patched_cache():
+            study = SpotType.objects.create(name="study_room")
+            self.spots = []
+            for i in range(3):
+                spot = Spot.objects.create(name=u"Binary spot \xe9 %s" % i, latitude=Decimal("47.655"), longitude=Decimal("-122.305"), capacity=10, building_name="Odegaard")
+                spot.spottypes.add(study)
+                SpotExtendedInfo.objects.create(spot=spot, key="has_whiteboards", value="true")
+                self.spots.append(spot)
+            self.url = "/api/v1/spot/%s" % self.spots[0].pk
+
+    @contextmanager
+    def patched_cache(self):
+        with patch.object(models, 'cache', self.cache), patch.object(rest_dispatch, 'cache', self.cache):
+            yield
+
+    def get(self, url, params=None, **headers):
+        with self.patched_cache():
+            response = Client().get(url, params or {}, **headers)
+            # The body may be streamed, so build it while the cache is patched
+            response.content = response.content
+            return response
+
+    def put(self, url, name, etag):
+        user, created = User.objects.get_or_create(username='demo_user')
+        client = Client()
+        client.login(username=user.username)
+        with self.patched_cache(), override_settings(SPOTSEEKER_AUTH_ADMINS=('demo_user',)):
+            return client.put(url, '{"name":"%s", "capacity":"10", "location": {"latitude": 55, "longitude": 30} }' % name, content_type="application/json", If_Match=etag)
+
+    def get_json(self, url, params=None):
+        response = self.get(url, params)
+        self.assertEquals(response['Content-Type'], 'application/json')
+        return json.loads(response.content)
+
+    def get_msgpack(self, url, params=None, **headers):
+        response = self.get(url, params, HTTP_ACCEPT='application/msgpack', **headers)
+        self.assertEquals(response['Content-Type'], 'application/msgpack')
+        return response
+
+    def test_msgpack_encoding(self):
+        msgpack = MessagePack()
+        self.assertEquals(msgpack.encode({'a': [1, -1, None, True, False, 1.5, u'\xe9']}), '\x81\xa1a\x97\x01\xff\xc0\xc3\xc2\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00\xa2\xc3\xa9')
+        self.assertEquals(msgpack.encode([200, -200, 70000, -70000, 2 ** 40]), '\x95\xcc\xc8\xd1\xff\x38\xce\x00\x01\x11\x70\xd2\xff\xfe\xee\x90\xcf\x00\x00\x01\x00\x00\x00\x00\x00')
+        self.assertEquals(msgpack.encode("x" * 40), '\xd9\x28' + "x" * 40)
+        self.assertEquals(msgpack.encode(range(16))[:3], '\xdc\x00\x10')
+        self.assertEquals(msgpack.encode(Decimal("47.655")), msgpack.encode(47.655))
+        self.assertEquals(msgpack.encode(datetime.date(2014, 3, 3)), msgpack.encode("2014-03-03"))
+        self.assertEquals(msgpack.array([msgpack.encode(1), msgpack.encode("a")]), msgpack.encode([1, "a"]))
+        self.assertRaises(TypeError, msgpack.encode, object())
+        self.assertRaises(ValueError, msgpack.encode, 2 ** 64)
+
+    def test_cbor_encoding(self):
+        cbor = CBOR()
+        self.assertEquals(cbor.encode({'a': [1, -1, None, True, False, 1.5, u'\xe9']}), '\xa1\x61a\x87\x01\x20\xf6\xf5\xf4\xfb\x3f\xf8\x00\x00\x00\x00\x00\x00\x62\xc3\xa9')
+        self.assertEquals(cbor.encode([24, -500, 70000]), '\x83\x18\x18\x39\x01\xf3\x1a\x00\x01\x11\x70')
+        self.assertEquals(cbor.encode("x" * 40), '\x78\x28' + "x" * 40)
+        self.assertEquals(cbor.array([cbor.encode(1), cbor.encode("a")]), cbor.encode([1, "a"]))
+
+    def test_negotiate(self):
+        view = rest_dispatch.RESTDispatch()
+
+        def accepted(accept):
+            request = type('Request', (), {'META': {'HTTP_ACCEPT': accept}})()
+            binary_format = view.accepted_format(request)
+            return binary_format and binary_format.name
+
+        self.assertEquals(accepted("application/msgpack"), 'msgpack')
+        self.assertEquals(accepted("application/x-msgpack"), 'msgpack')
+        self.assertEquals(accepted("application/cbor;q=0.5, */*;q=0.1"), 'cbor')
+        self.assertEquals(accepted("application/msgpack, application/json;q=0.9"), 'msgpack')
+        self.assertEquals(accepted("application/json, application/msgpack"), None, "JSON wins a tie")
+        self.assertEquals(accepted("application/*"), None)
+        self.assertEquals(accepted("*/*"), None)
+        self.assertEquals(accepted(""), None)
+        with override_settings(SPOTSEEKER_BINARY_RESPONSES=False):
+            self.assertEquals(accepted("application/msgpack"), None)
+
+    def test_spot(self):
+        plain = self.get(self.url)
+        response = self.get_msgpack(self.url)
+        self.assertEquals(decode_msgpack(response.content), json.loads(plain.content))
+        self.assertEquals(response['ETag'], "%s;msgpack" % plain['ETag'])
+        self.assertTrue('Accept' in response['Vary'])
+        self.assertTrue('Accept' in plain['Vary'])
+
+        response = self.get(self.url, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+
+        response = self.get(self.url, {'fields': 'id,name'}, HTTP_ACCEPT='application/cbor')
+        self.assertEquals(decode_cbor(response.content), {'id': self.spots[0].pk, 'name': u"Binary spot \xe9 0"})
+
+    def test_cached(self):
+        first = self.get_msgpack("/api/v1/spot/all")
+        self.assertEquals(decode_msgpack(first.content), self.get_json("/api/v1/spot/all"))
+
+        with patch.object(SpotManager, 'encoded_json_for') as encoded_json_for:
+            second = self.get_msgpack("/api/v1/spot/all")
+            self.assertFalse(encoded_json_for.called, "Uses the cached encodings")
+        self.assertEquals(second.content, first.content)
+
+        with self.patched_cache():
+            self.spots[1].name = "Changed"
+            self.spots[1].save()
+        spots = decode_msgpack(self.get_msgpack("/api/v1/spot/all").content)
+        self.assertEquals(spots[1]['name'], "Changed")
+
+    def test_refilled_before_commit(self):
+        spot = self.spots[0]
+        old = self.get_msgpack(self.url).content
+        etag = Spot.objects.get(pk=spot.pk).etag
+        with self.patched_cache():
+            key = models.spot_binary_cache_key(spot.pk, 'msgpack')
+
+        changes_committed = Spot.changes_committed
+
+        def refilled(spot, *args, **kwargs):
+            # A reader between the save and the commit caches the old
+            # encoding again
+            self.cache.set(key, old)
+            return changes_committed(spot, *args, **kwargs)
+
+        with patch.object(Spot, 'changes_committed', refilled):
+            self.assertEquals(self.put(self.url, "Committed", etag).status_code, 200)
+        self.assertEquals(decode_msgpack(self.get_msgpack(self.url).content)['name'], "Committed")
+
+    def test_lists(self):
+        params = {'type': 'study_room'}
+        response = self.get("/api/v1/spot", params, HTTP_ACCEPT='application/cbor')
+        self.assertEquals(response['Content-Type'], 'application/cbor')
+        self.assertEquals(decode_cbor(response.content), self.get_json("/api/v1/spot", params))
+
+        for url, params in (("/api/v2/spot", params),
+                            ("/api/v1/spot", {'type': 'study_room', 'format': 'compact'}),
+                            ("/api/v1/spot/all", {'page_size': 2}),
+                            ("/api/v1/spot/all", {'modified_since': '2000-01-01T00:00:00'})):
+            response = self.get_msgpack(url, params)
+            data = decode_msgpack(response.content)
+            if 'sync_token' in data:
+                del data['sync_token']
+            expected = self.get_json(url, params)
+            if 'sync_token' in expected:
+                del expected['sync_token']
+            self.assertEquals(data, expected, url)
+
+    def test_errors(self):
+        response = self.get_msgpack("/api/v1/spot/%s" % (self.spots[-1].pk + 100))
+        self.assertEquals(response.status_code, 404)
+        self.assertTrue('error' in decode_msgpack(response.content))
+
+    @override_settings(SPOTSEEKER_COMPRESS_RESPONSES=True)
+    def test_compressed(self):
+        plain = self.get(self.url)
+        with patch.object(rest_dispatch, 'brotli', None):
+            first = self.get_msgpack(self.url, HTTP_ACCEPT_ENCODING='gzip')
+            with patch.object(SpotManager, 'encoded_binary_for') as encoded_binary_for:
+                second = self.get_msgpack(self.url, HTTP_ACCEPT_ENCODING='gzip')
+                self.assertFalse(encoded_binary_for.called, "Uses the cached compressed body")
+
+        self.assertEquals(second.content, first.content)
+        self.assertEquals(second['Content-Encoding'], 'gzip')
+        self.assertEquals(second['ETag'], "%s;msgpack;gzip" % plain['ETag'])
+        self.assertEquals(decode_msgpack(zlib.decompress(second.content, 16 + zlib.MAX_WBITS)), json.loads(plain.content))
+
+    @override_settings(SPOTSEEKER_COMPRESS_RESPONSES=True)
+    def test_etag_round_trip(self):
+        for name, headers in (("msgpack", {}), ("msgpack;gzip", {'HTTP_ACCEPT_ENCODING': 'gzip'})):
+            with patch.object(rest_dispatch, 'brotli', None):
+                response = self.get_msgpack(self.url, **headers)
+                etag = response['ETag']
+                self.assertEquals(etag, "%s;%s" % (Spot.objects.get(pk=self.spots[0].pk).etag, name))
+
+                response = self.get(self.url, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=etag, **headers)
+                self.assertEquals(response.status_code, 304)
+                self.assertEquals(response['ETag'], etag, "A 304 has the same ETag as the full response")
+
+            response = self.put(self.url, "Put %s" % name, etag)
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(Spot.objects.get(pk=self.spots[0].pk).name, "Put %s" % name)
+
+            response = self.put(self.url, "Put again", etag)
+            self.assertEquals(response.status_code, 409)
@@ -19,10 +19,18 @@ from django.test.client import Client
 from spotseeker_server.models import Spot
 import simplejson as json
 import random
+import time
 from django.test.utils import override_settings
 from mock import patch
 from django.core import cache
+from django.db import DatabaseError
 from spotseeker_server import models
+from spotseeker_server.views import rest_dispatch
+from os.path import abspath, dirname
+import shutil
+import tempfile
+
+TEST_ROOT = abspath(dirname(__file__))
 
 
 @override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok',
@@ -39,16 +47,17 @@ class JsonCachingTest(TestCase):
         spot1.save()
         self.spot1 = spot1
         self.url1 = '/api/v1/spot/{0}'.format(self.spot1.pk)
+        self.TEMP_DIR = tempfile.mkdtemp()
 
     def test_get_spot(self):
         """tests if spot jsons are cached on the server when a client requests them
         """
         with patch.object(models, 'cache', self.cache):
-            self.assertIsNone(self.cache.get(self.spot1.pk))
+            self.assertIsNone(self.cache.get(models.spot_cache_key(self.spot1.pk)))
             client = Client()
             response = client.get(self.url1)
-            self.assertIsNotNone(self.cache.get(self.spot1.pk))
-            cache1 = models.cache.get(self.spot1.pk)
+            self.assertIsNotNone(self.cache.get(models.spot_cache_key(self.spot1.pk)))
+            cache1 = json.loads(models.cache.get(models.spot_cache_key(self.spot1.pk)))
             self.assertEqual(cache1['name'], self.spot1.name)  # verify proper cached content
 
     def test_put_spot(self):
@@ -57,16 +66,45 @@ class JsonCachingTest(TestCase):
         with patch.object(models, 'cache', self.cache):
             client = Client()
             self.cache.clear()
-            self.assertIsNone(self.cache.get(self.spot1.pk))  # cache should be emptied
+            self.assertIsNone(self.cache.get(models.spot_cache_key(self.spot1.pk)))  # cache should be emptied
             response = client.get(self.url1)
             etag = response['ETag']
             response1 = client.put(self.url1, '{"name":"whoop whoop changed number 1", "latitude": 0, "longitude": 0}', content_type="application/json", If_Match=etag, Foo='Bar')
-            # cache should be empty or current
-            cache1 = self.cache.get(self.spot1.pk)
-            if cache1 is not None:
-                self.assertEqual(cache1['name'], 'whoop whoop changed number 1', "Cache is up to date")
-            else:
-                self.assertIsNone(cache1, "Cache is empty")
+            # cache should be written through with the new values
+            cache1 = self.cache.get(models.spot_cache_key(self.spot1.pk))
+            self.assertIsNotNone(cache1, "Cache is refreshed")
+            self.assertEqual(json.loads(cache1)['name'], 'whoop whoop changed number 1', "Cache is up to date")
+            self.assertEqual(cache1, response1.content)
+
+    def test_post_spot(self):
+        """tests that new spots are cached when they are created through the api
+        """
+        with patch.object(models, 'cache', self.cache):
+            client = Client()
+            response = client.post('/api/v1/spot/', '{"name":"This is for testing cache number 2", "latitude": 0, "longitude": 0}', content_type="application/json")
+            self.assertEquals(response.status_code, 201)
+
+            spot_id = int(response['Location'].rstrip('/').split('/')[-1])
+            cache1 = self.cache.get(models.spot_cache_key(spot_id))
+            self.assertIsNotNone(cache1, "New spot is cached")
+            self.assertEqual(json.loads(cache1)['name'], "This is for testing cache number 2")
+
+    def test_post_image(self):
+        """tests that adding an image refreshes the cached spot
+        """
+        with patch.object(models, 'cache', self.cache):
+            with self.settings(MEDIA_ROOT=self.TEMP_DIR):
+                client = Client()
+                client.get(self.url1)
+
+                f = open("%s/resources/test_png.png" % TEST_ROOT)
+                response = client.post(self.url1 + '/image', {"description": "This is a png", "image": f})
+                f.close()
+                self.assertEquals(response.status_code, 201)
+
+                cache1 = self.cache.get(models.spot_cache_key(self.spot1.pk))
+                self.assertIsNotNone(cache1, "Cache is refreshed")
+                self.assertEqual(len(json.loads(cache1)['images']), 1, "Cache has the new image")
 
     def test_delete_spot(self):
         """tests deleting spots through the api
@@ -77,7 +115,7 @@ class JsonCachingTest(TestCase):
             response = client.get(self.url1)
             etag = response["ETag"]
             the_pk = self.spot1.pk
-            self.assertIsNotNone(self.cache.get(the_pk))  # cached object should be there
+            self.assertIsNotNone(self.cache.get(models.spot_cache_key(the_pk)))  # cached object should be there
             response = client.delete(self.url1, If_Match=etag)
             self.assertEquals(response.status_code, 200, "Gives a GONE in response to a valid delete")
 
@@ -87,7 +125,7 @@ class JsonCachingTest(TestCase):
                 test_spot = None
 
             self.assertIsNone(test_spot, "Can't objects.get a deleted spot")
-            self.assertIsNone(self.cache.get(the_pk))  # shouldn't be cached because its object is deleted
+            self.assertIsNone(self.cache.get(models.spot_cache_key(the_pk)))  # shouldn't be cached because its object is deleted
 
     def test_delete_spot_directly(self):
         """tests deleting spots through the admin
@@ -97,9 +135,9 @@ class JsonCachingTest(TestCase):
             self.cache.clear()
             response = client.get(self.url1)
             the_pk = self.spot1.pk
-            self.assertIsNotNone(self.cache.get(the_pk))  # cached object should be there
+            self.assertIsNotNone(self.cache.get(models.spot_cache_key(the_pk)))  # cached object should be there
             self.spot1.delete()
-            self.assertIsNone(self.cache.get(the_pk))  # shouldn't be there
+            self.assertIsNone(self.cache.get(models.spot_cache_key(the_pk)))  # shouldn't be there
 
     def test_modify_spot(self):
         """tests modifying spots through the admin
@@ -107,12 +145,12 @@ class JsonCachingTest(TestCase):
         with patch.object(models, 'cache', self.cache):
             client = Client()
             self.cache.clear()
-            self.assertIsNone(self.cache.get(self.spot1.pk))  # cache should be emptied
+            self.assertIsNone(self.cache.get(models.spot_cache_key(self.spot1.pk)))  # cache should be emptied
             json = self.spot1.json_data_structure()
-            self.assertIsNotNone(self.cache.get(self.spot1.pk))
+            self.assertIsNotNone(self.cache.get(models.spot_cache_key(self.spot1.pk)))
             self.spot1.name = "All-Blacks Haka War Dance"
             self.spot1.save()
-            self.assertIsNone(self.cache.get(self.spot1.pk))  # cache should be emptied of saved spot
+            self.assertIsNone(self.cache.get(models.spot_cache_key(self.spot1.pk)))  # cache should be emptied of saved spot
 
     def test_spot_json_data_structure_cache(self):
         """tests that the caching happens in the json_data_structure model method
@@ -120,9 +158,181 @@ class JsonCachingTest(TestCase):
         with patch.object(models, 'cache', self.cache):
             client = Client()
             self.cache.clear()
-            self.assertIsNone(self.cache.get(self.spot1.pk))
+            self.assertIsNone(self.cache.get(models.spot_cache_key(self.spot1.pk)))
             json = self.spot1.json_data_structure()
-            self.assertIsNotNone(self.cache.get(self.spot1.pk))
+            self.assertIsNotNone(self.cache.get(models.spot_cache_key(self.spot1.pk)))
+
+    def test_json_for_multi_get(self):
+        """tests that the bulk serializer reads the cache once and reports hits and misses
+        """
+        with patch.object(models, 'cache', self.cache):
+            spot2 = Spot.objects.create(name="This is for testing cache number 2", latitude="0", longitude="0")
+            spots = [self.spot1, spot2]
+
+            stats = {}
+            Spot.objects.json_for(spots, stats=stats)
+            self.assertEqual((stats['hits'], stats['misses'], stats['rebuilds']), (0, 2, 2))
+            self.assertIsNotNone(self.cache.get(models.spot_cache_key(spot2.pk)))
+
+            with patch.object(self.cache, 'get_many', wraps=self.cache.get_many) as get_many:
+                stats = {}
+                spots_json = Spot.objects.json_for(spots, stats=stats)
+            self.assertEqual(get_many.call_count, 1)
+            self.assertEqual((stats['hits'], stats['misses'], stats['rebuilds']), (2, 0, 0))
+            self.assertEqual([s['id'] for s in spots_json], [self.spot1.pk, spot2.pk])
+
+    def test_all_spots_encoded_fragments(self):
+        """tests that warm list responses are spliced from the cached JSON without re-encoding
+        """
+        with patch.object(models, 'cache', self.cache):
+            client = Client()
+            spot2 = Spot.objects.create(name="This is for testing cache number 2", latitude="0", longitude="0")
+            cold = client.get('/api/v1/spot/all').content
+
+            with patch.object(rest_dispatch.json, 'dumps', side_effect=AssertionError("re-encoded")):
+                warm = client.get('/api/v1/spot/all').content
+            self.assertEqual(warm, cold)
+            self.assertEqual(warm, '[' + ', '.join([self.cache.get(models.spot_cache_key(self.spot1.pk)), self.cache.get(models.spot_cache_key(spot2.pk))]) + ']')
+
+    def test_cache_key_namespace(self):
+        """tests that spot cache keys are prefixed and versioned, not the bare primary key
+        """
+        with patch.object(models, 'cache', self.cache):
+            self.spot1.json_data_structure()
+            self.assertIsNone(self.cache.get(self.spot1.pk))
+
+            key = models.spot_cache_key(self.spot1.pk)
+            self.assertTrue(key.startswith('spotseeker:spot:v%d:' % models.SPOT_CACHE_VERSION))
+            self.assertTrue(key.endswith(':%s' % self.spot1.pk))
+
+    def test_bump_generation(self):
+        """tests that bumping the generation invalidates every cached spot
+        """
+        with patch.object(models, 'cache', self.cache):
+            spot2 = Spot.objects.create(name="This is for testing cache number 2", latitude="0", longitude="0")
+            Spot.objects.json_for([self.spot1, spot2])
+            self.assertIsNotNone(self.cache.get(models.spot_cache_key(self.spot1.pk)))
+            self.assertIsNotNone(self.cache.get(models.spot_cache_key(spot2.pk)))
+
+            old_generation = models.spot_cache_generation()
+            models.bump_spot_cache_generation()
+            self.assertNotEqual(models.spot_cache_generation(), old_generation)
+
+            self.assertIsNone(self.cache.get(models.spot_cache_key(self.spot1.pk)))
+            self.assertIsNone(self.cache.get(models.spot_cache_key(spot2.pk)))
+
+            stats = {}
+            Spot.objects.json_for([self.spot1, spot2], stats=stats)
+            self.assertEqual((stats['hits'], stats['misses'], stats['rebuilds']), (0, 2, 2))
+
+    def test_process_stats(self):
+        """tests that the cache counts are added up for the process
+        """
+        with patch.object(models, 'cache', self.cache):
+            before = models.spot_cache_stats()
+            Spot.objects.json_for([self.spot1])
+            Spot.objects.json_for([self.spot1])
+            after = models.spot_cache_stats()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['rebuilds'] - before['rebuilds'], 1)
+
+    def test_lost_generation(self):
+        """tests that generations outlive the default cache timeout, and
+        that a lost one restarts past every generation used before
+        """
+        with patch.object(models, 'cache', self.cache):
+            models.search_cache_generation()
+            key = self.cache.make_key(models._search_cache_generation_key())
+            self.assertTrue(self.cache._expire_info[key] > time.time() + 30 * 24 * 60 * 60)
+
+            for i in range(1000):
+                bumped = models.bump_search_cache_generation()
+            self.cache.delete(models._search_cache_generation_key())
+            self.assertTrue(models.search_cache_generation() > bumped)
 
     def tearDown(self):
         self.cache.clear()
+        shutil.rmtree(self.TEMP_DIR)
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok',
+                   SPOTSEEKER_SPOT_FORM='spotseeker_server.default_forms.spot.DefaultSpotForm',
+                   SPOTSEEKER_SPOT_CACHE_SINGLE_FLIGHT=True)
+class SingleFlightCachingTest(TestCase):
+    """Tests the single-flight and stale-while-revalidate cache mode
+    """
+
+    def setUp(self):
+        self.cache = cache.get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        with patch.object(models, 'cache', self.cache):
+            self.spot = Spot.objects.create(name="Single flight spot", latitude="0", longitude="0")
+
+    def _lock_key(self):
+        return models.spot_cache_key(self.spot.pk) + ':lock'
+
+    def test_rebuild_releases_lock(self):
+        with patch.object(models, 'cache', self.cache):
+            stats = {}
+            Spot.objects.json_for([self.spot], stats=stats)
+            self.assertEqual((stats['rebuilds'], stats['stale']), (1, 0))
+            self.assertIsNone(self.cache.get(self._lock_key()))
+            self.assertIsNotNone(self.cache.get(models.spot_stale_cache_key(self.spot.pk)))
+
+    def test_serves_stale_while_locked(self):
+        with patch.object(models, 'cache', self.cache):
+            self.spot.json_data_structure()
+            self.spot.name = "Single flight spot, renamed"
+            self.spot.save()
+
+            self.cache.add(self._lock_key(), 1)
+            stats = {}
+            spot_json = Spot.objects.json_for([self.spot], stats=stats)[0]
+            self.assertEqual(spot_json['name'], "Single flight spot")
+            self.assertEqual((stats['rebuilds'], stats['stale']), (0, 1))
+
+            self.cache.delete(self._lock_key())
+            self.assertEqual(self.spot.json_data_structure()['name'], "Single flight spot, renamed")
+
+    def test_waits_without_stale(self):
+        with patch.object(models, 'cache', self.cache):
+            self.cache.add(self._lock_key(), 1)
+            with patch.object(Spot.objects, 'REBUILD_WAIT_INTERVAL', 0):
+                stats = {}
+                spot_json = Spot.objects.json_for([self.spot], stats=stats)[0]
+            self.assertEqual(spot_json['name'], "Single flight spot")
+            self.assertEqual(stats['rebuilds'], 1)
+
+    def test_bulk_misses(self):
+        with patch.object(models, 'cache', self.cache):
+            other = Spot.objects.create(name="Another single flight spot", latitude="0", longitude="0")
+            Spot.objects.json_for([self.spot, other])
+            self.spot.name = "Single flight spot, renamed"
+            self.spot.save()
+            other.name = "Another single flight spot, renamed"
+            other.save()
+
+            self.cache.add(self._lock_key(), 1)
+            stats = {}
+            spots = Spot.objects.json_for([self.spot, other], stats=stats)
+            self.assertEqual([spot_json['name'] for spot_json in spots], ["Single flight spot", "Another single flight spot, renamed"])
+            self.assertEqual((stats['misses'], stats['rebuilds'], stats['stale']), (2, 1, 1))
+            self.assertIsNotNone(self.cache.get(self._lock_key()), "Leaves the other request's lock")
+            self.assertIsNone(self.cache.get(models.spot_cache_key(other.pk) + ':lock'))
+
+    def test_serves_stale_on_database_error(self):
+        with patch.object(models, 'cache', self.cache):
+            self.spot.json_data_structure()
+            self.cache.delete(models.spot_cache_key(self.spot.pk))
+
+            with patch.object(Spot.objects, '_build_json', side_effect=DatabaseError("down")):
+                stats = {}
+                spot_json = Spot.objects.json_for([self.spot], stats=stats)[0]
+            self.assertEqual(spot_json['name'], "Single flight spot")
+            self.assertEqual(stats['stale'], 1)
+            self.assertIsNone(self.cache.get(self._lock_key()))
+
+            spot_id = self.spot.pk
+            self.spot.delete()
+            self.assertIsNone(self.cache.get(models.spot_stale_cache_key(spot_id)))
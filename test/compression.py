@@ -0,0 +1,172 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from spotseeker_server.models import Spot, SpotType, SpotExtendedInfo, SpotManager
+from spotseeker_server.views import rest_dispatch
+from spotseeker_server import models
+from django.core import cache
+from mock import patch, Mock
+from contextlib import contextmanager
+from decimal import Decimal
+import simplejson as json
+import zlib
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok',
+                   SPOTSEEKER_COMPRESS_RESPONSES=True)
+class ResponseCompressionTest(TestCase):
+    """ Tests compressing responses by their Accept-Encoding.
+    """
+
+    def setUp(self):
+        self.cache = cache.get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        with self.patched_cache():
+            study = SpotType.objects.create(name="study_room")
+            self.spots = []
+            for i in range(5):
+                spot = Spot.objects.create(name="Compressed spot %s" % i, latitude=Decimal("47.655"), longitude=Decimal("-122.305"), capacity=10, building_name="Odegaard")
+                spot.spottypes.add(study)
+                SpotExtendedInfo.objects.create(spot=spot, key="has_whiteboards", value="true")
+                self.spots.append(spot)
+            self.url = "/api/v1/spot/%s" % self.spots[0].pk
+
+    @contextmanager
+    def patched_cache(self):
+        with patch.object(models, 'cache', self.cache), patch.object(rest_dispatch, 'cache', self.cache), patch.object(rest_dispatch, 'brotli', None):
+            yield
+
+    def get(self, url, params=None, **headers):
+        with self.patched_cache():
+            response = Client().get(url, params or {}, **headers)
+            # The body may be streamed, so build it while the cache is patched
+            response.content = response.content
+            return response
+
+    def put(self, url, name, etag):
+        user, created = User.objects.get_or_create(username='demo_user')
+        client = Client()
+        client.login(username=user.username)
+        with self.patched_cache(), override_settings(SPOTSEEKER_AUTH_ADMINS=('demo_user',)):
+            return client.put(url, '{"name":"%s", "capacity":"10", "location": {"latitude": 55, "longitude": 30} }' % name, content_type="application/json", If_Match=etag)
+
+    def gunzip(self, response):
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        return json.loads(zlib.decompress(response.content, 16 + zlib.MAX_WBITS))
+
+    def test_negotiate(self):
+        view = rest_dispatch.RESTDispatch()
+
+        def encoding(accept_encoding):
+            request = type('Request', (), {'META': {'HTTP_ACCEPT_ENCODING': accept_encoding}})()
+            return view.accepted_encoding(request)
+
+        with patch.object(rest_dispatch, 'brotli', None):
+            self.assertEquals(encoding("gzip, deflate"), 'gzip')
+            self.assertEquals(encoding("GZIP;q=0.5"), 'gzip')
+            self.assertEquals(encoding("*"), 'gzip')
+            self.assertEquals(encoding("gzip;q=0"), None)
+            self.assertEquals(encoding("br, deflate"), None)
+            self.assertEquals(encoding(""), None)
+
+        # Only the module's presence matters to choosing br
+        with patch.object(rest_dispatch, 'brotli', Mock()):
+            self.assertEquals(encoding("gzip, deflate, br"), 'br')
+            self.assertEquals(encoding("gzip, br;q=0.5"), 'gzip')
+
+        with override_settings(SPOTSEEKER_COMPRESS_RESPONSES=False):
+            self.assertEquals(encoding("gzip"), None)
+
+    def test_uncompressed(self):
+        response = self.get(self.url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEquals(json.loads(response.content)['id'], self.spots[0].pk)
+
+        with override_settings(SPOTSEEKER_COMPRESS_RESPONSES=False):
+            response = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_spot(self):
+        plain = self.get(self.url)
+        response = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(self.gunzip(response), json.loads(plain.content))
+        self.assertEquals(response['ETag'], "%s;gzip" % plain['ETag'])
+        self.assertTrue('Accept-Encoding' in response['Vary'])
+        self.assertEquals(int(response['Content-Length']), len(response.content))
+
+        response = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH='"%s"' % response['ETag'])
+        self.assertEquals(response.status_code, 304)
+
+    def test_cached(self):
+        first = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        with patch.object(Spot, 'encoded_json_data_structure') as encoded_json:
+            second = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertFalse(encoded_json.called, "Uses the cached compressed body")
+        self.assertEquals(second.content, first.content)
+
+        with self.patched_cache():
+            self.spots[0].name = "Changed"
+            self.spots[0].save()
+        response = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(self.gunzip(response)['name'], "Changed")
+
+    def test_all(self):
+        plain = self.get("/api/v1/spot/all")
+        response = self.get("/api/v1/spot/all", HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(self.gunzip(response), json.loads(plain.content))
+
+        with patch.object(SpotManager, 'iter_encoded_json') as iter_encoded_json:
+            cached = self.get("/api/v1/spot/all", HTTP_ACCEPT_ENCODING='gzip')
+            self.assertFalse(iter_encoded_json.called, "Uses the cached compressed body")
+        self.assertEquals(cached.content, response.content)
+
+    def test_streamed(self):
+        plain = self.get("/api/v2/spot", {'type': 'study_room'})
+        response = self.get("/api/v2/spot", {'type': 'study_room'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(self.gunzip(response), json.loads(plain.content))
+        self.assertFalse(response.has_header('Content-Length'))
+
+    def test_small(self):
+        response = self.get("/api/v1/spot", {'type': 'lounge'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEquals(json.loads(response.content), [])
+
+    def test_etag_round_trip(self):
+        response = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        etag = response['ETag']
+        self.assertEquals(etag, "%s;gzip" % self.spots[0].etag)
+
+        response = self.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH='"%s"' % etag)
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response['ETag'], etag, "A 304 has the same ETag as the full response")
+
+        response = self.put(self.url, "Put spot", etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(Spot.objects.get(pk=self.spots[0].pk).name, "Put spot")
+
+        response = self.put(self.url, "Put again", etag)
+        self.assertEquals(response.status_code, 409, "The old ETag is out of date, whatever its encoding")
+
+    def test_small_etag(self):
+        plain = self.get("/api/v1/spot", {'type': 'lounge'})
+        response = self.get("/api/v1/spot", {'type': 'lounge'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(response['ETag'], "%s;gzip" % plain['ETag'])
+        response = self.get("/api/v1/spot", {'type': 'lounge'}, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response['ETag'], "%s;gzip" % plain['ETag'])
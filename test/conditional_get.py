@@ -0,0 +1,132 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from django.utils.http import http_date
+from spotseeker_server.models import Spot, SpotExtendedInfo, SpotTombstone
+from django.utils import timezone
+from datetime import timedelta
+from mock import patch
+from django.core import cache
+from spotseeker_server import models
+import time
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok',
+                   SPOTSEEKER_SPOT_FORM='spotseeker_server.default_forms.spot.DefaultSpotForm')
+class SpotConditionalGETTest(TestCase):
+    """ Tests If-None-Match and If-Modified-Since on spot, list and
+    search GETs.
+    """
+
+    def setUp(self):
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.spot = Spot.objects.create(name="Conditional GET", latitude=55, longitude=30)
+            self.spot2 = Spot.objects.create(name="Conditional GET 2", latitude=55, longitude=30)
+            self.url = "/api/v1/spot/%s" % self.spot.pk
+
+    def test_spot_if_none_match(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            c = Client()
+            response = c.get(self.url)
+            etag = response["ETag"]
+            self.assertEquals(etag, self.spot.etag)
+
+            response = c.get(self.url, HTTP_IF_NONE_MATCH='"%s"' % etag)
+            self.assertEquals(response.status_code, 304)
+            self.assertEquals(response.content, "")
+            self.assertEquals(response["ETag"], etag)
+
+            response = c.get(self.url, HTTP_IF_NONE_MATCH='"not-the-etag"')
+            self.assertEquals(response.status_code, 200)
+
+            SpotExtendedInfo.objects.create(spot=self.spot, key="has_outlets", value="true")
+            response = c.get(self.url, HTTP_IF_NONE_MATCH='"%s"' % etag)
+            self.assertEquals(response.status_code, 200, "Changed spots are sent again")
+            self.assertNotEquals(response["ETag"], etag)
+
+    def test_spot_if_modified_since(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            c = Client()
+            response = c.get(self.url)
+            last_modified = response["Last-Modified"]
+
+            response = c.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEquals(response.status_code, 304)
+
+            response = c.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() - 60 * 60 * 24))
+            self.assertEquals(response.status_code, 200)
+
+    def test_all_spots(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            c = Client()
+            response = c.get("/api/v1/spot/all")
+            etag = response["ETag"]
+
+            response = c.get("/api/v1/spot/all", HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(response.status_code, 304)
+
+            Spot.objects.create(name="Conditional GET 3", latitude=55, longitude=30)
+            response = c.get("/api/v1/spot/all", HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(response.status_code, 200, "New spots change the list etag")
+            etag = response["ETag"]
+
+            Spot.objects.get(name="Conditional GET 3").delete()
+            response = c.get("/api/v1/spot/all", HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(response.status_code, 200, "Deleted spots change the list etag")
+
+    def test_all_spots_if_modified_since(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            c = Client()
+            last_modified = c.get("/api/v1/spot/all")["Last-Modified"]
+            response = c.get("/api/v1/spot/all", HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEquals(response.status_code, 304)
+
+            self.spot2.delete()
+            # Last-Modified only has whole seconds
+            SpotTombstone.objects.update(deleted=timezone.now() + timedelta(seconds=2))
+            response = c.get("/api/v1/spot/all", HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEquals(response.status_code, 200, "Deleted spots change the list's Last-Modified")
+
+    def test_collections_without_last_modified(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            c = Client()
+            url = "/api/v1/spot?id=%s&id=%s" % (self.spot.pk, self.spot2.pk)
+            response = c.get(url)
+            self.assertFalse(response.has_header("Last-Modified"), "Removing a member wouldn't change it")
+
+            response = c.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+            self.assertEquals(response.status_code, 200)
+
+            response = c.get("/api/v1/spot/all", {'page_size': 1})
+            self.assertFalse(response.has_header("Last-Modified"))
+
+    def test_search(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            c = Client()
+            url = "/api/v1/spot?id=%s&id=%s" % (self.spot.pk, self.spot2.pk)
+            response = c.get(url)
+            etag = response["ETag"]
+
+            response = c.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(response.status_code, 304)
+
+            self.spot2.name = "Conditional GET 2, renamed"
+            self.spot2.save()
+            response = c.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(response.status_code, 200, "Changed members change the search etag")
@@ -0,0 +1,114 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from spotseeker_server.models import Spot, SpotAvailableHours, SpotOpenInterval
+from spotseeker_server import opening_hours
+from spotseeker_server.opening_hours import MINUTES_PER_DAY, MINUTES_PER_WEEK
+import simplejson as json
+from datetime import time
+from django.test.utils import override_settings
+from mock import patch
+from django.core import cache
+from spotseeker_server import models
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class SpotOpenIntervalTest(TestCase):
+    """ Tests the minute-of-week open intervals kept for the available hours.
+    """
+
+    def test_intervals(self):
+        intervals = opening_hours.intervals([
+            ('m', time(9, 30), time(23, 59, 59)),
+            ('t', time(0, 0), time(14, 0)),
+            ('w', time(8, 0), time(17, 0)),
+        ])
+        self.assertEquals(intervals, [
+            (MINUTES_PER_DAY + 9 * 60 + 30, 2 * MINUTES_PER_DAY + 14 * 60),
+            (3 * MINUTES_PER_DAY + 8 * 60, 3 * MINUTES_PER_DAY + 17 * 60),
+        ], "Monday night and Tuesday morning join")
+
+    def test_intervals_over_the_weekend(self):
+        intervals = opening_hours.intervals([
+            ('sa', time(20, 0), time(23, 59)),
+            ('su', time(0, 0), time(2, 0)),
+        ])
+        start = 6 * MINUTES_PER_DAY + 20 * 60
+        end = MINUTES_PER_WEEK + 2 * 60
+        self.assertEquals(intervals, [(start, end), (start - MINUTES_PER_WEEK, end - MINUTES_PER_WEEK)])
+
+    def test_open_all_week(self):
+        hours = [(day, time(0, 0), time(23, 59)) for day in ['su', 'm', 't', 'w', 'th', 'f', 'sa']]
+        self.assertEquals(opening_hours.intervals(hours), [(-MINUTES_PER_WEEK, 2 * MINUTES_PER_WEEK)])
+
+    def test_window(self):
+        self.assertEquals(opening_hours.window('m', "10:00"), (MINUTES_PER_DAY + 600, MINUTES_PER_DAY + 601))
+        self.assertEquals(opening_hours.window('sa', "22:00", 'su', "01:00"), (6 * MINUTES_PER_DAY + 1320, MINUTES_PER_WEEK + 60))
+        self.assertEquals(opening_hours.window('m', "10:00", 'm', "09:00"), (MINUTES_PER_DAY + 600, MINUTES_PER_WEEK + MINUTES_PER_DAY + 540), "The same day next week")
+
+    def test_maintained(self):
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            spot = Spot.objects.create(name="This spot has hours")
+            hours = SpotAvailableHours.objects.create(spot=spot, day="m", start_time="09:00", end_time="17:00")
+            intervals = list(SpotOpenInterval.objects.filter(spot=spot).values_list('start', 'end'))
+            self.assertEquals(intervals, [(MINUTES_PER_DAY + 540, MINUTES_PER_DAY + 1020)])
+
+            # Merges with the first hours
+            SpotAvailableHours.objects.create(spot=spot, day="m", start_time="16:00", end_time="20:00")
+            intervals = list(SpotOpenInterval.objects.filter(spot=spot).values_list('start', 'end'))
+            self.assertEquals(intervals, [(MINUTES_PER_DAY + 540, MINUTES_PER_DAY + 1200)])
+
+            SpotAvailableHours.objects.filter(spot=spot).delete()
+            self.assertEquals(SpotOpenInterval.objects.filter(spot=spot).count(), 0)
+
+            SpotAvailableHours.objects.create(spot=spot, day="t", start_time="09:00", end_time="17:00")
+            spot.delete()
+            self.assertEquals(SpotOpenInterval.objects.count(), 0)
+
+    def test_open_over_the_weekend(self):
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            spot = Spot.objects.create(name="This spot is open late on Saturday")
+            SpotAvailableHours.objects.create(spot=spot, day="sa", start_time="20:00", end_time="23:59")
+            SpotAvailableHours.objects.create(spot=spot, day="su", start_time="00:00", end_time="02:00")
+
+            c = Client()
+            for params in [{'open_at': "Saturday,22:00", 'open_until': "Sunday,01:00"},
+                           {'open_at': "Sunday,01:00"},
+                           {'open_at': "Saturday,23:59"},
+                           {'open_at': "Sunday,00:00", 'open_until': "Sunday,02:00"}]:
+                response = c.get("/api/v1/spot", params)
+                spot_ids = [found['id'] for found in json.loads(response.content)]
+                self.assertEquals(spot_ids, [spot.pk], "Open for %s" % params)
+
+            for params in [{'open_at': "Saturday,19:00", 'open_until': "Sunday,01:00"},
+                           {'open_at': "Sunday,02:00"},
+                           {'open_at': "Saturday,22:00", 'open_until': "Saturday,21:00"}]:
+                response = c.get("/api/v1/spot", params)
+                self.assertEquals(json.loads(response.content), [], "Closed for %s" % params)
+
+    def test_open_all_week(self):
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            spot = Spot.objects.create(name="This spot never closes")
+            for day in ['su', 'm', 't', 'w', 'th', 'f', 'sa']:
+                SpotAvailableHours.objects.create(spot=spot, day=day, start_time="00:00", end_time="23:59")
+
+            response = Client().get("/api/v1/spot", {'open_at': "Wednesday,12:00", 'open_until': "Wednesday,11:00"})
+            spot_ids = [found['id'] for found in json.loads(response.content)]
+            self.assertEquals(spot_ids, [spot.pk], "Open for the whole week from Wednesday noon")
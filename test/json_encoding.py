@@ -0,0 +1,128 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from spotseeker_server.models import Spot, SpotType
+from spotseeker_server import json_encoding
+from spotseeker_server import models
+from django.core import cache
+from mock import patch
+from decimal import Decimal
+from StringIO import StringIO
+import simplejson as json
+import datetime
+
+TEST_ENCODER = 'spotseeker_server.test.json_encoding'
+
+encoded_values = []
+
+
+def encode(value, pretty=False):
+    """ An encoder module for the tests, which records what it encodes.
+    """
+    encoded_values.append(value)
+    return json_encoding.get_encoder(json_encoding.DEFAULT_ENCODER).encode(value, pretty)
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class JSONEncodingTest(TestCase):
+    """ Tests the JSON encoder modules and their output policy.
+    """
+
+    def setUp(self):
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.spot = Spot.objects.create(name="Encoded spot", latitude=Decimal("47.65500000"), longitude=Decimal("-122.30500000"), capacity=10)
+            self.spot.spottypes.add(SpotType.objects.create(name="study_room"))
+        del encoded_values[:]
+
+    def get(self, url):
+        with patch.object(models, 'cache', self.dummy_cache):
+            response = Client().get(url)
+            self.assertEquals(response.status_code, 200)
+            return response
+
+    def test_decimal(self):
+        self.assertEquals(json_encoding.encode({'latitude': Decimal("47.65500000")}), '{"latitude": 47.65500000}')
+        self.assertEquals(json_encoding.encode([Decimal("-122.3"), Decimal("0.1")]), '[-122.3, 0.1]')
+
+    def test_datetime(self):
+        self.assertEquals(json_encoding.encode(datetime.datetime(2014, 3, 3, 10, 0, 5)), '"2014-03-03T10:00:05"')
+        self.assertEquals(json_encoding.encode(datetime.date(2014, 3, 3)), '"2014-03-03"')
+        self.assertEquals(json_encoding.encode(datetime.time(9, 30)), '"09:30:00"')
+        self.assertRaises(TypeError, json_encoding.encode, object())
+
+    def test_pretty(self):
+        self.assertEquals(json_encoding.encode({'b': Decimal("1.50"), 'a': [1]}, True), '{\n    "a": [\n        1\n    ],\n    "b": 1.50\n}')
+
+    def test_shipped_encoders(self):
+        values = [{'latitude': Decimal("47.65500000"), 'b': [Decimal("1E+2"), 0.1 + 0.2, None, True, u"caf\xe9 \"/\""]},
+                  {'modified': datetime.datetime(2014, 3, 3, 10, 0, 5), 'open': datetime.time(9, 30)}]
+        default = json_encoding.get_encoder(json_encoding.DEFAULT_ENCODER)
+        for module in json_encoding.ENCODERS:
+            try:
+                encoder = json_encoding.get_encoder(module)
+            except ImproperlyConfigured:
+                continue
+            for value in values:
+                self.assertEquals(json.loads(encoder.encode(value), use_decimal=True), json.loads(default.encode(value), use_decimal=True), module)
+                self.assertEquals(encoder.encode(value, True), default.encode(value, True), module)
+            self.assertRaises(TypeError, encoder.encode, [object()])
+
+        stdlib = json_encoding.get_encoder('spotseeker_server.json_encoders.stdlib_encoder')
+        for value in values:
+            self.assertEquals(stdlib.encode(value), default.encode(value), "The same whitespace too")
+
+    def test_setting(self):
+        with override_settings(SPOTSEEKER_JSON_ENCODER='spotseeker_server.no_such_encoder'):
+            self.assertRaises(ImproperlyConfigured, json_encoding.encode, [])
+        with override_settings(SPOTSEEKER_JSON_ENCODER='spotseeker_server.dispatch'):
+            self.assertRaises(ImproperlyConfigured, json_encoding.encode, [])
+
+        with override_settings(SPOTSEEKER_JSON_ENCODER=TEST_ENCODER):
+            response = self.get("/api/v1/spot/%s" % self.spot.pk)
+        self.assertEquals([value['id'] for value in encoded_values], [self.spot.pk], "Encodes the spot JSON")
+        self.assertEquals(json.loads(response.content)['name'], "Encoded spot")
+
+    def test_responses(self):
+        spot = json.loads(self.get("/api/v1/spot/%s" % self.spot.pk).content, use_decimal=True)
+        self.assertEquals(spot['location']['latitude'], Decimal("47.65500000"))
+        self.assertEquals(spot['last_modified'], Spot.objects.get(pk=self.spot.pk).last_modified.isoformat())
+
+        with override_settings(DEBUG=True, JSON_PRETTY_PRINT=True):
+            pretty = self.get("/api/v1/spot/%s" % self.spot.pk).content
+            search = self.get("/api/v1/spot?type=study_room").content
+        self.assertTrue(pretty.startswith('{\n    "available_hours": {'))
+        self.assertEquals(json.loads(pretty, use_decimal=True), spot)
+        self.assertEquals(json.loads(search, use_decimal=True), [spot])
+
+    def test_benchmark(self):
+        stdout = StringIO()
+        with patch.object(models, 'cache', self.dummy_cache):
+            call_command('benchmark_json_encoders', encoders=TEST_ENCODER, repeat=1, stdout=stdout)
+        output = stdout.getvalue()
+        self.assertTrue(TEST_ENCODER in output)
+        self.assertFalse("DIFFERENT" in output)
+
+        stdout = StringIO()
+        with patch.object(models, 'cache', self.dummy_cache):
+            call_command('benchmark_json_encoders', repeat=1, stdout=stdout)
+        output = stdout.getvalue()
+        self.assertTrue('spotseeker_server.json_encoders.stdlib_encoder' in output, "Times the shipped encoders by default")
+        self.assertFalse("DIFFERENT" in output)
@@ -0,0 +1,75 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from spotseeker_server.models import Spot
+import simplejson as json
+from decimal import Decimal
+from django.test.utils import override_settings
+from mock import patch
+from django.core import cache
+from spotseeker_server import models
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class SpotSearchBBoxTest(TestCase):
+    """ Tests searching for the spots inside a bbox viewport.
+    """
+
+    def setUp(self):
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            self.inside = Spot.objects.create(name="Inside", latitude=Decimal("47.655"), longitude=Decimal("-122.305"), capacity=10)
+            self.small = Spot.objects.create(name="Inside, but small", latitude=Decimal("47.656"), longitude=Decimal("-122.306"), capacity=1)
+            self.north = Spot.objects.create(name="North of the box", latitude=Decimal("47.670"), longitude=Decimal("-122.305"), capacity=10)
+            self.west = Spot.objects.create(name="West of the box", latitude=Decimal("47.655"), longitude=Decimal("-122.330"), capacity=10)
+            self.fiji = Spot.objects.create(name="East of the antimeridian", latitude=Decimal("-17.7"), longitude=Decimal("179.9"), capacity=10)
+            self.samoa = Spot.objects.create(name="West of the antimeridian", latitude=Decimal("-17.7"), longitude=Decimal("-179.9"), capacity=10)
+            self.nowhere = Spot.objects.create(name="Nowhere", capacity=10)
+
+    def search(self, params):
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            response = Client().get("/api/v1/spot", params)
+            if response.status_code != 200:
+                return response.status_code
+            return set(spot['id'] for spot in json.loads(response.content))
+
+    def test_bbox(self):
+        found = self.search({'bbox': '47.650,-122.310,47.660,-122.300'})
+        self.assertEquals(found, set([self.inside.pk, self.small.pk]))
+
+    def test_other_filters(self):
+        found = self.search({'bbox': '47.650,-122.310,47.660,-122.300', 'capacity': 5})
+        self.assertEquals(found, set([self.inside.pk]))
+
+    def test_antimeridian(self):
+        found = self.search({'bbox': '-18,179.5,-17,-179.5'})
+        self.assertEquals(found, set([self.fiji.pk, self.samoa.pk]))
+
+        found = self.search({'bbox': '-18,179.5,-17,179.95'})
+        self.assertEquals(found, set([self.fiji.pk]))
+
+    def test_limit(self):
+        found = self.search({'bbox': '47.640,-122.320,47.670,-122.290', 'limit': 2})
+        self.assertEquals(found, set([self.inside.pk, self.small.pk]), "The spots nearest the middle of the box")
+
+    def test_invalid(self):
+        self.assertEquals(self.search({'bbox': '47.650,-122.310,47.660'}), 400)
+        self.assertEquals(self.search({'bbox': 'north,west,south,east'}), 400)
+        self.assertEquals(self.search({'bbox': '47.660,-122.310,47.650,-122.300'}), 400, "South is north of north")
+        self.assertEquals(self.search({'bbox': '47.650,-190,47.660,-122.300'}), 400)
+        self.assertEquals(self.search({'bbox': 'nan,-122.310,47.660,-122.300'}), 400)
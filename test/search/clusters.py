@@ -0,0 +1,94 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from django.contrib.auth.models import User
+from spotseeker_server.models import Spot
+from spotseeker_server import geohash
+import simplejson as json
+from decimal import Decimal
+from django.test.utils import override_settings
+from mock import patch
+from django.core import cache
+from spotseeker_server import models
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class SpotClusterTest(TestCase):
+    """ Tests /api/v1/spot/clusters.
+    """
+
+    def setUp(self):
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            # Eight spots on one part of campus, and two on another
+            self.campus = []
+            for i in range(8):
+                self.campus.append(Spot.objects.create(name="Campus %s" % i, latitude=Decimal("47.6550") + Decimal(i) / 10000, longitude=Decimal("-122.3050"), capacity=i))
+            self.downtown = []
+            for i in range(2):
+                self.downtown.append(Spot.objects.create(name="Downtown %s" % i, latitude=Decimal("47.6060"), longitude=Decimal("-122.3320") + Decimal(i) / 10000, capacity=10))
+            self.far_away = Spot.objects.create(name="Far away", latitude=Decimal("40.7"), longitude=Decimal("-74.0"))
+
+    def get(self, params):
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            return Client().get("/api/v1/spot/clusters", params)
+
+    def test_clusters(self):
+        response = self.get({'bbox': '47.5,-122.5,47.8,-122.2', 'zoom': 12})
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEquals(data['precision'], geohash.precision_for_zoom(12))
+
+        clusters = sorted(data['clusters'], key=lambda cluster: cluster['count'])
+        self.assertEquals([cluster['count'] for cluster in clusters], [2, 8])
+
+        self.assertEquals(clusters[0]['spot_ids'], [spot.pk for spot in self.downtown])
+        self.assertAlmostEquals(clusters[0]['latitude'], 47.606)
+        self.assertAlmostEquals(clusters[0]['longitude'], -122.33195)
+
+        self.assertEquals(clusters[1]['spot_ids'], [spot.pk for spot in self.campus[:5]], "Only a sample of the spot ids")
+        self.assertAlmostEquals(clusters[1]['latitude'], 47.65535)
+        self.assertEquals(clusters[1]['geohash'], self.campus[0].geohash[:data['precision']])
+
+    def test_zoomed_out(self):
+        response = self.get({'bbox': '47.5,-122.5,47.8,-122.2', 'zoom': 3})
+        clusters = json.loads(response.content)['clusters']
+        self.assertEquals(len(clusters), 1, "Campus and downtown are in one cluster")
+        self.assertEquals(clusters[0]['count'], 10)
+
+    def test_other_filters(self):
+        response = self.get({'bbox': '47.5,-122.5,47.8,-122.2', 'zoom': 12, 'capacity': 6})
+        clusters = sorted(json.loads(response.content)['clusters'], key=lambda cluster: cluster['count'])
+        self.assertEquals([cluster['count'] for cluster in clusters], [2, 2])
+
+    def test_required_params(self):
+        self.assertEquals(self.get({'zoom': 12}).status_code, 400)
+        self.assertEquals(self.get({'bbox': '47.5,-122.5,47.8,-122.2'}).status_code, 400)
+        self.assertEquals(self.get({'bbox': '47.5,-122.5,47.8,-122.2', 'zoom': 'far'}).status_code, 400)
+        self.assertEquals(self.get({'bbox': '47.5,-122.5,47.8,-122.2', 'zoom': 30}).status_code, 400)
+
+    @override_settings(SPOTSEEKER_AUTH_ADMINS=('demo_user',))
+    def test_post(self):
+        user, created = User.objects.get_or_create(username='demo_user')
+        client = Client()
+        client.login(username=user.username)
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            response = client.post("/api/v1/spot/clusters", '{"name": "Not a spot"}', content_type="application/json")
+        self.assertEquals(response.status_code, 405)
+        self.assertFalse(Spot.objects.filter(name="Not a spot").exists())
@@ -0,0 +1,94 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from spotseeker_server.models import Spot, SpotType
+import simplejson as json
+from decimal import Decimal
+from django.test.utils import override_settings
+from mock import patch
+from django.core import cache
+from spotseeker_server import models
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class SpotSearchCompactTest(TestCase):
+    """ Tests the format=compact search results.
+    """
+
+    def setUp(self):
+        study = SpotType.objects.create(name="study_room")
+        cafe = SpotType.objects.create(name="cafe")
+
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            self.spots = []
+            for i in range(6):
+                spot = Spot.objects.create(name="Compact %s" % i, latitude=Decimal("47.6550") + Decimal(i) / 10000, longitude=Decimal("-122.3050"), capacity=i)
+                self.spots.append(spot)
+            self.spots[0].spottypes.add(study)
+            self.spots[1].spottypes.add(study)
+            self.spots[1].spottypes.add(cafe)
+
+    def get(self, params):
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            return Client().get("/api/v1/spot", params)
+
+    def test_compact(self):
+        response = self.get({'name': 'Compact', 'format': 'compact'})
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.content, use_decimal=True)
+
+        self.assertEquals(data['id'], [spot.pk for spot in self.spots])
+        self.assertEquals(data['latitude'], [spot.latitude for spot in self.spots])
+        self.assertEquals(data['longitude'], [spot.longitude for spot in self.spots])
+        self.assertEquals(data['capacity'], range(6))
+        self.assertEquals(data['type'][0], ["study_room"])
+        self.assertEquals(sorted(data['type'][1]), ["cafe", "study_room"])
+        self.assertEquals(data['type'][2], [])
+
+    def test_queries(self):
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            with self.assertNumQueries(2):
+                response = Client().get("/api/v1/spot", {'name': 'Compact', 'format': 'compact'})
+                response.content
+
+    def test_same_spots_as_full(self):
+        params = {'center_latitude': "47.6550", 'center_longitude': "-122.3050", 'distance': 50, 'limit': 3}
+        full = json.loads(self.get(params).content)
+
+        params['format'] = 'compact'
+        compact = json.loads(self.get(params).content)
+
+        self.assertEquals(len(compact['id']), 3)
+        self.assertEquals(sorted(compact['id']), sorted(spot['id'] for spot in full))
+
+    def test_nearest(self):
+        response = self.get({'center_latitude': "47.65521", 'center_longitude': "-122.3050", 'nearest': 3, 'format': 'compact'})
+        data = json.loads(response.content)
+        self.assertEquals(data['id'], [self.spots[2].pk, self.spots[3].pk, self.spots[1].pk], "Nearest first")
+
+    def test_etag(self):
+        full = self.get({'name': 'Compact'})
+        compact = self.get({'name': 'Compact', 'format': 'compact'})
+        self.assertNotEquals(full['ETag'], compact['ETag'], "The formats have different ETags")
+
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            response = Client().get("/api/v1/spot", {'name': 'Compact', 'format': 'compact'}, HTTP_IF_NONE_MATCH=compact['ETag'])
+            self.assertEquals(response.status_code, 304)
@@ -383,3 +383,36 @@ class SpotSearchDistanceTest(TestCase):
                     far_out_count += 1
 
             self.assertEquals(far_out_count, 100, "Found all 100 far out spots")
+
+    def test_radius_cutoff(self):
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            center_lat = Decimal("33.777482")
+            center_long = Decimal("-48.468559")
+
+            # About 89m east and 111m north - inside the bounding box for 120m, but 142m away
+            corner = Spot.objects.create(name="In the corner of the box", latitude=center_lat + Decimal("0.001"), longitude=center_long + Decimal("0.00096"))
+            # About 111m north
+            edge = Spot.objects.create(name="At the edge of the circle", latitude=center_lat + Decimal("0.001"), longitude=center_long)
+
+            c = Client()
+            response = c.get("/api/v1/spot", {'center_latitude': center_lat, 'center_longitude': center_long, 'distance': 120, 'limit': 0})
+            spot_ids = [spot['id'] for spot in json.loads(response.content)]
+            self.assertEquals(spot_ids, [edge.pk], "Only the spot inside the radius is found")
+
+    def test_distances_of_spots(self):
+        from spotseeker_server.views.search import SearchView
+        from pyproj import Geod
+        spots = [
+            Spot(name="Nearby", latitude=Decimal("33.777482"), longitude=Decimal("-48.468559")),
+            Spot(name="Nowhere"),
+            Spot(name="Far away", latitude=Decimal("34.777482"), longitude=Decimal("-48.468559")),
+        ]
+
+        view = SearchView()
+        distances = view.distances(spots, "-48.468559", "33.777482")
+        self.assertEquals(len(distances), 3)
+        self.assertAlmostEquals(distances[0], 0)
+        self.assertEquals(distances[1], float('inf'), "Spots without a location are infinitely far away")
+        az12, az21, distance = Geod(ellps='clrk66').inv(-48.468559, 34.777482, -48.468559, 33.777482)
+        self.assertAlmostEquals(distances[2], distance)
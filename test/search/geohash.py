@@ -0,0 +1,88 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from spotseeker_server.models import Spot
+from spotseeker_server.views.search import SearchView
+from spotseeker_server import geohash
+import simplejson as json
+from decimal import Decimal
+from django.test.utils import override_settings
+from mock import patch
+from django.core import cache
+from spotseeker_server import models
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class SpotSearchGeohashTest(TestCase):
+    """ Tests the geohash column used to narrow distance searches.
+    """
+
+    def setUp(self):
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', self.dummy_cache):
+            # A grid of spots around a geohash cell corner near Seattle
+            for i in range(-5, 6):
+                for j in range(-5, 6):
+                    Spot.objects.create(
+                        name="grid %s %s" % (i, j),
+                        latitude=Decimal("47.63671875") + Decimal(i) / 1000,
+                        longitude=Decimal("-122.34375") + Decimal(j) / 1000
+                    )
+
+    def test_encode(self):
+        self.assertEquals(geohash.encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEquals(geohash.encode(0, 0, 1), "s")
+
+    def test_cover_antimeridian(self):
+        cells = geohash.cover(-1, 179, 1, -179)
+        self.assertTrue(geohash.encode(0, 179.5, len(cells[0])) in cells)
+        self.assertTrue(geohash.encode(0, -179.5, len(cells[0])) in cells)
+
+    def test_ranges(self):
+        self.assertEquals(geohash.ranges(["c23p", "c23n", "c23q", "c240"]),
+                          [("c23n", "c23q~"), ("c240", "c240~")])
+
+    def test_maintained_on_save(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            spot = Spot.objects.create(name="geohash spot", latitude=Decimal("57.64911"), longitude=Decimal("10.40744"))
+            self.assertEquals(Spot.objects.get(pk=spot.pk).geohash, geohash.encode(57.64911, 10.40744))
+
+            spot.latitude = None
+            spot.save()
+            self.assertEquals(Spot.objects.get(pk=spot.pk).geohash, "")
+
+    def test_same_as_box(self):
+        """The geohash narrowing doesn't change which spots are found"""
+        boxes = [
+            ("47.6340", "-122.3460", "47.6390", "-122.3410"),
+            ("47.6367", "-122.3440", "47.6368", "-122.3430"),
+            ("47.6300", "-122.3500", "47.6400", "-122.3300"),
+            ("47.6370", "-122.3437", "47.6420", "-122.3390"),
+        ]
+        view = SearchView()
+        for south, west, north, east in boxes:
+            expected = Spot.objects.filter(latitude__gte=south, latitude__lte=north, longitude__gte=west, longitude__lte=east)
+            found = view.filter_box(Spot.objects.all(), south, west, north, east)
+            self.assertEquals(set(found), set(expected))
+            self.assertTrue(len(expected) > 0)
+
+    def test_distance_search(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            c = Client()
+            response = c.get("/api/v1/spot", {'center_latitude': "47.63671875", 'center_longitude': "-122.34375", 'distance': "120", 'limit': "0"})
+            spots = json.loads(response.content)
+            self.assertEquals(len(spots), 5, "The 3x3 spots at the center, without the corners outside the radius")
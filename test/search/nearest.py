@@ -0,0 +1,85 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from spotseeker_server.models import Spot
+import simplejson as json
+from decimal import Decimal
+from django.test.utils import override_settings
+from mock import patch
+from django.core import cache
+from spotseeker_server import models
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class SpotSearchNearestTest(TestCase):
+    """ Tests the nearest=k search mode.
+    """
+
+    def setUp(self):
+        self.center_lat = Decimal("33.777482")
+        self.center_long = Decimal("-48.468559")
+
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            # Spots about 11m, 111m, 1.1km, 11km and 111km north of the center
+            self.spots = []
+            for i, offset in enumerate(["0.0001", "0.001", "0.01", "0.1", "1"]):
+                spot = Spot.objects.create(name="Spot %s" % i, latitude=self.center_lat + Decimal(offset), longitude=self.center_long, capacity=i)
+                self.spots.append(spot)
+            Spot.objects.create(name="Nowhere", capacity=10)
+
+    def get(self, params):
+        params = dict(params)
+        params.setdefault('center_latitude', self.center_lat)
+        params.setdefault('center_longitude', self.center_long)
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            return Client().get("/api/v1/spot", params)
+
+    def test_nearest(self):
+        response = self.get({'nearest': 3})
+        self.assertEquals(response.status_code, 200)
+        spot_ids = [spot['id'] for spot in json.loads(response.content)]
+        self.assertEquals(spot_ids, [spot.pk for spot in self.spots[:3]], "The 3 nearest spots, nearest first")
+
+    def test_widens_past_every_ring(self):
+        response = self.get({'nearest': 10})
+        spot_ids = [spot['id'] for spot in json.loads(response.content)]
+        self.assertEquals(spot_ids, [spot.pk for spot in self.spots], "Every spot with a location, nearest first")
+
+    def test_other_filters(self):
+        response = self.get({'nearest': 2, 'capacity': 3})
+        spot_ids = [spot['id'] for spot in json.loads(response.content)]
+        self.assertEquals(spot_ids, [self.spots[3].pk, self.spots[4].pk], "The nearest spots matching the capacity")
+
+    def test_start_distance(self):
+        response = self.get({'nearest': 1, 'distance': 50000})
+        spot_ids = [spot['id'] for spot in json.loads(response.content)]
+        self.assertEquals(spot_ids, [self.spots[0].pk], "A wide first ring still finds the nearest spot")
+
+    def test_missing_center(self):
+        response = self.get({'nearest': 3, 'center_latitude': ''})
+        self.assertEquals(response.status_code, 400, "Needs numbers for the center")
+
+        dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', dummy_cache):
+            response = Client().get("/api/v1/spot", {'nearest': 3, 'center_latitude': self.center_lat})
+            self.assertEquals(response.status_code, 400, "Needs a longitude")
+
+    def test_invalid_nearest(self):
+        self.assertEquals(self.get({'nearest': 'three'}).status_code, 400)
+        self.assertEquals(self.get({'nearest': 0}).status_code, 400)
@@ -0,0 +1,87 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from spotseeker_server.models import Spot
+from spotseeker_server import models
+from django.core import cache
+from mock import patch
+from decimal import Decimal
+import simplejson as json
+import re
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class SpotSearchPagesTest(TestCase):
+    """ Tests paging through search results with page_size and cursor.
+    """
+
+    def setUp(self):
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', self.dummy_cache):
+            # About 11m apart going north, created farthest first so the
+            # ids run the other way from the distances
+            self.spots = {}
+            for i in reversed(range(7)):
+                self.spots[i] = Spot.objects.create(name="Paged spot %s" % i, latitude=Decimal("47.655") + Decimal("0.0001") * i, longitude=Decimal("-122.305"), capacity=i)
+            self.far = Spot.objects.create(name="Far spot", latitude=Decimal("48.655"), longitude=Decimal("-122.305"), capacity=10)
+
+    def pages(self, params):
+        """ Follows the next links, returning the ids on each page. """
+        pages = []
+        with patch.object(models, 'cache', self.dummy_cache):
+            response = Client().get("/api/v1/spot", params)
+            while True:
+                self.assertEquals(response.status_code, 200)
+                content = json.loads(response.content)
+                if isinstance(content, dict):
+                    pages.append(content['id'])
+                else:
+                    pages.append([spot['id'] for spot in content])
+                if not response.has_header('Link'):
+                    return pages
+                response = Client().get(re.match(r'<(.*)>; rel="next"$', response['Link']).group(1))
+
+    def ids(self, *numbers):
+        return [self.spots[i].pk for i in numbers]
+
+    def test_pages(self):
+        pages = self.pages({'capacity': 2, 'page_size': 2})
+        found = sorted([self.far.pk] + self.ids(6, 5, 4, 3, 2))
+        self.assertEquals(pages, [found[0:2], found[2:4], found[4:6]], "By id")
+
+    def test_distance(self):
+        pages = self.pages({'center_latitude': '47.655', 'center_longitude': '-122.305', 'distance': 50, 'page_size': 2})
+        self.assertEquals(sum(pages, []), sorted(self.ids(0, 1, 2, 3, 4)), "Only the spots inside the circle, by id")
+        self.assertEquals([len(page) for page in pages], [2, 2, 1])
+
+    def test_nearest(self):
+        pages = self.pages({'center_latitude': '47.655', 'center_longitude': '-122.305', 'nearest': 5, 'page_size': 2})
+        self.assertEquals(pages, [self.ids(0, 1), self.ids(2, 3), self.ids(4)], "Closest first, up to the nearest count")
+
+    def test_compact(self):
+        pages = self.pages({'capacity': 2, 'page_size': 3, 'format': 'compact'})
+        self.assertEquals(sum(pages, []), sorted([self.far.pk] + self.ids(6, 5, 4, 3, 2)))
+
+    def test_invalid(self):
+        client = Client()
+        self.assertEquals(client.get("/api/v1/spot", {'capacity': 2, 'page_size': 0}).status_code, 400)
+        self.assertEquals(client.get("/api/v1/spot", {'capacity': 2, 'page_size': 2, 'cursor': '!'}).status_code, 400)
+
+        nearest = {'center_latitude': '47.655', 'center_longitude': '-122.305', 'nearest': 5, 'page_size': 2}
+        nearest['cursor'] = 'WzFd'  # [1], an id cursor
+        self.assertEquals(client.get("/api/v1/spot", nearest).status_code, 400)
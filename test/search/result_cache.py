@@ -0,0 +1,160 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from django.http import QueryDict
+from spotseeker_server.models import Spot, SpotType, SpotExtendedInfo, SpotAvailableHours
+from spotseeker_server.views import search
+from spotseeker_server.views.spot import SpotView
+from spotseeker_server import models
+from django.core import cache
+from mock import patch
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+import simplejson as json
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok',
+                   SPOTSEEKER_SEARCH_CACHE=True)
+class SpotSearchCacheTest(TestCase):
+    """ Tests caching the ids of the spots found by a search.
+    """
+
+    def setUp(self):
+        self.cache = cache.get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        with self.patched_cache():
+            self.study = SpotType.objects.create(name="study_room")
+            self.spot = Spot.objects.create(name="Cached spot", latitude=Decimal("47.655"), longitude=Decimal("-122.305"), capacity=10)
+            self.spot.spottypes.add(self.study)
+            self.other = Spot.objects.create(name="Another spot", latitude=Decimal("47.656"), longitude=Decimal("-122.306"), capacity=2)
+
+    @contextmanager
+    def patched_cache(self):
+        # One cache for both the spot JSON and the search results
+        with patch.object(models, 'cache', self.cache), patch.object(search, 'cache', self.cache):
+            yield
+
+    def search(self, params):
+        with self.patched_cache():
+            response = Client().get("/api/v1/spot", params)
+            return sorted(spot['id'] for spot in json.loads(response.content))
+
+    def test_cached(self):
+        params = {'capacity': 5, 'center_latitude': '47.655', 'center_longitude': '-122.305', 'distance': 500}
+        self.assertEquals(self.search(params), [self.spot.pk])
+
+        with self.patched_cache():
+            with patch.object(search.SearchView, 'query_spots') as query_spots:
+                self.assertEquals(self.search(params), [self.spot.pk])
+                self.assertFalse(query_spots.called, "Uses the cached result")
+
+    def test_compact(self):
+        params = {'type': 'study_room', 'format': 'compact'}
+        with self.patched_cache():
+            first = json.loads(Client().get("/api/v1/spot", params).content)
+            second = json.loads(Client().get("/api/v1/spot", params).content)
+        self.assertEquals(first, second)
+        self.assertEquals(second['id'], [self.spot.pk])
+        self.assertEquals(second['type'], [["study_room"]])
+
+    def test_key(self):
+        view = search.SearchView()
+
+        def key(params):
+            request = type('Request', (), {'GET': view.round_coordinates(QueryDict(params))})()
+            with self.patched_cache():
+                return view.search_cache_key(request)[0]
+
+        base = key('capacity=5&type=study_room&center_latitude=47.655&center_longitude=-122.305&distance=50')
+        self.assertEquals(key('type=study_room&distance=50&center_longitude=-122.305&center_latitude=47.655&capacity=5'), base, "Key order doesn't matter")
+        self.assertEquals(key('capacity=5&type=study_room&center_latitude=47.65501&center_longitude=-122.30499&distance=50&oauth_nonce=1234'), base, "Close centers and OAuth parameters don't matter")
+        self.assertNotEquals(key('capacity=5&type=study_room&center_latitude=47.656&center_longitude=-122.305&distance=50'), base)
+        self.assertNotEquals(key('capacity=6&type=study_room&center_latitude=47.655&center_longitude=-122.305&distance=50'), base)
+
+        with override_settings(SPOTSEEKER_SEARCH_CACHE_COORDINATE_PRECISION=6):
+            self.assertNotEquals(key('capacity=5&type=study_room&center_latitude=47.65501&center_longitude=-122.305&distance=50'), base)
+
+    def test_invalidated(self):
+        self.assertEquals(self.search({'capacity': 5}), [self.spot.pk])
+
+        with self.patched_cache():
+            self.other.capacity = 20
+            self.other.save()
+            self.assertEquals(self.search({'capacity': 5}), [self.spot.pk, self.other.pk], "Sees the changed spot")
+
+            self.assertEquals(self.search({'extended_info:has_outlets': 'true'}), [])
+            info = SpotExtendedInfo.objects.create(spot=self.other, key="has_outlets", value="true")
+            self.assertEquals(self.search({'extended_info:has_outlets': 'true'}), [self.other.pk], "Sees the new extended info")
+            info.delete()
+            self.assertEquals(self.search({'extended_info:has_outlets': 'true'}), [], "Sees the deleted extended info")
+
+            self.assertEquals(self.search({'open_at': "Monday,10:00"}), [])
+            hours = SpotAvailableHours.objects.create(spot=self.other, day="m", start_time="09:00", end_time="17:00")
+            self.assertEquals(self.search({'open_at': "Monday,10:00"}), [self.other.pk], "Sees the new hours")
+            hours.delete()
+            self.assertEquals(self.search({'open_at': "Monday,10:00"}), [], "Sees the deleted hours")
+
+            self.spot.delete()
+            self.assertEquals(self.search({'capacity': 5}), [self.other.pk], "Drops the deleted spot")
+
+    def test_invalidated_after_commit(self):
+        # The save bumps the generation inside the transaction, so a
+        # search before the commit could still cache the old results
+        # under the generation it leaves
+        build_and_save = SpotView._build_and_save_from_input
+        generations = []
+
+        def build_and_save_in_transaction(view, request, spot):
+            response = build_and_save(view, request, spot)
+            generations.append(models.search_cache_generation())
+            return response
+
+        user, created = User.objects.get_or_create(username='demo_user')
+        client = Client()
+        client.login(username=user.username)
+        with self.patched_cache(), override_settings(SPOTSEEKER_AUTH_ADMINS=('demo_user',)):
+            with patch.object(SpotView, '_build_and_save_from_input', build_and_save_in_transaction):
+                etag = Spot.objects.get(pk=self.other.pk).etag
+                response = client.put("/api/v1/spot/%s" % self.other.pk, '{"name":"Another spot", "capacity":"20", "location": {"latitude": 47.656, "longitude": -122.306} }', content_type="application/json", If_Match=etag)
+            self.assertEquals(response.status_code, 200)
+            self.assertNotEquals(models.search_cache_generation(), generations[0], "Bumped again after the commit")
+
+            delete = Spot.delete
+
+            def delete_in_transaction(spot):
+                delete(spot)
+                generations.append(models.search_cache_generation())
+
+            with patch.object(Spot, 'delete', delete_in_transaction):
+                response = client.delete("/api/v1/spot/%s" % self.spot.pk, If_Match=Spot.objects.get(pk=self.spot.pk).etag)
+            self.assertEquals(response.status_code, 200)
+            self.assertNotEquals(models.search_cache_generation(), generations[1], "Bumped again after the delete")
+
+    def test_open_now(self):
+        with self.patched_cache():
+            with patch.object(search, 'localtime', return_value=datetime(2014, 3, 3, 10, 0).timetuple()) as localtime:
+                with patch.object(self.cache, 'set', wraps=self.cache.set) as cache_set:
+                    self.search({'open_now': 'true'})
+                    self.assertEquals(cache_set.call_args[0][2], 60, "Kept for a minute")
+                    key = cache_set.call_args[0][0]
+
+                    localtime.return_value = datetime(2014, 3, 3, 10, 1).timetuple()
+                    self.search({'open_now': 'true'})
+                    self.assertNotEquals(cache_set.call_args[0][0], key, "A new key the next minute")
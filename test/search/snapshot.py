@@ -0,0 +1,194 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from spotseeker_server.models import Spot, SpotType, SpotExtendedInfo, SpotAvailableHours
+from spotseeker_server.search_snapshot import get_snapshot, reset_snapshot
+from spotseeker_server.views.search import SearchView
+from spotseeker_server.test.search.capacity import SpotSearchCapacityTest
+from spotseeker_server.test.search.limit import SpotSearchLimitTest
+from spotseeker_server.test.search.distance import SpotSearchDistanceTest
+from spotseeker_server.test.search.distance_fields import SpotSearchDistanceFieldTest
+from spotseeker_server.test.search.nearest import SpotSearchNearestTest
+from spotseeker_server.test.search.bbox import SpotSearchBBoxTest
+from spotseeker_server.test.search.time import SpotSearchTimeTest
+from spotseeker_server.test.hours.open_now import SpotHoursOpenNowTest
+from spotseeker_server.test.hours.open_at import SpotHoursOpenAtTest
+from spotseeker_server.test.hours.open_until import SpotHoursOpenUntilTest
+from spotseeker_server.test.hours.intervals import SpotOpenIntervalTest
+from spotseeker_server import models
+from django.core import cache
+from mock import patch
+from decimal import Decimal
+from datetime import timedelta
+import simplejson as json
+
+
+class SnapshotSearchMixin(object):
+    """ Starts each test with an empty search snapshot.
+    """
+    def setUp(self):
+        reset_snapshot()
+        super(SnapshotSearchMixin, self).setUp()
+
+
+# The search tests again, answered from the snapshot
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotSearchCapacityTest(SnapshotSearchMixin, SpotSearchCapacityTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotSearchLimitTest(SnapshotSearchMixin, SpotSearchLimitTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotSearchDistanceTest(SnapshotSearchMixin, SpotSearchDistanceTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotSearchDistanceFieldTest(SnapshotSearchMixin, SpotSearchDistanceFieldTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotSearchNearestTest(SnapshotSearchMixin, SpotSearchNearestTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotSearchBBoxTest(SnapshotSearchMixin, SpotSearchBBoxTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotSearchTimeTest(SnapshotSearchMixin, SpotSearchTimeTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotHoursOpenNowTest(SnapshotSearchMixin, SpotHoursOpenNowTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotHoursOpenAtTest(SnapshotSearchMixin, SpotHoursOpenAtTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotHoursOpenUntilTest(SnapshotSearchMixin, SpotHoursOpenUntilTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SnapshotOpenIntervalTest(SnapshotSearchMixin, SpotOpenIntervalTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok',
+                   SPOTSEEKER_SEARCH_SNAPSHOT=True)
+class SpotSnapshotTest(SnapshotSearchMixin, TestCase):
+    """ Tests keeping the search snapshot up to date.
+    """
+
+    def setUp(self):
+        super(SpotSnapshotTest, self).setUp()
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.study = SpotType.objects.create(name="study_room")
+            self.spot = Spot.objects.create(name="Snapshot spot", latitude=Decimal("47.655"), longitude=Decimal("-122.305"), capacity=10)
+            self.spot.spottypes.add(self.study)
+            SpotExtendedInfo.objects.create(spot=self.spot, key="has_whiteboards", value="true")
+            self.other = Spot.objects.create(name="Another spot", latitude=Decimal("47.656"), longitude=Decimal("-122.306"), capacity=2)
+
+    def search(self, params):
+        with patch.object(models, 'cache', self.dummy_cache):
+            response = Client().get("/api/v1/spot", params)
+            return sorted(spot['id'] for spot in json.loads(response.content))
+
+    def test_search(self):
+        self.assertEquals(self.search({'type': 'study_room'}), [self.spot.pk])
+        self.assertEquals(self.search({'extended_info:has_whiteboards': 'true'}), [self.spot.pk])
+        self.assertEquals(self.search({'capacity': 5}), [self.spot.pk])
+        self.assertEquals(self.search({'building_name': ''}), [self.spot.pk, self.other.pk])
+        self.assertEquals(self.search({'id': [self.other.pk]}), [self.other.pk])
+
+    def test_refresh(self):
+        self.assertEquals(self.search({'capacity': 5}), [self.spot.pk])
+
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.other.capacity = 20
+            self.other.save()
+            self.assertEquals(self.search({'capacity': 5}), [self.spot.pk, self.other.pk], "Sees the changed spot")
+
+            self.other.spottypes.add(self.study)
+            self.assertEquals(self.search({'type': 'study_room'}), [self.spot.pk, self.other.pk], "Sees the added type")
+
+            SpotAvailableHours.objects.create(spot=self.other, day="m", start_time="09:00", end_time="17:00")
+            self.assertEquals(self.search({'open_at': "Monday,10:00"}), [self.other.pk], "Sees the new hours")
+
+            self.spot.delete()
+            self.assertEquals(self.search({'capacity': 5}), [self.other.pk], "Drops the deleted spot")
+
+            new_spot = Spot.objects.create(name="A new spot", capacity=30)
+            self.assertEquals(self.search({'capacity': 25}), [new_spot.pk], "Finds the new spot")
+
+    def test_incremental(self):
+        self.search({'capacity': 5})
+
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.other.capacity = 20
+            self.other.save()
+
+            snapshot = get_snapshot()
+            with patch.object(snapshot, '_load', wraps=snapshot._load) as load:
+                self.search({'capacity': 5})
+                self.assertEquals(list(load.call_args[0][0]), [self.other.pk], "Only reloads the changed spot")
+
+    def test_late_commit(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.other.capacity = 20
+            self.other.save()
+            self.assertEquals(self.search({'capacity': 50}), [])
+
+            # Stamped before the change the snapshot has seen, but
+            # committed after it
+            stamp = Spot.objects.get(pk=self.other.pk).last_modified - timedelta(seconds=5)
+            Spot.objects.filter(pk=self.spot.pk).update(capacity=50, etag="late", last_modified=stamp)
+            self.assertEquals(self.search({'capacity': 50}), [self.spot.pk])
+
+    def test_in_process(self):
+        self.search({'capacity': 5})
+
+        with patch.object(models, 'cache', self.dummy_cache):
+            # Only the queries to look for changes
+            with self.assertNumQueries(3):
+                response = Client().get("/api/v1/spot", {'type': 'study_room', 'capacity': 5, 'format': 'compact'})
+            data = json.loads(response.content)
+            self.assertEquals(data['id'], [self.spot.pk])
+            self.assertEquals(data['type'], [["study_room"]])
+
+    def test_fallback(self):
+        view = SearchView()
+        request = type('Request', (), {'GET': {'name': 'Snapshot'}})()
+        chain = type('Chain', (), {'filters': []})()
+        self.assertFalse(view.use_snapshot(request, chain), "Field searches use the database")
+        self.assertEquals(self.search({'name': 'Snapshot'}), [self.spot.pk])
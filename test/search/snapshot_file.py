@@ -0,0 +1,257 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from spotseeker_server.models import Spot, SpotType, SpotExtendedInfo, SpotAvailableHours, SpotTombstone
+from spotseeker_server.search_snapshot import get_snapshot, write_snapshot_file, SnapshotFile
+from spotseeker_server.test.search.snapshot import SnapshotSearchMixin
+from spotseeker_server.test.search.capacity import SpotSearchCapacityTest
+from spotseeker_server.test.search.distance import SpotSearchDistanceTest
+from spotseeker_server.test.search.nearest import SpotSearchNearestTest
+from spotseeker_server.test.search.bbox import SpotSearchBBoxTest
+from spotseeker_server.test.hours.open_at import SpotHoursOpenAtTest
+from spotseeker_server.test.hours.intervals import SpotOpenIntervalTest
+from spotseeker_server import models
+from django.core import cache
+from mock import patch
+from decimal import Decimal
+from StringIO import StringIO
+import simplejson as json
+import os
+import tempfile
+import threading
+
+SNAPSHOT_FILE = os.path.join(tempfile.gettempdir(), 'spotseeker_test_snapshot_%s' % os.getpid())
+
+
+class SnapshotFileMixin(SnapshotSearchMixin):
+    """ Writes the snapshot file after the test's spots are created, so
+    those spots come from the file and any made by the test itself from
+    the database.
+    """
+    def setUp(self):
+        super(SnapshotFileMixin, self).setUp()
+        with patch.object(models, 'cache', cache.get_cache('django.core.cache.backends.dummy.DummyCache')):
+            write_snapshot_file(SNAPSHOT_FILE)
+
+    def tearDown(self):
+        if os.path.exists(SNAPSHOT_FILE):
+            os.remove(SNAPSHOT_FILE)
+        super(SnapshotFileMixin, self).tearDown()
+
+
+# The search tests again, answered from the snapshot file
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True, SPOTSEEKER_SEARCH_SNAPSHOT_FILE=SNAPSHOT_FILE)
+class SnapshotFileSearchCapacityTest(SnapshotFileMixin, SpotSearchCapacityTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True, SPOTSEEKER_SEARCH_SNAPSHOT_FILE=SNAPSHOT_FILE)
+class SnapshotFileSearchDistanceTest(SnapshotFileMixin, SpotSearchDistanceTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True, SPOTSEEKER_SEARCH_SNAPSHOT_FILE=SNAPSHOT_FILE)
+class SnapshotFileSearchNearestTest(SnapshotFileMixin, SpotSearchNearestTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True, SPOTSEEKER_SEARCH_SNAPSHOT_FILE=SNAPSHOT_FILE)
+class SnapshotFileSearchBBoxTest(SnapshotFileMixin, SpotSearchBBoxTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True, SPOTSEEKER_SEARCH_SNAPSHOT_FILE=SNAPSHOT_FILE)
+class SnapshotFileHoursOpenAtTest(SnapshotFileMixin, SpotHoursOpenAtTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_SEARCH_SNAPSHOT=True, SPOTSEEKER_SEARCH_SNAPSHOT_FILE=SNAPSHOT_FILE)
+class SnapshotFileOpenIntervalTest(SnapshotFileMixin, SpotOpenIntervalTest):
+    pass
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok',
+                   SPOTSEEKER_SEARCH_SNAPSHOT=True,
+                   SPOTSEEKER_SEARCH_SNAPSHOT_FILE=SNAPSHOT_FILE)
+class SpotSnapshotFileTest(SnapshotFileMixin, TestCase):
+    """ Tests sharing the search snapshot through a file.
+    """
+
+    def setUp(self):
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.study = SpotType.objects.create(name="study_room")
+            self.spot = Spot.objects.create(name="Snapshot spot", latitude=Decimal("47.655"), longitude=Decimal("-122.305"), capacity=10, building_name="Odegaard")
+            self.spot.spottypes.add(self.study)
+            SpotExtendedInfo.objects.create(spot=self.spot, key="has_whiteboards", value="true")
+            SpotAvailableHours.objects.create(spot=self.spot, day="m", start_time="09:00", end_time="17:00")
+            self.other = Spot.objects.create(name="Another spot", latitude=Decimal("47.656"), longitude=Decimal("-122.306"))
+        super(SpotSnapshotFileTest, self).setUp()
+
+    def search(self, params):
+        with patch.object(models, 'cache', self.dummy_cache):
+            response = Client().get("/api/v1/spot", params)
+            return sorted(spot['id'] for spot in json.loads(response.content))
+
+    def test_file(self):
+        snapshot_file = SnapshotFile(SNAPSHOT_FILE)
+        self.assertEquals(snapshot_file.count, 2)
+        self.assertEquals(snapshot_file.column('pk'), (self.spot.pk, self.other.pk))
+        spot = snapshot_file.spot(snapshot_file.position(self.spot.pk))
+        self.assertEquals(spot.latitude, Decimal("47.655"))
+        self.assertEquals(spot.capacity, 10)
+        self.assertEquals(spot.etag, Spot.objects.get(pk=self.spot.pk).etag)
+        other = snapshot_file.spot(snapshot_file.position(self.other.pk))
+        self.assertEquals(other.capacity, None)
+        self.assertEquals(snapshot_file.position(self.other.pk + 1), None)
+
+    def test_search(self):
+        self.assertEquals(self.search({'type': 'study_room'}), [self.spot.pk])
+        self.assertEquals(self.search({'extended_info:has_whiteboards': 'true'}), [self.spot.pk])
+        self.assertEquals(self.search({'capacity': 5}), [self.spot.pk, self.other.pk])
+        self.assertEquals(self.search({'building_name': 'Odegaard'}), [self.spot.pk])
+        self.assertEquals(self.search({'open_at': "Monday,10:00"}), [self.spot.pk])
+        self.assertEquals(self.search({'id': [self.other.pk]}), [self.other.pk])
+
+    def test_without_loading(self):
+        snapshot = get_snapshot()
+        with patch.object(models, 'cache', self.dummy_cache):
+            with patch.object(snapshot, '_reload') as reload:
+                # Only the queries to look for changes
+                with self.assertNumQueries(3):
+                    response = Client().get("/api/v1/spot", {'type': 'study_room', 'format': 'compact'})
+                self.assertFalse(reload.called, "Doesn't load spots from the database")
+
+        data = json.loads(response.content)
+        self.assertEquals(data['id'], [self.spot.pk])
+        self.assertEquals(data['type'], [["study_room"]])
+        self.assertEquals(snapshot.spots, [], "Nothing held outside the file")
+
+    def test_changes(self):
+        self.search({'capacity': 5})
+
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.other.capacity = 2
+            self.other.save()
+            self.assertEquals(self.search({'capacity': 5}), [self.spot.pk], "Sees the changed spot")
+
+            self.other.spottypes.add(self.study)
+            self.assertEquals(self.search({'type': 'study_room'}), [self.spot.pk, self.other.pk], "Sees the added type")
+
+            self.spot.delete()
+            self.assertEquals(self.search({'type': 'study_room'}), [self.other.pk], "Drops the deleted spot")
+            self.assertEquals(self.search({'open_at': "Monday,10:00"}), [], "Drops the deleted spot's hours")
+
+    def test_swap(self):
+        self.search({'capacity': 5})
+
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.other.capacity = 2
+            self.other.save()
+            self.search({'capacity': 5})
+            snapshot = get_snapshot()
+            self.assertEquals(len(snapshot.spots), 1)
+
+            old_file = snapshot.base
+            write_snapshot_file(SNAPSHOT_FILE)
+            self.assertEquals(self.search({'capacity': 5}), [self.spot.pk])
+            self.assertNotEquals(snapshot.base, old_file, "Maps the new file")
+            self.assertEquals(snapshot.spots, [], "Nothing held outside the new file")
+
+    def test_untracked_delete(self):
+        self.search({'capacity': 5})
+
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.other.delete()
+            SpotTombstone.objects.all().delete()
+            snapshot = get_snapshot()
+            old_file = snapshot.base
+            self.assertEquals(self.search({'capacity': 5}), [self.spot.pk], "Drops the spot that left no tombstone")
+            self.assertNotEquals(snapshot.base, old_file, "Maps a rewritten file")
+            self.assertEquals(snapshot.base.count, 1)
+            self.assertEquals(SnapshotFile(SNAPSHOT_FILE).column('pk'), (self.spot.pk,))
+
+            new_spot = Spot.objects.create(name="A new spot", capacity=30)
+            self.assertEquals(self.search({'capacity': 25}), [new_spot.pk], "Still follows changes")
+            self.assertEquals(snapshot.base.count, 1, "Keeps the rewritten file")
+
+    def test_file_filters(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            for i in range(30):
+                spot = Spot.objects.create(name="Spot %s" % i, latitude=Decimal(str(-80 + i * 5.5)), longitude=Decimal(str(-179 + i * 12)), capacity=None if i % 4 == 0 else i % 7)
+                SpotAvailableHours.objects.create(spot=spot, day=["m", "t", "w", "th", "f", "sa", "su"][i % 7], start_time="%02d:00" % (i % 12), end_time="%02d:30" % (12 + i % 10))
+            Spot.objects.create(name="Nowhere")
+            write_snapshot_file(SNAPSHOT_FILE)
+
+        snapshot_file = SnapshotFile(SNAPSHOT_FILE)
+        latitudes, longitudes = snapshot_file.column('latitude'), snapshot_file.column('longitude')
+        capacities = snapshot_file.column('capacity')
+        intervals = zip(snapshot_file.column('position'), snapshot_file.column('start'), snapshot_file.column('end'))
+
+        def scan(flags):
+            return sum(1 << i for i, flag in enumerate(flags) if flag)
+
+        for south, west, north, east in ((-90, -180, 90, 180), (-30.5, -100, 40, 100), (0, 170, 60, -150), (10, 10, 10, 10), (85, -180, 90, 180)):
+            in_longitude = (lambda lon: lon >= west or lon <= east) if west > east else (lambda lon: west <= lon <= east)
+            self.assertEquals(snapshot_file.in_box(south, north, in_longitude), scan(south <= lat <= north and in_longitude(lon) for lat, lon in zip(latitudes, longitudes)))
+
+        for minimum in (-1, 0, 3, 6, 7, 100):
+            self.assertEquals(snapshot_file.with_capacity(minimum), scan(capacity == SnapshotFile.NO_CAPACITY or capacity >= minimum for capacity in capacities))
+
+        for start, end in ((0, 1), (10, 600), (1500, 2000), (5 * 1440 + 300, 5 * 1440 + 400), (10080, 10081)):
+            expected = 0
+            for i, s, e in intervals:
+                if s <= start and e >= end:
+                    expected |= 1 << i
+            self.assertEquals(snapshot_file.open_for(start, end), expected)
+
+    def test_search_unlocked(self):
+        snapshot = get_snapshot()
+        in_box = SnapshotFile.in_box
+        locked = []
+
+        def try_lock():
+            if snapshot.lock.acquire(False):
+                snapshot.lock.release()
+            else:
+                locked.append(True)
+
+        def in_box_from_another_thread(snapshot_file, *args):
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            return in_box(snapshot_file, *args)
+
+        with patch.object(SnapshotFile, 'in_box', in_box_from_another_thread):
+            self.assertEquals(self.search({'bbox': '47,-123,48,-122'}), [self.spot.pk, self.other.pk])
+        self.assertEquals(locked, [], "The file is searched without the lock")
+
+    def test_old_version(self):
+        with open(SNAPSHOT_FILE, 'r+b') as f:
+            f.write(SnapshotFile.PREAMBLE.pack(SnapshotFile.MAGIC, SnapshotFile.VERSION - 1, 0))
+        self.assertEquals(self.search({'capacity': 5}), [self.spot.pk, self.other.pk])
+        self.assertEquals(SnapshotFile(SNAPSHOT_FILE).count, 2, "Rewrites the file")
+
+    def test_command(self):
+        os.remove(SNAPSHOT_FILE)
+        stdout = StringIO()
+        call_command('build_search_snapshot', stdout=stdout)
+        self.assertEquals(stdout.getvalue(), "Wrote 2 spots to %s\n" % SNAPSHOT_FILE)
+        self.assertEquals(SnapshotFile(SNAPSHOT_FILE).count, 2)
@@ -0,0 +1,109 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from django.contrib.auth.models import User
+from spotseeker_server.models import Spot, SpotType, SpotExtendedInfo, SpotAvailableHours, FavoriteSpot, parse_spot_fields
+from mock import patch
+from spotseeker_server import models
+from django.core import cache
+from decimal import Decimal
+import simplejson as json
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class SpotFieldsTest(TestCase):
+    """ Tests returning only some fields of each spot.
+    """
+
+    def setUp(self):
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.spot = Spot.objects.create(name="Sparse spot", latitude=Decimal("47.655"), longitude=Decimal("-122.305"), capacity=10, building_name="Odegaard")
+            self.spot.spottypes.add(SpotType.objects.create(name="study_room"))
+            SpotExtendedInfo.objects.create(spot=self.spot, key="noise_level", value="quiet")
+            SpotExtendedInfo.objects.create(spot=self.spot, key="has_whiteboards", value="true")
+            SpotAvailableHours.objects.create(spot=self.spot, day="m", start_time="09:00", end_time="17:00")
+            self.url = "/api/v1/spot/%s" % self.spot.pk
+
+    def get(self, url, params):
+        with patch.object(models, 'cache', self.dummy_cache):
+            response = Client().get(url, params)
+            self.assertEquals(response.status_code, 200)
+            return json.loads(response.content)
+
+    def test_parse(self):
+        self.assertEquals(parse_spot_fields("id,name"), {'id': None, 'name': None})
+        self.assertEquals(parse_spot_fields("extended_info.noise_level, extended_info.has_outlets"), {'extended_info': set(['noise_level', 'has_outlets'])})
+        self.assertEquals(parse_spot_fields("location.latitude,location"), {'location': None})
+        self.assertRaises(ValueError, parse_spot_fields, "id,secret")
+        self.assertRaises(ValueError, parse_spot_fields, "name.first")
+        self.assertRaises(ValueError, parse_spot_fields, "extended_info.")
+
+    def test_spot(self):
+        spot = self.get(self.url, {'fields': 'id,name,location,type,extended_info.noise_level'})
+        self.assertEquals(sorted(spot.keys()), ['extended_info', 'id', 'location', 'name', 'type'])
+        self.assertEquals(spot['id'], self.spot.pk)
+        self.assertEquals(spot['location']['building_name'], "Odegaard")
+        self.assertEquals(spot['type'], ["study_room"])
+        self.assertEquals(spot['extended_info'], {"noise_level": "quiet"})
+
+        spot = self.get(self.url, {'fields': 'available_hours.monday,location.latitude'})
+        self.assertEquals(spot, {'available_hours': {'monday': [["09:00", "17:00"]]}, 'location': {'latitude': 47.655}})
+
+    def test_not_queried(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            # Only the spot itself
+            with self.assertNumQueries(1):
+                Client().get(self.url, {'fields': 'id,name,capacity'})
+            # And its extended info
+            with self.assertNumQueries(2):
+                Client().get(self.url, {'fields': 'id,extended_info.noise_level'})
+
+    def test_etag(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            full = Client().get(self.url)
+            sparse = Client().get(self.url, {'fields': 'id,name'})
+            self.assertNotEquals(full['ETag'], sparse['ETag'])
+            self.assertEquals(Client().get(self.url, {'fields': 'name,id'})['ETag'], sparse['ETag'])
+
+    def test_invalid(self):
+        response = Client().get(self.url, {'fields': 'id,secret'})
+        self.assertEquals(response.status_code, 400)
+
+    def test_search(self):
+        spots = self.get("/api/v1/spot", {'capacity': 5, 'fields': 'id,name'})
+        self.assertEquals(spots, [{'id': self.spot.pk, 'name': "Sparse spot"}])
+
+    def test_all(self):
+        spots = self.get("/api/v1/spot/all", {'fields': 'id'})
+        self.assertEquals(spots, [{'id': self.spot.pk}])
+
+        spots = self.get("/api/v1/spot/all", {'fields': 'id', 'page_size': 5})
+        self.assertEquals(spots, [{'id': self.spot.pk}])
+
+        changes = self.get("/api/v1/spot/all", {'fields': 'id', 'modified_since': "2000-01-01T00:00:00"})
+        self.assertEquals(changes['spots'], [{'id': self.spot.pk}])
+
+    @override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.fake_oauth')
+    def test_favorites(self):
+        user = User.objects.create(username="fields_fav")
+        FavoriteSpot.objects.create(user=user, spot=self.spot)
+
+        with patch.object(models, 'cache', self.dummy_cache):
+            response = Client().get("/api/v1/user/me/favorites", {'fields': 'id,name'}, TESTING_OAUTH_USER="fields_fav")
+        self.assertEquals(json.loads(response.content), [{'id': self.spot.pk, 'name': "Sparse spot"}])
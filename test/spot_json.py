@@ -0,0 +1,95 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from spotseeker_server.models import Spot, SpotType, SpotExtendedInfo, SpotAvailableHours
+from mock import patch
+from django.core import cache
+from spotseeker_server import models
+from spotseeker_server.views.rest_dispatch import encoded_json_array
+import simplejson as json
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok',
+                   SPOTSEEKER_SPOT_FORM='spotseeker_server.default_forms.spot.DefaultSpotForm')
+class SpotBulkJSONTest(TestCase):
+    """ Tests the bulk spot serializer, Spot.objects.json_for.
+    """
+
+    def setUp(self):
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        self.spot_type = SpotType.objects.create(name="study_room")
+
+    def _create_spots(self, count):
+        with patch.object(models, 'cache', self.dummy_cache):
+            for i in range(count):
+                spot = Spot.objects.create(name="bulk json spot %s" % i, latitude=55, longitude=30)
+                spot.spottypes.add(self.spot_type)
+                SpotExtendedInfo.objects.create(spot=spot, key="has_whiteboards", value="true")
+                SpotAvailableHours.objects.create(spot=spot, day="m", start_time="09:00", end_time="17:00")
+                SpotAvailableHours.objects.create(spot=spot, day="m", start_time="06:00", end_time="08:00")
+
+    def test_same_as_json_data_structure(self):
+        self._create_spots(3)
+        with patch.object(models, 'cache', self.dummy_cache):
+            spots = Spot.objects.all()
+            bulk = Spot.objects.json_for(spots)
+
+            self.assertEquals(len(bulk), 3)
+            for spot, spot_json in zip(spots, bulk):
+                self.assertEquals(spot_json, spot.json_data_structure())
+                self.assertEquals(spot_json["type"], ["study_room"])
+                self.assertEquals(spot_json["extended_info"], {"has_whiteboards": "true"})
+                self.assertEquals(spot_json["available_hours"]["monday"], [["06:00", "08:00"], ["09:00", "17:00"]])
+
+    def test_keeps_order(self):
+        self._create_spots(3)
+        with patch.object(models, 'cache', self.dummy_cache):
+            spots = list(Spot.objects.all())
+            spots.reverse()
+            ids = [spot_json["id"] for spot_json in Spot.objects.json_for(spots)]
+            self.assertEquals(ids, [spot.pk for spot in spots])
+
+    def test_all_spots_query_count(self):
+        """The number of queries for /spot/all doesn't grow with the
+        number of spots."""
+        with patch.object(models, 'cache', self.dummy_cache):
+            c = Client()
+
+            self._create_spots(2)
+            with self.assertNumQueries(7):
+                content = c.get("/api/v1/spot/all").content
+            self.assertEquals(len(json.loads(content)), 2)
+
+            self._create_spots(10)
+            with self.assertNumQueries(7):
+                content = c.get("/api/v1/spot/all").content
+            self.assertEquals(len(json.loads(content)), 12)
+
+    def test_all_spots_streamed_in_batches(self):
+        """/spot/all is streamed one batch of spots at a time, with the
+        same body as a single array."""
+        self._create_spots(5)
+        with patch.object(models, 'cache', self.dummy_cache):
+            with patch.object(Spot.objects, 'JSON_BATCH_SIZE', 2):
+                with self.assertNumQueries(2 + 3 * 5):
+                    chunks = list(Client().get("/api/v1/spot/all"))
+                self.assertEquals(len(chunks), 5, "Brackets plus one chunk per batch")
+
+            spots = json.loads(''.join(chunks))
+            self.assertEquals([spot["id"] for spot in spots], sorted(spot.pk for spot in Spot.objects.all()))
+            self.assertEquals(''.join(chunks), encoded_json_array(Spot.objects.encoded_json_for(Spot.objects.order_by('pk'))))
@@ -0,0 +1,193 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from spotseeker_server.models import Spot, SpotType, SpotExtendedInfo, SpotListTables
+from mock import patch
+from spotseeker_server import models
+from django.core import cache
+from decimal import Decimal
+import simplejson as json
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class SpotListV2Test(TestCase):
+    """ Tests the v2 spot lists, with shared lookup tables.
+    """
+
+    def setUp(self):
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', self.dummy_cache):
+            study = SpotType.objects.create(name="study_room")
+            cafe = SpotType.objects.create(name="cafe")
+            self.spots = []
+            for i in range(3):
+                spot = Spot.objects.create(name="Spot %s" % i, latitude=Decimal("47.655"), longitude=Decimal("-122.305"), capacity=10, building_name="Odegaard")
+                spot.spottypes.add(study)
+                SpotExtendedInfo.objects.create(spot=spot, key="has_whiteboards", value="true")
+                self.spots.append(spot)
+            self.spots[2].spottypes.add(cafe)
+            self.spots[2].building_name = "Suzzallo"
+            self.spots[2].save()
+            SpotExtendedInfo.objects.create(spot=self.spots[2], key="noise_level", value="quiet")
+
+    def get(self, url, params=None):
+        with patch.object(models, 'cache', self.dummy_cache):
+            response = Client().get(url, params or {})
+            self.assertEquals(response.status_code, 200)
+            # The body is streamed, so build it while the cache is patched
+            response.content = response.content
+            return response
+
+    def expand(self, data):
+        """ The v1 form of the spots in a v2 list. """
+        spots = []
+        for entry in data['spots']:
+            spot = dict(entry)
+            spot['uri'] = "%s%s" % (data['uri_prefix'], spot['id'])
+            spot['type'] = [data['types'][index] for index in spot['type']]
+            spot['location'] = dict(spot['location'])
+            spot['location']['building_name'] = data['buildings'][spot['location']['building_name']]
+            spot['extended_info'] = dict((data['extended_info_keys'][index], value) for index, value in spot['extended_info'])
+            spots.append(spot)
+        return spots
+
+    def test_all(self):
+        v1 = json.loads(self.get("/api/v1/spot/all").content)
+        data = json.loads(self.get("/api/v2/spot/all").content)
+
+        self.assertEquals(data['count'], 3)
+        self.assertEquals(data['next'], None)
+        self.assertEquals(data['uri_prefix'], "/api/v1/spot/")
+        self.assertEquals(sorted(data['types']), ["cafe", "study_room"])
+        self.assertEquals(sorted(data['buildings']), ["Odegaard", "Suzzallo"])
+        self.assertEquals(sorted(data['extended_info_keys']), ["has_whiteboards", "noise_level"])
+        self.assertEquals(self.expand(data), v1)
+
+    def test_etag(self):
+        v1 = self.get("/api/v1/spot/all")
+        v2 = self.get("/api/v2/spot/all")
+        self.assertNotEquals(v1['ETag'], v2['ETag'], "The shapes are cached apart")
+
+    def test_search(self):
+        v1 = json.loads(self.get("/api/v1/spot", {'type': 'study_room'}).content)
+        data = json.loads(self.get("/api/v2/spot", {'type': 'study_room'}).content)
+        self.assertEquals(data['count'], 3)
+        self.assertEquals(sorted(self.expand(data)), sorted(v1))
+
+        data = json.loads(self.get("/api/v2/spot", {'type': 'lounge'}).content)
+        self.assertEquals(data['spots'], [])
+        self.assertEquals(data['count'], 0)
+        self.assertEquals(data['types'], [])
+
+    def test_fields(self):
+        data = json.loads(self.get("/api/v2/spot/all", {'fields': 'id,type'}).content)
+        self.assertEquals(sorted(data['spots'][0].keys()), ['id', 'type'])
+        self.assertEquals(data['buildings'], [])
+
+    def test_pages(self):
+        response = self.get("/api/v2/spot/all", {'page_size': 2})
+        data = json.loads(response.content)
+        self.assertEquals(data['count'], 3)
+        self.assertEquals([spot['id'] for spot in data['spots']], [spot.pk for spot in self.spots[:2]])
+        self.assertEquals(data['buildings'], ["Odegaard"], "Only what the page uses")
+        self.assertTrue(data['next'] in response['Link'])
+
+        data = json.loads(self.get("/api/v2/spot/all", {'page_size': 2, 'cursor': data['next']}).content)
+        self.assertEquals([spot['id'] for spot in data['spots']], [self.spots[2].pk])
+        self.assertEquals(data['next'], None)
+
+    @override_settings(SPOTSEEKER_SYNC_OVERLAP=0)
+    def test_changes(self):
+        sync_token = json.loads(self.get("/api/v2/spot/all", {'modified_since': '2000-01-01T00:00:00'}).content)['sync_token']
+        with patch.object(models, 'cache', self.dummy_cache):
+            deleted = self.spots[0].pk
+            self.spots[0].delete()
+            self.spots[1].name = "Renamed"
+            self.spots[1].save()
+
+        data = json.loads(self.get("/api/v2/spot/all", {'sync_token': sync_token}).content)
+        self.assertEquals(data['deleted'], [deleted])
+        self.assertEquals([spot['name'] for spot in data['spots']], ["Renamed"])
+        self.assertEquals(data['types'], ["study_room"])
+        self.assertTrue('sync_token' in data)
+
+    def test_cached_entries(self):
+        locmem_cache = cache.get_cache('django.core.cache.backends.locmem.LocMemCache')
+        locmem_cache.clear()
+        with patch.object(models, 'cache', locmem_cache):
+            expected = json.loads(Client().get("/api/v2/spot/all").content)
+            with patch.object(SpotListTables, 'template') as template:
+                cached = json.loads(Client().get("/api/v2/spot", {'type': 'study_room'}).content)
+                self.assertFalse(template.called, "Uses the cached entries")
+            self.assertEquals(sorted(self.expand(cached)), sorted(self.expand(expected)))
+
+            self.spots[1].name = "Renamed"
+            self.spots[1].save()
+            data = json.loads(Client().get("/api/v2/spot/all").content)
+        self.assertEquals([spot['name'] for spot in self.expand(data)], ["Spot 0", "Renamed", "Spot 2"])
+
+    def test_template(self):
+        spot_json = json.dumps({
+            'id': 1,
+            'name': u"\x000\x00 \"quoted\" caf\xe9",
+            'type': ["cafe", u"\x000\x00"],
+            'location': {'building_name': "Odegaard", 'latitude': Decimal("47.65500000")},
+            'extended_info': {'noise_level': "quiet", 'has_whiteboards': "true"},
+        }, use_decimal=True)
+        template = SpotListTables.template(spot_json)
+        self.assertEquals(template.spot_id, 1)
+        self.assertEquals(len(template.refs), 5)
+
+        tables = SpotListTables()
+        tables.index('types', "study_room")
+        entry = json.loads(tables.encoded_entries([template])[0], use_decimal=True)
+        self.assertEquals(entry['name'], u"\x000\x00 \"quoted\" caf\xe9")
+        self.assertEquals(entry['type'], [1, 2])
+        self.assertEquals(tables.tables['types'], ["study_room", "cafe", u"\x000\x00"])
+        self.assertEquals(entry['location'], {'building_name': 0, 'latitude': Decimal("47.65500000")})
+        self.assertEquals(entry['extended_info'], [[0, "true"], [1, "quiet"]])
+
+    @override_settings(SPOTSEEKER_AUTH_ADMINS=('demo_user',))
+    def test_refilled_before_commit(self):
+        locmem_cache = cache.get_cache('django.core.cache.backends.locmem.LocMemCache')
+        locmem_cache.clear()
+        user, created = User.objects.get_or_create(username='demo_user')
+        client = Client()
+        client.login(username=user.username)
+        spot = self.spots[0]
+        url = "/api/v1/spot/%s" % spot.pk
+
+        with patch.object(models, 'cache', locmem_cache):
+            Client().get("/api/v2/spot/all").content
+            key = models.spot_list_entry_cache_key(spot.pk)
+            old = locmem_cache.get(key)
+            changes_committed = Spot.changes_committed
+
+            def refilled(spot, *args, **kwargs):
+                # A reader between the save and the commit caches the
+                # old entry again
+                locmem_cache.set(key, old)
+                return changes_committed(spot, *args, **kwargs)
+
+            with patch.object(Spot, 'changes_committed', refilled):
+                etag = Spot.objects.get(pk=spot.pk).etag
+                response = client.put(url, '{"name":"Committed", "capacity":"10", "location": {"latitude": 55, "longitude": 30} }', content_type="application/json", If_Match=etag)
+                self.assertEquals(response.status_code, 200)
+            data = json.loads(Client().get("/api/v2/spot/all").content)
+        self.assertEquals(self.expand(data)[0]['name'], "Committed")
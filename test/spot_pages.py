@@ -0,0 +1,87 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from spotseeker_server.models import Spot
+from mock import patch
+from django.core import cache
+from spotseeker_server import models
+import simplejson as json
+import re
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok')
+class SpotPagesTest(TestCase):
+    """ Tests paging through /api/v1/spot/all.
+    """
+
+    def setUp(self):
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.spots = [Spot.objects.create(name="Paged spot %s" % i) for i in range(5)]
+
+    def _pages(self, url, params):
+        """ Follows the next links from url, returning the decoded pages. """
+        pages = []
+        with patch.object(models, 'cache', self.dummy_cache):
+            response = Client().get(url, params)
+            while True:
+                self.assertEquals(response.status_code, 200)
+                pages.append(json.loads(response.content))
+                if not response.has_header('Link'):
+                    return pages
+                next_url = re.match(r'<(.*)>; rel="next"$', response['Link']).group(1)
+                response = Client().get(next_url)
+
+    def test_pages(self):
+        pages = self._pages("/api/v1/spot/all", {'page_size': 2})
+        self.assertEquals([[spot['id'] for spot in page] for page in pages],
+                          [[self.spots[0].pk, self.spots[1].pk], [self.spots[2].pk, self.spots[3].pk], [self.spots[4].pk]])
+
+    def test_exact_pages(self):
+        pages = self._pages("/api/v1/spot/all", {'page_size': 5})
+        self.assertEquals(len(pages), 1, "No link past the last spot")
+        self.assertEquals(len(pages[0]), 5)
+
+    def test_bounded_query(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            response = Client().get("/api/v1/spot/all", {'page_size': 2})
+            cursor = re.search(r'cursor=([^&>]*)', response['Link']).group(1)
+            # The page, then the related rows of its spots
+            with self.assertNumQueries(5):
+                response = Client().get("/api/v1/spot/all", {'page_size': 2, 'cursor': cursor})
+            self.assertEquals([spot['id'] for spot in json.loads(response.content)], [self.spots[2].pk, self.spots[3].pk])
+
+    def test_sync_pages(self):
+        deleted_id = self.spots[0].pk
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.spots[0].delete()
+        pages = self._pages("/api/v1/spot/all", {'page_size': 3, 'modified_since': "2000-01-01T00:00:00"})
+        self.assertEquals(len(pages), 2)
+        self.assertEquals([spot['id'] for spot in pages[0]['spots'] + pages[1]['spots']], [spot.pk for spot in self.spots[1:]])
+        self.assertEquals(pages[0]['deleted'], [deleted_id])
+        self.assertEquals(pages[1]['deleted'], [], "Deletions are only on the first page")
+        self.assertEquals(pages[0]['sync_token'], pages[1]['sync_token'], "One sync token for every page")
+
+    def test_invalid(self):
+        client = Client()
+        self.assertEquals(client.get("/api/v1/spot/all", {'page_size': 0}).status_code, 400)
+        self.assertEquals(client.get("/api/v1/spot/all", {'page_size': 'ten'}).status_code, 400)
+        self.assertEquals(client.get("/api/v1/spot/all", {'page_size': 100000}).status_code, 400)
+        self.assertEquals(client.get("/api/v1/spot/all", {'cursor': 'WzFd'}).status_code, 400)
+        self.assertEquals(client.get("/api/v1/spot/all", {'page_size': 2, 'cursor': 'not a cursor'}).status_code, 400)
+        self.assertEquals(client.get("/api/v1/spot/all", {'page_size': 2, 'cursor': 'eyJhIjogMX0'}).status_code, 400)
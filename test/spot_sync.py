@@ -0,0 +1,112 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from spotseeker_server.models import Spot, SpotTombstone
+from mock import patch
+from django.core import cache
+from spotseeker_server import models
+from datetime import timedelta
+import simplejson as json
+
+
+@override_settings(SPOTSEEKER_AUTH_MODULE='spotseeker_server.auth.all_ok',
+                   SPOTSEEKER_SPOT_FORM='spotseeker_server.default_forms.spot.DefaultSpotForm')
+class SpotSyncTest(TestCase):
+    """ Tests syncing the changes to /api/v1/spot/all since a time.
+    """
+
+    def setUp(self):
+        self.dummy_cache = cache.get_cache('django.core.cache.backends.dummy.DummyCache')
+        with patch.object(models, 'cache', self.dummy_cache):
+            self.spot1 = Spot.objects.create(name="Sync spot 1", latitude=55, longitude=30)
+            self.spot2 = Spot.objects.create(name="Sync spot 2", latitude=55, longitude=30)
+
+    def _sync(self, **params):
+        response = Client().get("/api/v1/spot/all", params)
+        self.assertEquals(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_initial_sync(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            changes = self._sync(modified_since="2000-01-01T00:00:00")
+            self.assertEquals(sorted(s["id"] for s in changes["spots"]), [self.spot1.pk, self.spot2.pk])
+            self.assertEquals(changes["deleted"], [])
+            self.assertTrue(changes["sync_token"])
+
+    def test_changes_since_token(self):
+        with patch.object(models, 'cache', self.dummy_cache), override_settings(SPOTSEEKER_SYNC_OVERLAP=0):
+            token = self._sync(modified_since="2000-01-01T00:00:00")["sync_token"]
+
+            changes = self._sync(sync_token=token)
+            self.assertEquals(changes["spots"], [], "Nothing changed")
+            self.assertEquals(changes["deleted"], [])
+
+            self.spot1.name = "Sync spot 1, renamed"
+            self.spot1.save()
+            spot2_id = self.spot2.pk
+            self.spot2.delete()
+
+            changes = self._sync(sync_token=token)
+            self.assertEquals([s["name"] for s in changes["spots"]], ["Sync spot 1, renamed"])
+            self.assertEquals(changes["deleted"], [spot2_id])
+
+            changes = self._sync(sync_token=changes["sync_token"])
+            self.assertEquals(changes["spots"], [])
+            self.assertEquals(changes["deleted"], [])
+
+    def test_overlap(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            now = timezone.now()
+            with patch.object(timezone, 'now', return_value=now):
+                token = self._sync(modified_since="2000-01-01T00:00:00")["sync_token"]
+            self.assertEquals(parse_datetime(token), now - timedelta(seconds=60))
+
+            # Written by a transaction that began before the token was
+            # issued and committed after
+            Spot.objects.filter(pk=self.spot1.pk).update(last_modified=now - timedelta(seconds=30))
+            changes = self._sync(sync_token=token)
+            self.assertTrue(self.spot1.pk in [s["id"] for s in changes["spots"]])
+
+    def test_same_time_as_token(self):
+        with patch.object(models, 'cache', self.dummy_cache), override_settings(SPOTSEEKER_SYNC_OVERLAP=0):
+            now = timezone.now()
+            with patch.object(timezone, 'now', return_value=now):
+                token = self._sync(modified_since="2000-01-01T00:00:00")["sync_token"]
+
+            Spot.objects.filter(pk__in=[self.spot1.pk, self.spot2.pk]).update(last_modified=now - timedelta(days=1))
+            Spot.objects.filter(pk=self.spot1.pk).update(last_modified=now)
+            spot2_id = self.spot2.pk
+            self.spot2.delete()
+            SpotTombstone.objects.filter(spot_id=spot2_id).update(deleted=now)
+
+            changes = self._sync(sync_token=token)
+            self.assertEquals([s["id"] for s in changes["spots"]], [self.spot1.pk])
+            self.assertEquals(changes["deleted"], [spot2_id])
+
+    def test_bulk_delete_tombstones(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            ids = sorted([self.spot1.pk, self.spot2.pk])
+            Spot.objects.all().delete()
+            self.assertEquals(sorted(SpotTombstone.objects.values_list('spot_id', flat=True)), ids)
+
+    def test_invalid_since(self):
+        with patch.object(models, 'cache', self.dummy_cache):
+            response = Client().get("/api/v1/spot/all", {"modified_since": "yesterday"})
+            self.assertEquals(response.status_code, 400)
@@ -23,6 +23,15 @@ from spotseeker_server.test.spot_put import SpotPUTTest
 from spotseeker_server.test.spot_delete import SpotDELETETest
 from spotseeker_server.test.spot_post import SpotPOSTTest
 from spotseeker_server.test.spot_get import SpotGETTest
+from spotseeker_server.test.spot_json import SpotBulkJSONTest
+from spotseeker_server.test.conditional_get import SpotConditionalGETTest
+from spotseeker_server.test.spot_sync import SpotSyncTest
+from spotseeker_server.test.spot_pages import SpotPagesTest
+from spotseeker_server.test.spot_fields import SpotFieldsTest
+from spotseeker_server.test.spot_list_v2 import SpotListV2Test
+from spotseeker_server.test.compression import ResponseCompressionTest
+from spotseeker_server.test.json_encoding import JSONEncodingTest
+from spotseeker_server.test.binary_formats import BinaryResponseTest
 from spotseeker_server.test.favorite_model import FavoriteSpotTest
 from spotseeker_server.test.no_rest_methods import NoRESTMethodsTest
 from spotseeker_server.test.schema import SpotSchemaTest
@@ -39,6 +48,15 @@ from spotseeker_server.test.search.limit import SpotSearchLimitTest
 from spotseeker_server.test.search.distance import SpotSearchDistanceTest
 from spotseeker_server.test.search.fields import SpotSearchFieldTest
 from spotseeker_server.test.search.distance_fields import SpotSearchDistanceFieldTest
+from spotseeker_server.test.search.geohash import SpotSearchGeohashTest
+from spotseeker_server.test.search.nearest import SpotSearchNearestTest
+from spotseeker_server.test.search.bbox import SpotSearchBBoxTest
+from spotseeker_server.test.search.clusters import SpotClusterTest
+from spotseeker_server.test.search.compact import SpotSearchCompactTest
+from spotseeker_server.test.search.snapshot import SnapshotSearchCapacityTest, SnapshotSearchLimitTest, SnapshotSearchDistanceTest, SnapshotSearchDistanceFieldTest, SnapshotSearchNearestTest, SnapshotSearchBBoxTest, SnapshotSearchTimeTest, SnapshotHoursOpenNowTest, SnapshotHoursOpenAtTest, SnapshotHoursOpenUntilTest, SnapshotOpenIntervalTest, SpotSnapshotTest
+from spotseeker_server.test.search.snapshot_file import SnapshotFileSearchCapacityTest, SnapshotFileSearchDistanceTest, SnapshotFileSearchNearestTest, SnapshotFileSearchBBoxTest, SnapshotFileHoursOpenAtTest, SnapshotFileOpenIntervalTest, SpotSnapshotFileTest
+from spotseeker_server.test.search.result_cache import SpotSearchCacheTest
+from spotseeker_server.test.search.pages import SpotSearchPagesTest
 from spotseeker_server.test.search.view_methods import SpotSearchViewMethodsTest
 from spotseeker_server.test.search.time import SpotSearchTimeTest
 from spotseeker_server.test.hours.model import SpotHoursModelTest
@@ -52,6 +70,7 @@ from spotseeker_server.test.hours.open_now_location import SpotHoursOpenNowLocat
 from spotseeker_server.test.hours.open_now_location_attributes import SpotHoursOpenNowLocationAttributesTest
 from spotseeker_server.test.hours.overlap import SpotHoursOverlapTest
 from spotseeker_server.test.hours.modify import SpotHoursModifyTest
+from spotseeker_server.test.hours.intervals import SpotOpenIntervalTest
 from spotseeker_server.test.auth.all_ok import SpotAuthAllOK
 from spotseeker_server.test.auth.oauth import SpotAuthOAuth
 from spotseeker_server.test.auth.oauth_logger import SpotAuthOAuthLogger
@@ -59,7 +78,7 @@ from spotseeker_server.test.uw_spot.spot_form import UWSpotFormTest
 from spotseeker_server.test.uw_spot.spot_post import UWSpotPOSTTest
 from spotseeker_server.test.uw_spot.spot_put import UWSpotPUTTest
 from spotseeker_server.test.uw_spot.schema import UWSpotSchemaTest
-from spotseeker_server.test.cache_test import JsonCachingTest
+from spotseeker_server.test.cache_test import JsonCachingTest, SingleFlightCachingTest
 
 from spotseeker_server.test.favorites import FavoritesTest
 from spotseeker_server.test.share_space import ShareSpaceTest
@@ -35,6 +35,7 @@ from spotseeker_server.views.image import ImageView
 from spotseeker_server.views.thumbnail import ThumbnailView
 from spotseeker_server.views.null import NullView
 from spotseeker_server.views.all_spots import AllSpotsView
+from spotseeker_server.views.clusters import ClusterView
 from spotseeker_server.views.schema_gen import SchemaGenView
 from spotseeker_server.views.favorites import FavoritesView
 from spotseeker_server.views.person import PersonView
@@ -46,6 +47,9 @@ urlpatterns = patterns('',
     url(r'v1/spot/(?P<spot_id>(\d+|external:[\w-]+))$', csrf_exempt(SpotView().run), name='spot'),
     url(r'v1/spot/?$', csrf_exempt(SearchView().run), name='spot-search'),
     url(r'v1/spot/all$', csrf_exempt(AllSpotsView().run), name='spots'),
+    url(r'v1/spot/clusters$', csrf_exempt(ClusterView().run), name='spot-clusters'),
+    url(r'v2/spot/?$', csrf_exempt(SearchView().run), {'version': 2}, name='spot-search-v2'),
+    url(r'v2/spot/all$', csrf_exempt(AllSpotsView().run), {'version': 2}, name='spots-v2'),
     url(r'v1/buildings/?$', csrf_exempt(BuildingListView().run), name='buildings'),
     url(r'v1/schema$', csrf_exempt(SchemaGenView().run), name='schema'),
     url(r'v1/spot/(?P<spot_id>\d+)/image$', csrf_exempt(AddImageView().run)),
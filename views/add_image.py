@@ -21,6 +21,7 @@
 from spotseeker_server.views.rest_dispatch import RESTDispatch, RESTException
 from spotseeker_server.models import SpotImage, Spot
 from django.http import HttpResponse
+from django.db import transaction
 from spotseeker_server.require_auth import *
 from PIL import Image
 
@@ -56,7 +57,9 @@ class AddImageView(RESTDispatch):
 
         args['image'] = request.FILES['image']
 
-        image = spot.spotimage_set.create(**args)
+        with transaction.commit_on_success():
+            image = spot.spotimage_set.create(**args)
+        spot.refresh_cached_json()
 
         response = HttpResponse(status=201)
         response["Location"] = image.rest_url()
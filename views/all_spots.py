@@ -18,18 +18,154 @@
     sbutler1@illinois.edu: adapt to the new RESTDispatch framework.
 """
 
-from spotseeker_server.views.rest_dispatch import RESTDispatch, JSONResponse
+from spotseeker_server.views.rest_dispatch import RESTDispatch, RESTException, JSONResponse, EncodedJSONResponse, iter_encoded_json_array, iter_spot_list, encode_cursor, spot_list_response
 from spotseeker_server.forms.spot import SpotForm
 from spotseeker_server.models import *
 from django.http import HttpResponse
+from django.db.models import Count, Max
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from spotseeker_server.require_auth import *
+from spotseeker_server import json_encoding
+from datetime import timedelta
+import hashlib
 
 
 class AllSpotsView(RESTDispatch):
-
+    """ Lists every Spot at /api/v1/spot/all.
+    GET returns 200 with a list of spots.
+    GET with modified_since=<ISO 8601 datetime> or sync_token=<token>
+    returns 200 with only the spots changed since then, the ids of the
+    spots deleted since then, and a sync_token for the next request.
+    Consecutive syncs overlap by SPOTSEEKER_SYNC_OVERLAP seconds, so a
+    spot may be sent again; clients should replace it by id.
+    Either can be paged in id order with page_size, following the Link
+    header of each page to the next, and fields picks the parts of each
+    spot to return.
+    At /api/v2/spot/all each of these is a v2 list envelope instead,
+    with the count of spots and the cursor of the next page.
+    """
     @app_auth_required
-    def GET(self, request):
-        spots = []
-        for spot in Spot.objects.all():
-            spots.append(spot.json_data_structure())
-        return JSONResponse(spots)
+    def GET(self, request, version=1):
+        page_size, cursor = self.page_params(request)
+        fields = self.spot_fields(request)
+        if 'sync_token' in request.GET or 'modified_since' in request.GET:
+            return self._get_changes(request, page_size, cursor, fields, version)
+        if page_size is not None:
+            return self._get_page(request, page_size, cursor, fields, version)
+
+        # Any change to a spot updates its last_modified, and removing
+        # one changes the count and leaves a tombstone
+        latest = Spot.objects.aggregate(count=Count('id'), last_modified=Max('last_modified'))
+        last_deleted = SpotTombstone.objects.aggregate(last=Max('deleted'))['last']
+        last_modified = latest['last_modified']
+        if last_deleted is not None and (last_modified is None or last_deleted > last_modified):
+            last_modified = last_deleted
+        etag = hashlib.sha1("all:%s:%s:%s" % (SPOT_CACHE_VERSION, latest['count'], last_modified and last_modified.isoformat())).hexdigest()
+        etag = self.version_etag(self.fields_etag(etag, fields), version)
+
+        response = self.not_modified(request, etag, last_modified)
+        if response is None:
+            def build():
+                if version == 2:
+                    batches = Spot.objects.iter_list_entries(fields=fields)
+                    return EncodedJSONResponse(iter_spot_list(batches, SpotListTables(), count=latest['count'], next=None))
+                return spot_list_response(Spot.objects.iter_batches(), fields)
+
+            response = self.cached_compressed_response(request, etag, build)
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    def _get_page(self, request, page_size, cursor, fields=None, version=1):
+        spots, next_cursor = self._page(Spot.objects.all(), page_size, cursor)
+
+        etag = self.collection_etag(spots)
+        etag = self.fields_etag(hashlib.sha1("page:%s:%s" % (etag, next_cursor)).hexdigest(), fields)
+        etag = self.version_etag(etag, version)
+        response = self.not_modified(request, etag)
+        if response is None:
+            if version == 2:
+                batches = [Spot.objects.list_entries_for(spots, fields=fields)]
+                response = EncodedJSONResponse(iter_spot_list(batches, SpotListTables(), count=Spot.objects.count(), next=encode_cursor(next_cursor)))
+            else:
+                response = spot_list_response([spots], fields)
+            self.set_validators(response, etag)
+        return self.set_next_page(request, response, next_cursor)
+
+    def _get_changes(self, request, page_size=None, cursor=None, fields=None, version=1):
+        since = request.GET.get('sync_token', request.GET.get('modified_since'))
+        since = self._parse_since(since)
+
+        if cursor:
+            # A later page of the same sync, which ends with the first
+            # page's sync_token
+            sync_token = cursor[1] if len(cursor) == 2 else None
+            if not isinstance(sync_token, basestring):
+                raise RESTException("Invalid cursor", 400)
+        else:
+            # Taken before reading anything, and set back by the sync
+            # overlap, so the next sync can't miss a change made while
+            # this one runs, or one committed late by a long transaction
+            # that stamped it earlier
+            overlap = getattr(settings, 'SPOTSEEKER_SYNC_OVERLAP', 60)
+            sync_token = (timezone.now() - timedelta(seconds=overlap)).isoformat()
+
+        # Deletions are only listed on the first page
+        deleted = []
+        if not cursor:
+            deleted = list(SpotTombstone.objects.filter(deleted__gte=since).values_list('spot_id', flat=True).distinct())
+        changed = Spot.objects.filter(last_modified__gte=since)
+
+        next_cursor = None
+        if page_size is None:
+            batches = Spot.objects.iter_batches(changed)
+        else:
+            page, next_cursor = self._page(changed, page_size, cursor)
+            batches = [page]
+            if next_cursor is not None:
+                next_cursor.append(sync_token)
+
+        if version == 2:
+            entries = (Spot.objects.list_entries_for(batch, fields=fields) for batch in batches)
+            body = iter_spot_list(entries, SpotListTables(), deleted=deleted, sync_token=sync_token, next=encode_cursor(next_cursor))
+            return self.set_next_page(request, EncodedJSONResponse(body), next_cursor)
+        spots = iter_encoded_json_array(Spot.objects.encoded_json_for(batch, fields=fields) for batch in batches)
+
+        def body():
+            yield '{"spots": '
+            for chunk in spots:
+                yield chunk
+            yield ', "deleted": %s, "sync_token": %s}' % (json_encoding.encode(deleted), json_encoding.encode(sync_token))
+
+        return self.set_next_page(request, EncodedJSONResponse(body()), next_cursor)
+
+    def _page(self, query, page_size, cursor):
+        """ Returns the spots in query after the id in cursor, up to
+        page_size of them, and the cursor for the next page (or None if
+        this is the last one).
+        """
+        query = query.order_by('pk')
+        if cursor:
+            if not isinstance(cursor[0], (int, long)):
+                raise RESTException("Invalid cursor", 400)
+            query = query.filter(pk__gt=cursor[0])
+
+        spots = list(query[:page_size + 1])
+        if len(spots) > page_size:
+            return spots[:page_size], [spots[page_size - 1].pk]
+        return spots, None
+
+    def _parse_since(self, value):
+        try:
+            since = parse_datetime(value)
+        except ValueError:
+            since = None
+        if since is None:
+            raise RESTException("Invalid modified_since or sync_token", 400)
+
+        if settings.USE_TZ and timezone.is_naive(since):
+            since = timezone.make_aware(since, timezone.get_default_timezone())
+        elif not settings.USE_TZ and timezone.is_aware(since):
+            since = timezone.make_naive(since, timezone.get_default_timezone())
+        return since
@@ -0,0 +1,73 @@
+""" Copyright 2014 UW Information Technology, University of Washington
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+from spotseeker_server.views.rest_dispatch import RESTDispatch, RESTException, JSONResponse
+from spotseeker_server.views.search import SearchView
+from spotseeker_server.forms.spot_search import SpotSearchForm
+from spotseeker_server.org_filters import SearchFilterChain
+from spotseeker_server.require_auth import *
+from spotseeker_server import geohash
+
+
+class ClusterView(RESTDispatch):
+    """ Groups the spots matching a search inside a bbox into geohash
+    cells sized for a map zoom level. Each cluster has the number of
+    spots, their centroid, and a sample of their ids. The search itself
+    is SearchView's, but only GET is allowed.
+    """
+    SAMPLE_SIZE = 5
+    MAX_ZOOM = 22
+
+    @app_auth_required
+    def GET(self, request):
+        form = SpotSearchForm(request.GET)
+        if not form.is_valid():
+            return JSONResponse([])
+
+        if 'bbox' not in request.GET or 'zoom' not in request.GET:
+            raise RESTException("Must specify bbox and zoom", 400)
+        try:
+            zoom = int(request.GET['zoom'])
+        except ValueError:
+            raise RESTException("zoom must be a number", 400)
+        if zoom < 0 or zoom > self.MAX_ZOOM:
+            raise RESTException("zoom must be between 0 and %s" % self.MAX_ZOOM, 400)
+        precision = geohash.precision_for_zoom(zoom)
+
+        chain = SearchFilterChain(request)
+        query, has_valid_search_param, bbox = SearchView().search_query(request, chain)
+        query = query.only('id', 'latitude', 'longitude', 'geohash').order_by('id')
+        spots = chain.filter_results(set(query))
+
+        clusters = {}
+        for spot in sorted(spots, key=lambda spot: spot.pk):
+            cell = spot.geohash[:precision]
+            if cell not in clusters:
+                clusters[cell] = {'geohash': cell, 'count': 0, 'latitude': 0.0, 'longitude': 0.0, 'spot_ids': []}
+            cluster = clusters[cell]
+            cluster['count'] += 1
+            cluster['latitude'] += float(spot.latitude)
+            cluster['longitude'] += float(spot.longitude)
+            if len(cluster['spot_ids']) < self.SAMPLE_SIZE:
+                cluster['spot_ids'].append(spot.pk)
+
+        for cluster in clusters.values():
+            cluster['latitude'] = round(cluster['latitude'] / cluster['count'], 6)
+            cluster['longitude'] = round(cluster['longitude'] / cluster['count'], 6)
+
+        return JSONResponse({
+            'precision': precision,
+            'clusters': [clusters[cell] for cell in sorted(clusters)],
+        })
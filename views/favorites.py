@@ -14,7 +14,7 @@
 
 """
 
-from spotseeker_server.views.rest_dispatch import RESTDispatch, JSONResponse
+from spotseeker_server.views.rest_dispatch import RESTDispatch, JSONResponse, spot_list_response
 from spotseeker_server.require_auth import user_auth_required
 from spotseeker_server.models import Spot, FavoriteSpot
 from django.http import HttpResponse
@@ -60,16 +60,18 @@ class FavoritesView(RESTDispatch):
 
     def _get_all_favorites(self, request):
         user = self._get_user(request)
-        favorites = []
 
-        objects = FavoriteSpot.objects.filter(user = user)
-
-        for fav in objects:
-            if hasattr(fav, 'spot'):
-                json = fav.spot.json_data_structure()
-                favorites.append(fav.spot.json_data_structure())
-
-        return JSONResponse(favorites)
+        objects = FavoriteSpot.objects.filter(user=user).select_related('spot')
+        spots = [fav.spot for fav in objects if hasattr(fav, 'spot')]
+        fields = self.spot_fields(request)
+
+        etag = self.collection_etag(spots)
+        etag = self.fields_etag(etag, fields)
+        response = self.not_modified(request, etag)
+        if response is None:
+            response = spot_list_response([spots], fields)
+            self.set_validators(response, etag)
+        return response
 
     def _get_is_favorite(self, request, spot_id):
         user = self._get_user(request)
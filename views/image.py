@@ -20,6 +20,7 @@
 
 from spotseeker_server.views.rest_dispatch import RESTDispatch, RESTException, JSONResponse
 from django.http import HttpResponse
+from django.db import transaction
 from django.utils.http import http_date
 from django.core.servers.basehttp import FileWrapper
 from django.core.exceptions import ValidationError
@@ -72,7 +73,9 @@ class ImageView(RESTDispatch):
             img.description = request.POST["description"]
         if "display_index" in request.POST:
             img.display_index = request.POST["display_index"]
-        img.save()
+        with transaction.commit_on_success():
+            img.save()
+        spot.refresh_cached_json()
 
         return self.GET(request, spot_id, image_id)
 
@@ -87,6 +90,8 @@ class ImageView(RESTDispatch):
 
         self.validate_etag(request, img)
 
-        img.delete()
+        with transaction.commit_on_success():
+            img.delete()
+        spot.refresh_cached_json()
 
         return HttpResponse(status=200)
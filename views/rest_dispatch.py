@@ -25,9 +25,27 @@
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.conf import settings
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.encoding import smart_str
+from django.utils.http import http_date, parse_http_date_safe
+from spotseeker_server.models import Spot, parse_spot_fields, compressed_cache_key
+from spotseeker_server import json_encoding
+from spotseeker_server import binary_encoding
 import simplejson as json
 import traceback
+import base64
+import calendar
+import hashlib
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 class JSONResponse(HttpResponse):
@@ -38,16 +56,198 @@ class JSONResponse(HttpResponse):
 
     def __init__(self, content='', *args, **kwargs):
         if content != '':
-            if settings.DEBUG and settings.JSON_PRETTY_PRINT:
-                content = json.dumps(content, sort_keys=True, indent=4 * ' ')
-            else:
-                content = json.dumps(content)
+            content = self.serialize(content)
 
         if not kwargs.get('content_type', None):
             kwargs['content_type'] = 'application/json'
 
         super(JSONResponse, self).__init__(content, *args, **kwargs)
 
+    def serialize(self, content):
+        pretty = settings.DEBUG and settings.JSON_PRETTY_PRINT
+        return json_encoding.encode(content, pretty)
+
+
+class EncodedJSONResponse(JSONResponse):
+    """
+    A JSONResponse for content that is already encoded as JSON, for
+    example cached spot JSON. The content may also be an iterator of
+    encoded chunks, which are streamed to the client. It is only
+    decoded again to pretty print it.
+    """
+
+    def serialize(self, content):
+        if settings.DEBUG and settings.JSON_PRETTY_PRINT:
+            if not isinstance(content, basestring):
+                content = ''.join(content)
+            return super(EncodedJSONResponse, self).serialize(json.loads(content, use_decimal=True))
+        else:
+            return content
+
+
+def encoded_json_array(fragments):
+    """
+    Joins already encoded JSON values into an encoded JSON array, the
+    same as json.dumps would produce for the decoded values.
+    """
+    return '[' + ', '.join(fragments) + ']'
+
+
+def iter_encoded_json_array(batches):
+    """
+    Like encoded_json_array, but takes an iterable of batches of
+    encoded JSON values and yields the array one chunk per batch.
+    """
+    yield '['
+    separator = ''
+    for fragments in batches:
+        if fragments:
+            yield separator + ', '.join(fragments)
+            separator = ', '
+    yield ']'
+
+
+def spot_response(spot, fields=None):
+    """
+    An EncodedJSONResponse of a spot's JSON, or the given fields of it.
+    The response keeps the spot, so a binary form of it can be made from
+    the spot's cached binary encoding.
+    """
+    response = EncodedJSONResponse(spot.encoded_json_data_structure(fields))
+    response.spots = ([[spot]], fields, False)
+    return response
+
+
+def spot_list_response(batches, fields=None):
+    """
+    An EncodedJSONResponse of the list of spots in batches, a list or
+    an iterator of lists of spots. From an iterator, the JSON is only
+    built as it is streamed, a batch at a time. Like spot_response, the
+    response keeps the batches, so a binary form can be made from the
+    spots' cached binary encodings instead.
+    """
+    encoded = (Spot.objects.encoded_json_for(batch, fields=fields) for batch in batches)
+    if isinstance(batches, list):
+        response = EncodedJSONResponse(encoded_json_array([spot_json for batch in encoded for spot_json in batch]))
+    else:
+        response = EncodedJSONResponse(iter_encoded_json_array(encoded))
+    response.spots = (batches, fields, True)
+    return response
+
+
+def iter_spot_list(batches, tables, **values):
+    """
+    Yields the encoded v2 spot list envelope: the entries built by
+    tables (a SpotListTables) for batches of SpotListEntry (see
+    Spot.objects.list_entries_for), then the lookup tables, and the
+    other values given, such as count and next.
+    """
+    yield '{"spots": '
+    for chunk in iter_encoded_json_array(tables.encoded_entries(batch) for batch in batches):
+        yield chunk
+    # The tables are only complete once every entry is built
+    values.update(tables.json_data_structure())
+    yield ', ' + json_encoding.encode(values)[1:]
+
+
+def encode_cursor(cursor):
+    """
+    The opaque form of a cursor (a list of the last sort key of a page)
+    given to clients, or None if there is no next page.
+    """
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursor)).rstrip('=')
+
+
+def parse_etags(value):
+    """
+    Parses the value of an If-Match or If-None-Match header into the
+    list of the ETags in it, as the objects they are for have them. A
+    response in a binary format or compressed has its object's ETag
+    followed by ;<format> and ;<encoding> (see variant_etag), so those
+    are dropped, along with any quotes or W/ prefix.
+    """
+    etags = []
+    for tag in value.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"').split(';')[0]
+        if tag:
+            etags.append(tag)
+    return etags
+
+
+def variant_etag(etag, variant):
+    """
+    The ETag of a representation of something with the given etag,
+    re-encoded or compressed as named by variant.
+    """
+    return "%s;%s" % (etag, variant)
+
+
+def parse_quality_list(value):
+    """
+    Parses the value of an Accept or Accept-Encoding header into a dict
+    of the (lower case) names in it and their q-values.
+    """
+    accepted = {}
+    for item in value.split(','):
+        params = item.split(';')
+        name = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            key, _, param_value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name] = quality
+    return accepted
+
+
+def compression_encodings():
+    """
+    The Content-Encodings responses can be compressed with, most
+    preferred first. br needs the brotli module.
+    """
+    if brotli is None:
+        return ('gzip',)
+    return ('br', 'gzip')
+
+
+def compress(content, encoding, best=False):
+    """
+    Compresses content with the given Content-Encoding. With best, it
+    is compressed as small as possible, which is slower and only worth
+    it for bodies that are cached.
+    """
+    return ''.join(iter_compressed([content], encoding, best))
+
+
+def iter_compressed(chunks, encoding, best=False):
+    """
+    Like compress, but takes an iterable of chunks of content and
+    yields the compressed stream as each chunk is compressed.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=11 if best else 5)
+        compress_chunk, finish = compressor.process, compressor.finish
+    else:
+        # wbits of 16 + MAX_WBITS writes a gzip header (without a
+        # timestamp, so a body always compresses the same)
+        compressor = zlib.compressobj(9 if best else 6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress_chunk, finish = compressor.compress, compressor.flush
+
+    for chunk in chunks:
+        data = compress_chunk(smart_str(chunk))
+        if data:
+            yield data
+    yield finish()
+
 
 class RESTException(Exception):
     """
@@ -107,7 +307,8 @@ class RESTDispatch:
             json_values = self.json_error(e)
             response = JSONResponse(json_values, status=500)
 
-        return response
+        response = self.binary_response(request, response)
+        return self.compress_response(request, response)
 
     def json_error(self, ex):
         json_values = {"error": str(ex)}
@@ -124,9 +325,302 @@ class RESTDispatch:
             else:
                 request.META["HTTP_IF_MATCH"] = request.META["If_Match"]
 
-        if request.META["HTTP_IF_MATCH"] != obj.etag:
+        if obj.etag not in parse_etags(request.META["HTTP_IF_MATCH"]):
             raise RESTException("Invalid ETag", 409)
 
+    def not_modified(self, request, etag=None, last_modified=None):
+        """
+        Handles a conditional GET. Returns a 304 response if the client's
+        If-None-Match (or, without one, If-Modified-Since) shows it
+        already has the current representation, otherwise None. Call
+        this before building the body, and set_validators on the full
+        response.
+        """
+        response = None
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+
+        if if_none_match is not None:
+            if etag is not None:
+                tags = parse_etags(if_none_match)
+                if '*' in tags or etag in tags:
+                    response = HttpResponseNotModified()
+        elif if_modified_since is not None and last_modified is not None:
+            if_modified_since = parse_http_date_safe(if_modified_since)
+            if if_modified_since is not None and int(self._timestamp(last_modified)) <= if_modified_since:
+                response = HttpResponseNotModified()
+
+        if response is not None:
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    def accepted_encoding(self, request):
+        """
+        Returns the Content-Encoding to compress the response to request
+        with, chosen by its Accept-Encoding, or None to leave it
+        uncompressed. Nothing is compressed unless
+        SPOTSEEKER_COMPRESS_RESPONSES is on.
+        """
+        if not getattr(settings, 'SPOTSEEKER_COMPRESS_RESPONSES', False):
+            return None
+
+        accepted = parse_quality_list(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        best = None
+        for encoding in compression_encodings():
+            quality = accepted.get(encoding, accepted.get('*', 0.0))
+            if quality > 0 and (best is None or quality > best[0]):
+                best = (quality, encoding)
+        return best and best[1]
+
+    def compress_response(self, request, response):
+        """
+        Compresses a JSON response in the encoding the client accepts
+        (see accepted_encoding). Streamed bodies are compressed as they
+        are streamed. Bodies shorter than SPOTSEEKER_COMPRESS_MIN_SIZE
+        bytes are left as they are.
+
+        The ETag of any response to a client that accepts an encoding,
+        including a 304 and a body too short to compress, is marked with
+        the encoding, so the client sees one ETag for the representation
+        it gets whichever way it is answered.
+        """
+        encoding = self.accepted_encoding(request)
+        if encoding is None:
+            return response
+        if response.status_code != 304:
+            content_type = response.get('Content-Type', '').split(';')[0]
+            if content_type != 'application/json' and content_type not in binary_encoding.MEDIA_TYPES:
+                return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.has_header('ETag'):
+            response['ETag'] = variant_etag(response['ETag'], encoding)
+
+        if response.status_code == 304 or response.has_header('Content-Encoding'):
+            return response
+        if response._base_content_is_iter:
+            response.content = iter_compressed(response._container, encoding)
+            if response.has_header('Content-Length'):
+                del response['Content-Length']
+        else:
+            content = response.content
+            if len(content) < getattr(settings, 'SPOTSEEKER_COMPRESS_MIN_SIZE', 200):
+                return response
+            response.content = compress(content, encoding)
+            response['Content-Length'] = str(len(response.content))
+        response['Content-Encoding'] = encoding
+        return response
+
+    def accepted_format(self, request):
+        """
+        Returns the binary format (see binary_encoding) the client would
+        rather have than JSON, going by its Accept header, or None to
+        send JSON. JSON is kept when they are equally acceptable, and is
+        always sent unless SPOTSEEKER_BINARY_RESPONSES is on.
+        """
+        if not getattr(settings, 'SPOTSEEKER_BINARY_RESPONSES', False):
+            return None
+
+        accepted = parse_quality_list(request.META.get('HTTP_ACCEPT', ''))
+
+        def quality(media_type):
+            for media_range in (media_type, media_type.split('/')[0] + '/*', '*/*'):
+                if media_range in accepted:
+                    return accepted[media_range]
+            return 0.0
+
+        best = (quality('application/json'), None)
+        for media_type in sorted(binary_encoding.MEDIA_TYPES):
+            if quality(media_type) > best[0]:
+                best = (quality(media_type), binary_encoding.MEDIA_TYPES[media_type])
+        return best[1]
+
+    def binary_response(self, request, response):
+        """
+        Re-encodes a JSON response in the binary format the client asked
+        for (see accepted_format). A response made by spot_response or
+        spot_list_response is put together from the spots' cached binary
+        encodings; any other is decoded from its JSON. The ETag of a 304
+        is marked with the format just as the full response's would be.
+        """
+        if not getattr(settings, 'SPOTSEEKER_BINARY_RESPONSES', False):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0]
+        if response.status_code == 304:
+            content_type = None
+        elif content_type != 'application/json' and content_type not in binary_encoding.MEDIA_TYPES:
+            return response
+        patch_vary_headers(response, ('Accept',))
+
+        binary_format = self.accepted_format(request)
+        if binary_format is None:
+            return response
+
+        if content_type == 'application/json':
+            binary = HttpResponse(self._binary_content(response, binary_format), content_type=binary_format.media_type, status=response.status_code)
+            for header, value in response.items():
+                if header.lower() not in ('content-type', 'content-length'):
+                    binary[header] = value
+            response = binary
+        elif content_type is not None and content_type != binary_format.media_type:
+            return response
+
+        if response.has_header('ETag'):
+            response['ETag'] = variant_etag(response['ETag'], binary_format.name)
+        return response
+
+    def _binary_content(self, response, binary_format):
+        spots = getattr(response, 'spots', None)
+        if spots is not None:
+            batches, fields, many = spots
+            fragments = []
+            for batch in batches:
+                fragments.extend(Spot.objects.encoded_binary_for(batch, binary_format, fields))
+            if many:
+                return binary_format.array(fragments)
+            if fragments:
+                return fragments[0]
+
+        content = response.content
+        if not content:
+            return ''
+        return binary_format.encode(json.loads(content))
+
+    def cached_compressed_response(self, request, etag, build):
+        """
+        Returns the response built by calling build, for a JSON body
+        that is the same for as long as its ETag is etag. When the
+        client accepts a compressed response, the compressed body (in
+        the format it asked for) is kept in the cache under the ETag,
+        and later requests are answered from it without building,
+        re-encoding or compressing anything.
+        """
+        encoding = self.accepted_encoding(request)
+        if encoding is None:
+            return build()
+
+        binary_format = self.accepted_format(request)
+        if binary_format is None:
+            format_name, content_type = 'json', 'application/json'
+        else:
+            format_name, content_type = binary_format.name, binary_format.media_type
+
+        key = compressed_cache_key(etag, encoding, format_name)
+        body = cache.get(key)
+        if body is None:
+            response = self.binary_response(request, build())
+            if response.status_code != 200:
+                return response
+            body = ''.join(iter_compressed(response._container, encoding, best=True))
+            cache.set(key, body)
+
+        response = HttpResponse(body, content_type=content_type)
+        response['Content-Encoding'] = encoding
+        response['Content-Length'] = str(len(body))
+        return response
+
+    def set_validators(self, response, etag=None, last_modified=None):
+        """Sets the ETag and Last-Modified headers of a response."""
+        if etag is not None:
+            response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(self._timestamp(last_modified))
+        return response
+
+    def collection_etag(self, objs):
+        """
+        Returns the etag of a list of objects that each have an etag,
+        which changes when any member's etag changes, or members are
+        added or removed. Collections have no Last-Modified, as the
+        newest member's last_modified doesn't change when one is
+        removed.
+        """
+        objs = sorted(objs, key=lambda obj: obj.pk)
+        return hashlib.sha1(' '.join("%s:%s" % (obj.pk, obj.etag) for obj in objs)).hexdigest()
+
+    def spot_fields(self, request):
+        """
+        Returns the parsed fields parameter of a request (see
+        parse_spot_fields), or None if whole spots are wanted.
+        """
+        if 'fields' not in request.GET:
+            return None
+        try:
+            return parse_spot_fields(request.GET['fields'])
+        except ValueError as e:
+            raise RESTException(str(e), 400)
+
+    def fields_etag(self, etag, fields):
+        """
+        The ETag of the representation of something with the given etag
+        that has only the given fields of its spots.
+        """
+        if fields is None:
+            return etag
+        names = sorted(name if keys is None else ','.join("%s.%s" % (name, key) for key in sorted(keys)) for name, keys in fields.items())
+        return hashlib.sha1("fields:%s:%s" % (':'.join(names), etag)).hexdigest()
+
+    def version_etag(self, etag, version):
+        """
+        The ETag of the given version of a spot list with the given etag
+        in its first version.
+        """
+        if version == 1:
+            return etag
+        return hashlib.sha1("v%s:%s" % (version, etag)).hexdigest()
+
+    def page_params(self, request):
+        """
+        Returns the page_size (or None, if the client isn't paging) and
+        the decoded cursor (or None, for the first page) of a request.
+        A cursor is the sort key of the last item of the previous page,
+        so the next page can start from it with an indexed query.
+        """
+        if 'page_size' not in request.GET:
+            if 'cursor' in request.GET:
+                raise RESTException("cursor needs a page_size", 400)
+            return None, None
+
+        max_page_size = getattr(settings, 'SPOTSEEKER_MAX_PAGE_SIZE', 1000)
+        try:
+            page_size = int(request.GET['page_size'])
+        except ValueError:
+            raise RESTException("page_size must be a number", 400)
+        if page_size < 1 or page_size > max_page_size:
+            raise RESTException("page_size must be from 1 to %s" % max_page_size, 400)
+
+        cursor = None
+        if 'cursor' in request.GET:
+            try:
+                value = request.GET['cursor']
+                cursor = json.loads(base64.urlsafe_b64decode(str(value) + '=' * (-len(value) % 4)))
+            except (TypeError, ValueError, UnicodeEncodeError):
+                cursor = None
+            if not isinstance(cursor, list):
+                raise RESTException("Invalid cursor", 400)
+        return page_size, cursor
+
+    def set_next_page(self, request, response, cursor):
+        """
+        Adds a Link header to response pointing to the next page, the
+        same request with cursor (a list of the last sort key) encoded.
+        Nothing is added on the last page, where cursor is None.
+        """
+        if cursor is None:
+            return response
+
+        params = request.GET.copy()
+        params['cursor'] = encode_cursor(cursor)
+        url = request.build_absolute_uri("%s?%s" % (request.path, params.urlencode()))
+        response['Link'] = '<%s>; rel="next"' % url
+        return response
+
+    def _timestamp(self, value):
+        """Seconds since the epoch for a (naive or aware) datetime."""
+        if timezone.is_aware(value):
+            return calendar.timegm(value.utctimetuple())
+        else:
+            return time.mktime(value.timetuple())
+
     def _get_user(self, request):
         if not 'SS_OAUTH_USER' in request.META:
             print request.META
@@ -21,49 +21,485 @@
         support (hooks).
 """
 
-from spotseeker_server.views.rest_dispatch import RESTDispatch, RESTException, JSONResponse
+from spotseeker_server.views.rest_dispatch import RESTDispatch, RESTException, JSONResponse, EncodedJSONResponse, iter_spot_list, encode_cursor, spot_list_response
 from spotseeker_server.forms.spot_search import SpotSearchForm
 from spotseeker_server.views.spot import SpotView
 from spotseeker_server.org_filters import SearchFilterChain
 from django.http import HttpResponse, HttpResponseBadRequest
 from django.db.models import Q
 from spotseeker_server.require_auth import *
-from spotseeker_server.models import Spot, SpotType
+from spotseeker_server.models import Spot, SpotType, SpotListTables, search_cache_key
+from spotseeker_server.search_snapshot import get_snapshot
+from django.conf import settings
+from django.core.cache import cache
+from spotseeker_server import geohash
+from spotseeker_server import opening_hours
 from pyproj import Geod
 from decimal import *
 from time import *
 from datetime import datetime
+from array import array
+from operator import itemgetter, attrgetter
+from collections import namedtuple
+import simplejson as json
+import hashlib
+import heapq
+import logging
 import sys
 
+logger = logging.getLogger(__name__)
+
+# The fields of a spot in a format=compact search, plus its validators
+CompactSpot = namedtuple('CompactSpot', ['pk', 'latitude', 'longitude', 'capacity', 'etag', 'last_modified'])
+
+# A search by distance from a point: the center, the radius in metres,
+# and the (south, west, north, east) box that holds the circle
+SearchCircle = namedtuple('SearchCircle', ['longitude', 'latitude', 'radius', 'box'])
+
 
 class SearchView(RESTDispatch):
     """ Handles searching for Spots with particular attributes based on a query string.
     """
+    # Metres searched around the center for the first nearest ring, and
+    # the distance past which the nearest search stops using a box
+    NEAREST_START_DISTANCE = 100
+    NEAREST_MAX_DISTANCE = 2000000
+
+    # The parameters the in-memory snapshot can search on, besides
+    # extended_info:
+    SNAPSHOT_KEYS = set([
+        "expand_radius", "nearest", "format", "bbox", "distance",
+        "center_latitude", "center_longitude", "limit", "open_anytime",
+        "open_now", "open_until", "open_at", "capacity", "type",
+        "building_name", "id", "fields",
+    ])
+
     @user_auth_required
     @admin_auth_required
-    def POST(self, request):
+    def POST(self, request, version=1):
         return SpotView().run(request)
 
     @app_auth_required
-    def GET(self, request):
+    def GET(self, request, version=1):
         form = SpotSearchForm(request.GET)
-        has_valid_search_param = False
 
         if not form.is_valid():
-            return JSONResponse([])
+            return self.empty_response(version)
 
         if len(request.GET) == 0:
-            return JSONResponse([])
+            return self.empty_response(version)
+        page_size, cursor = self.page_params(request)
+        fields = self.spot_fields(request)
+        if getattr(settings, 'SPOTSEEKER_SEARCH_CACHE', False):
+            request.GET = self.round_coordinates(request.GET)
         chain = SearchFilterChain(request)
+
+        limit = 20
+        if 'limit' in request.GET:
+            if request.GET['limit'] == '0':
+                limit = 0
+            else:
+                limit = int(request.GET['limit'])
+
+        nearest = None
+        if 'nearest' in request.GET:
+            if 'center_longitude' not in request.GET or 'center_latitude' not in request.GET:
+                raise RESTException("Must specify latitude and longitude to find the nearest spots", 400)
+            try:
+                nearest = int(request.GET['nearest'])
+                center_longitude = float(request.GET['center_longitude'])
+                center_latitude = float(request.GET['center_latitude'])
+                start_distance = float(request.GET.get('distance', self.NEAREST_START_DISTANCE))
+            except ValueError:
+                raise RESTException("nearest, latitude, longitude and distance must be numbers", 400)
+            if nearest < 1 or start_distance <= 0:
+                raise RESTException("nearest and distance must be greater than 0", 400)
+            nearest = (nearest, center_longitude, center_latitude, start_distance)
+        elif 'distance' in request.GET or 'center_longitude' in request.GET or 'center_latitude' in request.GET:
+            if 'distance' not in request.GET or 'center_longitude' not in request.GET or 'center_latitude' not in request.GET:
+                # If distance, lat, or long are specified in the server request; all 3 must be present.
+                raise RESTException("Must specify latitude, longitude, and distance", 400)
+
+        compact = request.GET.get('format') == 'compact'
+        types = None
+        next_cursor = None
+        cache_key, cache_timeout = self.search_cache_key(request)
+        spot_ids = cache.get(cache_key) if cache_key else None
+        if page_size is not None:
+            spots, next_cursor = self.page_spots(request, chain, page_size, cursor, nearest)
+        elif spot_ids is not None:
+            spots = self.cached_spots(spot_ids)
+        elif self.use_snapshot(request, chain):
+            snapshot = get_snapshot()
+            with snapshot.lock:
+                snapshot.refresh()
+                snapshot = snapshot.view()
+            spots = self.snapshot_spots(request, snapshot, limit, nearest)
+            if compact and spots is not None:
+                types = snapshot.types_of(spots)
+        else:
+            spots = self.query_spots(request, chain, limit, nearest, compact)
+
+        if spots is None:
+            return self.empty_response(version)
+        if cache_key and spot_ids is None:
+            cache.set(cache_key, [spot.pk for spot in spots], cache_timeout)
+
+        etag = self.collection_etag(spots)
+        if compact:
+            etag = hashlib.sha1("compact:%s" % etag).hexdigest()
+        if page_size is not None:
+            etag = hashlib.sha1("page:%s:%s" % (etag, next_cursor)).hexdigest()
+        if not compact:
+            etag = self.version_etag(self.fields_etag(etag, fields), version)
+        response = self.not_modified(request, etag)
+        if response is None:
+            if compact:
+                response = JSONResponse(self.compact_columns(spots, types))
+            elif version == 2:
+                # A paged search's total would mean running all of it
+                count = len(spots) if page_size is None else None
+                batches = [Spot.objects.list_entries_for(spots, fields=fields)]
+                response = EncodedJSONResponse(iter_spot_list(batches, SpotListTables(), count=count, next=encode_cursor(next_cursor)))
+            else:
+                response = spot_list_response([spots], fields)
+            self.set_validators(response, etag)
+        return self.set_next_page(request, response, next_cursor)
+
+    def query_spots(self, request, chain, limit, nearest, compact):
+        """ Runs the search as a database query. Returns the matching
+        spots (as CompactSpots if compact), or None if the search has no
+        valid search parameter.
+        """
+        query, has_valid_search_param, bbox = self.search_query(request, chain)
+
+        radius = None
+        circle = self.search_circle(request)
+        if nearest is not None:
+            has_valid_search_param = True
+        elif circle is not None:
+            has_valid_search_param = True
+            distance_query = self.filter_box(query, *circle.box)
+            if self.within_radius(request, distance_query.exists()):
+                query = distance_query
+                radius = circle.radius
+            else:
+                # If we're querying everything, let's make sure we only return a limited number of spaces...
+                limit = 10
+
+        if not has_valid_search_param:
+            return None
+
+        if nearest is not None:
+            return self.nearest_spots(query, chain, *nearest)
+
+        if compact:
+            spots = self.compact_spots(query)
+        else:
+            spots = list(query)
+        spots = self.rank(request, spots, bbox, radius, limit)
+
+        if compact:
+            if chain.filters:
+                # The org filters need Spot objects to filter
+                allowed = set(spot.pk for spot in chain.filter_results(set(query.only('id'))))
+                spots = [spot for spot in spots if spot.pk in allowed]
+            spots.sort(key=attrgetter('pk'))
+            return spots
+        else:
+            return chain.filter_results(set(spots))
+
+    def empty_response(self, version):
+        """ The response to a search that finds nothing. """
+        if version == 2:
+            return EncodedJSONResponse(iter_spot_list([], SpotListTables(), count=0, next=None))
+        return JSONResponse([])
+
+    def page_spots(self, request, chain, page_size, cursor, nearest):
+        """ Runs the search one page at a time, in id order, or closest
+        first for a nearest search. Each page is a query starting after
+        the sort key in cursor, fetching no more than one page (and one
+        spot to tell if there is another) at a time. Returns the page's
+        spots and the cursor for the next page (None on the last page),
+        or (None, None) if the search has no valid search parameter.
+        """
+        query, has_valid_search_param, bbox = self.search_query(request, chain)
+        if nearest is not None:
+            return self.nearest_page(query, chain, page_size, cursor, *nearest)
+
+        radius = None
+        circle = self.search_circle(request)
+        if circle is not None:
+            has_valid_search_param = True
+            distance_query = self.filter_box(query, *circle.box)
+            if self.within_radius(request, distance_query.exists()):
+                query = distance_query
+                radius = circle.radius
+
+        if not has_valid_search_param:
+            return None, None
+
+        after = None
+        if cursor:
+            if len(cursor) != 1 or not isinstance(cursor[0], (int, long)):
+                raise RESTException("Invalid cursor", 400)
+            after = cursor[0]
+
+        query = query.order_by('pk').distinct()
+        spots = []
+        while len(spots) <= page_size:
+            wanted = page_size + 1 - len(spots)
+            batch = list(query.filter(pk__gt=after)[:wanted] if after is not None else query[:wanted])
+            if not batch:
+                break
+            after = batch[-1].pk
+
+            found = batch
+            if radius is not None:
+                # The bounding box also has corners outside of the radius
+                found = [spot for dist, spot in zip(self.distances(found, circle.longitude, circle.latitude), found) if dist <= radius]
+            spots.extend(sorted(chain.filter_results(set(found)), key=attrgetter('pk')))
+            if len(batch) < wanted:
+                break
+
+        if len(spots) > page_size:
+            return spots[:page_size], [spots[page_size - 1].pk]
+        return spots, None
+
+    def nearest_page(self, query, chain, page_size, cursor, count, longitude, latitude, distance):
+        """ A page of a nearest search, closest first. The cursor holds
+        the distance and id of the last spot, and how many of the count
+        spots have been returned.
+        """
+        after = None
+        returned = 0
+        if cursor:
+            if len(cursor) != 3 or not all(isinstance(value, (int, long, float)) for value in cursor):
+                raise RESTException("Invalid cursor", 400)
+            after = (float(cursor[0]), cursor[1])
+            returned = int(cursor[2])
+            # Nothing closer than the last spot is wanted
+            distance = max(distance, after[0])
+
+        wanted = min(page_size, count - returned)
+        if wanted <= 0:
+            return [], None
+        spots = self.nearest_spots(query, chain, wanted + 1, longitude, latitude, distance, after)
+
+        if len(spots) > wanted and returned + wanted < count:
+            last = spots[wanted - 1]
+            return spots[:wanted], [self.distances([last], longitude, latitude)[0], last.pk, returned + wanted]
+        return spots[:wanted], None
+
+    def round_coordinates(self, params):
+        """ A copy of the search parameters with the center and bbox
+        coordinates rounded to SPOTSEEKER_SEARCH_CACHE_COORDINATE_PRECISION
+        decimal places, so that searches from nearby points find the
+        same spots and share a cached result.
+        """
+        precision = getattr(settings, 'SPOTSEEKER_SEARCH_CACHE_COORDINATE_PRECISION', 4)
+        params = params.copy()
+        for key in ('center_latitude', 'center_longitude', 'bbox'):
+            if key in params:
+                try:
+                    params[key] = ','.join("%.*f" % (precision, float(value)) for value in params[key].split(','))
+                except ValueError:
+                    # Left for the search to reject
+                    pass
+        return params
+
+    def search_cache_key(self, request):
+        """ Returns the cache key for the ids of the spots a search finds
+        and how long to keep them, or (None, None) if search results
+        aren't cached. The key is built from the sorted parameters,
+        leaving out the OAuth ones, and changes with the search cache
+        generation. An open_now search is keyed to the current minute.
+        """
+        if not getattr(settings, 'SPOTSEEKER_SEARCH_CACHE', False) or 'page_size' in request.GET:
+            return None, None
+
+        params = sorted((key, value) for key in request.GET if not key.startswith('oauth_') for value in request.GET.getlist(key))
+        timeout = getattr(settings, 'SPOTSEEKER_SEARCH_CACHE_TIMEOUT', 300)
+        if 'open_now' in request.GET:
+            params.append(('open_now:minute', strftime("%Y-%m-%dT%H:%M", localtime())))
+            timeout = min(timeout, 60)
+
+        return search_cache_key(json.dumps(params)), timeout
+
+    def cached_spots(self, spot_ids):
+        """ Loads the CompactSpots for a cached search result, in the
+        order of spot_ids.
+        """
+        found = {}
+        for start in range(0, len(spot_ids), Spot.objects.JSON_BATCH_SIZE):
+            batch = spot_ids[start:start + Spot.objects.JSON_BATCH_SIZE]
+            found.update((spot.pk, spot) for spot in self.compact_spots(Spot.objects.filter(pk__in=batch)))
+        return [found[spot_id] for spot_id in spot_ids if spot_id in found]
+
+    def use_snapshot(self, request, chain):
+        """ Whether the search can be answered from the in-memory
+        snapshot of the spots: the snapshot is turned on, there are no
+        org filters, and every parameter is one the snapshot handles.
+        """
+        if not getattr(settings, 'SPOTSEEKER_SEARCH_SNAPSHOT', False) or chain.filters:
+            return False
+        for key in request.GET:
+            if not (key in self.SNAPSHOT_KEYS or key.startswith('oauth_') or key.startswith('extended_info:')):
+                return False
+        return True
+
+    def snapshot_spots(self, request, snapshot, limit, nearest):
+        """ Runs the search against a refreshed SpotSnapshot, the same way
+        query_spots runs it against the database. Returns the matching
+        SnapshotSpots, or None if the search has no valid search
+        parameter.
+        """
+        bits = snapshot.alive
+        has_valid_search_param = False
+        bbox = None
+
+        for key in request.GET:
+            if key == "bbox":
+                bbox = self.parse_bbox(request.GET[key])
+                bits &= snapshot.in_box(*bbox)
+                has_valid_search_param = True
+            elif key in ("open_now", "open_until", "open_at"):
+                window = self.open_window(request, key)
+                if window is not None:
+                    bits &= snapshot.open_for(*window)
+                    has_valid_search_param = True
+            elif key == "capacity":
+                try:
+                    bits &= snapshot.with_capacity(int(request.GET["capacity"]))
+                    has_valid_search_param = True
+                except ValueError:
+                    pass
+            elif key == "type":
+                bits &= snapshot.with_types(request.GET.getlist(key))
+                has_valid_search_param = True
+            elif key == "building_name":
+                bits &= snapshot.with_building_names(request.GET.getlist(key))
+                has_valid_search_param = True
+            elif key.startswith('extended_info:'):
+                bits &= snapshot.with_extended_info(key[14:], request.GET.getlist(key))
+                has_valid_search_param = True
+            elif key == "id":
+                bits &= snapshot.with_ids([int(spot_id) for spot_id in request.GET.getlist(key)])
+                has_valid_search_param = True
+
+        radius = None
+        circle = self.search_circle(request)
+        if nearest is not None:
+            count, longitude, latitude, start_distance = nearest
+            spots = snapshot.get(bits)
+            ranked = [(dist, spot) for dist, spot in zip(self.distances(spots, longitude, latitude), spots) if dist < float('inf')]
+            return [spot for dist, spot in heapq.nsmallest(count, ranked, key=itemgetter(0))]
+        elif circle is not None:
+            has_valid_search_param = True
+            box_bits = bits & snapshot.in_box(*circle.box)
+            if self.within_radius(request, box_bits & snapshot.alive):
+                bits = box_bits
+                radius = circle.radius
+            else:
+                limit = 10
+
+        if not has_valid_search_param:
+            return None
+
+        spots = self.rank(request, snapshot.get(bits), bbox, radius, limit)
+        spots.sort(key=attrgetter('pk'))
+        return spots
+
+    def search_circle(self, request):
+        """ Returns the SearchCircle of a search by distance from
+        center_longitude and center_latitude, or None if the request
+        doesn't have all three parameters or they aren't numbers.
+        """
+        if not ('distance' in request.GET and 'center_longitude' in request.GET and 'center_latitude' in request.GET):
+            return None
+        try:
+            longitude = float(request.GET['center_longitude'])
+            latitude = float(request.GET['center_latitude'])
+            radius = float(request.GET['distance'])
+        except ValueError:
+            logger.info("Ignoring an invalid distance search: %s", request.GET.urlencode())
+            return None
+        return SearchCircle(longitude, latitude, radius, self.box(longitude, latitude, radius))
+
+    def within_radius(self, request, found_any):
+        """ Whether to keep a search to its circle, given whether anything
+        was found in the circle. With expand_radius, a search that finds
+        nothing nearby searches everywhere instead.
+        """
+        return 'expand_radius' not in request.GET or bool(found_any)
+
+    def rank(self, request, spots, bbox, radius, limit):
+        """ Drops the spots outside of the search radius, and keeps the
+        limit spots nearest the center when there are more.
+        """
+        if radius is not None or (limit > 0 and limit < len(spots)):
+            if 'center_longitude' in request.GET and 'center_latitude' in request.GET:
+                center_longitude, center_latitude = request.GET['center_longitude'], request.GET['center_latitude']
+            elif bbox is not None:
+                center_longitude, center_latitude = self.bbox_center(*bbox)
+            else:
+                raise RESTException("missing required parameters for this type of search", 400)
+            distances = self.distances(spots, center_longitude, center_latitude)
+
+            ranked = zip(distances, spots)
+            if radius is not None:
+                # The bounding box also has corners outside of the radius
+                ranked = [(dist, spot) for dist, spot in ranked if dist <= radius]
+            if limit > 0 and limit < len(ranked):
+                ranked = heapq.nsmallest(limit, ranked, key=itemgetter(0))
+            spots = [spot for dist, spot in ranked]
+        return spots
+
+    def compact_spots(self, query):
+        """ Returns a CompactSpot for each spot in query, loaded from
+        one values_list query instead of as Spot objects.
+        """
+        values = query.values_list(*CompactSpot._fields).order_by()
+        return [CompactSpot._make(row) for row in values]
+
+    def compact_columns(self, spots, types=None):
+        """ The columnar format=compact body for a list of spots: one
+        list per field, in the same order as spots. The types are
+        loaded unless given as a dict of type names keyed by spot id.
+        """
+        spot_ids = [spot.pk for spot in spots]
+
+        if types is None:
+            types = self.spot_types(spot_ids)
+
+        return {
+            'id': spot_ids,
+            'latitude': [spot.latitude for spot in spots],
+            'longitude': [spot.longitude for spot in spots],
+            'capacity': [spot.capacity for spot in spots],
+            'type': [types[spot_id] for spot_id in spot_ids],
+        }
+
+    def spot_types(self, spot_ids):
+        """ The names of the types of each spot, keyed by spot id. """
+        types = dict((spot_id, []) for spot_id in spot_ids)
+        for start in range(0, len(spot_ids), Spot.objects.JSON_BATCH_SIZE):
+            batch = spot_ids[start:start + Spot.objects.JSON_BATCH_SIZE]
+            spot_types = Spot.spottypes.through.objects.filter(spot__in=batch).order_by('id')
+            for spot_id, name in spot_types.values_list('spot_id', 'spottype__name'):
+                types[spot_id].append(name)
+        return types
+
+    def search_query(self, request, chain):
+        """ Builds the query for the search parameters in request, apart
+        from the distance and nearest parameters. Returns the query,
+        whether any valid search parameter was found, and the parsed bbox
+        (or None).
+        """
+        has_valid_search_param = False
         query = Spot.objects.all()
+        bbox = None
 
-        day_dict = {"Sunday": "su",
-                    "Monday": "m",
-                    "Tuesday": "t",
-                    "Wednesday": "w",
-                    "Thursday": "th",
-                    "Friday": "f",
-                    "Saturday": "sa", }
         # Exclude things that get special consideration here, otherwise add a filter for the keys
         for key in request.GET:
             if key.startswith('oauth_'):
@@ -74,6 +510,17 @@ class SearchView(RESTDispatch):
                 pass
             elif key == "expand_radius":
                 pass
+            elif key == "nearest":
+                pass
+            elif key == "format":
+                pass
+            elif key == "zoom":
+                # Used by the cluster view
+                pass
+            elif key == "bbox":
+                bbox = self.parse_bbox(request.GET[key])
+                query = self.filter_box(query, *bbox)
+                has_valid_search_param = True
             elif key == "distance":
                 pass
             elif key == "center_latitude":
@@ -82,57 +529,15 @@ class SearchView(RESTDispatch):
                 pass
             elif key == "limit":
                 pass
+            elif key in ("page_size", "cursor", "fields"):
+                pass
             elif key == "open_anytime":
                 pass
-            elif key == "open_now":
-                if request.GET["open_now"]:
-
-                    day_lookup = ["su", "m", "t", "w", "th", "f", "sa"]
-                    day_num = int(strftime("%w", localtime()))
-                    today = day_lookup[day_num]
-                    now = datetime.time(datetime.now())
-                    query = query.filter(spotavailablehours__day__iexact=today, spotavailablehours__start_time__lt=now, spotavailablehours__end_time__gt=now)
+            elif key in ("open_now", "open_until", "open_at"):
+                window = self.open_window(request, key)
+                if window is not None:
+                    query = self.filter_open(query, *window)
                     has_valid_search_param = True
-            elif key == "open_until":
-                if request.GET["open_until"] and request.GET["open_at"]:
-                    until_day, until_time = request.GET["open_until"].split(',')
-                    at_day, at_time = request.GET["open_at"].split(',')
-                    until_day = day_dict[until_day]
-                    at_day = day_dict[at_day]
-
-                    if until_day == at_day:
-                        if strptime(until_time, "%H:%M") >= strptime(at_time, "%H:%M"):
-                            query = query.filter(spotavailablehours__day__iexact=until_day, spotavailablehours__start_time__lte=at_time, spotavailablehours__end_time__gte=until_time)
-                        else:
-                            days_to_test = ["su", "m", "t", "w", "th", "f", "sa"]
-                            days_to_test.remove(at_day)
-
-                            query = query.filter(spotavailablehours__day__iexact=at_day, spotavailablehours__start_time__lte=at_time, spotavailablehours__end_time__gte="23:59")
-                            query = query.filter(spotavailablehours__day__iexact=until_day, spotavailablehours__start_time__lte="00:00", spotavailablehours__end_time__gte=until_time)
-
-                            for day in days_to_test:
-                                query = query.filter(spotavailablehours__day__iexact=day, spotavailablehours__start_time__lte="00:00", spotavailablehours__end_time__gte="23:59")
-                    else:
-                        days_to_test = self.get_days_in_range(at_day, until_day)
-                        last_day = days_to_test.pop()
-                        days_to_test.reverse()
-                        first_day = days_to_test.pop()
-
-                        query = query.filter(spotavailablehours__day__iexact=first_day, spotavailablehours__start_time__lte=at_time, spotavailablehours__end_time__gte="23:59")
-                        query = query.filter(spotavailablehours__day__iexact=last_day, spotavailablehours__start_time__lte="00:00", spotavailablehours__end_time__gte=until_time)
-
-                        for day in days_to_test:
-                            query = query.filter(spotavailablehours__day__iexact=day, spotavailablehours__start_time__lte="00:00", spotavailablehours__end_time__gte="23:59")
-                    has_valid_search_param = True
-            elif key == "open_at":
-                if request.GET["open_at"]:
-                    try:
-                        request.GET["open_until"]
-                    except:
-                        day, time = request.GET['open_at'].split(',')
-                        day = day_dict[day]
-                        query = query.filter(spotavailablehours__day__iexact=day, spotavailablehours__start_time__lte=time, spotavailablehours__end_time__gt=time)
-                        has_valid_search_param = True
             elif key == "capacity":
                 try:
                     limit = int(request.GET["capacity"])
@@ -183,78 +588,146 @@ class SearchView(RESTDispatch):
                     if not request.META['SERVER_NAME'] == 'testserver':
                         print >> sys.stderr, "E: ", e
 
-        # Always prefetch the related extended info
-        query = query.select_related('SpotExtendedInfo')
-
         query = chain.filter_query(query)
         if chain.has_valid_search_param:
             has_valid_search_param = True
 
-        limit = 20
-        if 'limit' in request.GET:
-            if request.GET['limit'] == '0':
-                limit = 0
-            else:
-                limit = int(request.GET['limit'])
-
-        if 'distance' in request.GET and 'center_longitude' in request.GET and 'center_latitude' in request.GET:
-            try:
-                g = Geod(ellps='clrk66')
-                top = g.fwd(request.GET['center_longitude'], request.GET['center_latitude'], 0, request.GET['distance'])
-                right = g.fwd(request.GET['center_longitude'], request.GET['center_latitude'], 90, request.GET['distance'])
-                bottom = g.fwd(request.GET['center_longitude'], request.GET['center_latitude'], 180, request.GET['distance'])
-                left = g.fwd(request.GET['center_longitude'], request.GET['center_latitude'], 270, request.GET['distance'])
-
-                top_limit = "%.8f" % top[1]
-                bottom_limit = "%.8f" % bottom[1]
-                left_limit = "%.8f" % left[0]
-                right_limit = "%.8f" % right[0]
-
-                distance_query = query.filter(longitude__gte=left_limit)
-
-                distance_query = distance_query.filter(longitude__lte=right_limit)
-                distance_query = distance_query.filter(latitude__gte=bottom_limit)
-                distance_query = distance_query.filter(latitude__lte=top_limit)
-                has_valid_search_param = True
+        return query, has_valid_search_param, bbox
 
-                if len(distance_query) > 0 or 'expand_radius' not in request.GET:
-                    query = distance_query
-                else:
-                    # If we're querying everything, let's make sure we only return a limited number of spaces...
-                    limit = 10
-            except Exception as e:
-                if not request.META['SERVER_NAME'] == 'testserver':
-                    print >> sys.stderr, "E: ", e
-                #query = Spot.objects.all()
-        elif 'distance' in request.GET or 'center_longitude' in request.GET or 'center_latitude' in request.GET:
-            if 'distance' not in request.GET or 'center_longitude' not in request.GET or 'center_latitude' not in request.GET:
-                # If distance, lat, or long are specified in the server request; all 3 must be present.
-                raise RESTException("Must specify latitude, longitude, and distance", 400)
-
-        if not has_valid_search_param:
-            return JSONResponse([])
-
-        if limit > 0 and limit < len(query):
-            sorted_list = list(query)
-            try:
-                sorted_list.sort(lambda x, y: cmp(self.distance(x, request.GET['center_longitude'], request.GET['center_latitude']), self.distance(y, request.GET['center_longitude'], request.GET['center_latitude'])))
-                query = sorted_list[:limit]
-            except KeyError:
-                raise RESTException("missing required parameters for this type of search", 400)
-
-        response = []
-        spots = set(query)
-        spots = chain.filter_results(spots)
-
-        for spot in spots:
-            response.append(spot.json_data_structure())
+    def open_window(self, request, key):
+        """ Returns the minute-of-week window a spot has to be open for,
+        for an open_now, open_until or open_at parameter, or None if the
+        parameter doesn't limit the search on its own.
+        """
+        day_dict = {"Sunday": "su",
+                    "Monday": "m",
+                    "Tuesday": "t",
+                    "Wednesday": "w",
+                    "Thursday": "th",
+                    "Friday": "f",
+                    "Saturday": "sa", }
 
-        return JSONResponse(response)
+        if key == "open_now":
+            if request.GET["open_now"]:
+                day_lookup = ["su", "m", "t", "w", "th", "f", "sa"]
+                day_num = int(strftime("%w", localtime()))
+                today = day_lookup[day_num]
+                now = datetime.time(datetime.now())
+                return opening_hours.window(today, now)
+        elif key == "open_until":
+            if request.GET["open_until"] and request.GET["open_at"]:
+                until_day, until_time = request.GET["open_until"].split(',')
+                at_day, at_time = request.GET["open_at"].split(',')
+                return opening_hours.window(day_dict[at_day], at_time, day_dict[until_day], until_time)
+        elif key == "open_at":
+            if request.GET["open_at"] and "open_until" not in request.GET:
+                day, time = request.GET['open_at'].split(',')
+                return opening_hours.window(day_dict[day], time)
+        return None
+
+    def filter_open(self, query, start, end):
+        """ Narrows query to the spots open for the whole of a window of
+        minutes of the week, using their precomputed open intervals.
+        """
+        return query.filter(spotopeninterval__start__lte=start, spotopeninterval__end__gte=end)
+
+    def box(self, longitude, latitude, distance):
+        """ Returns the (south, west, north, east) limits of the box
+        around a point that holds a circle of distance metres.
+        """
+        g = Geod(ellps='clrk66')
+        top = g.fwd(longitude, latitude, 0, distance)
+        right = g.fwd(longitude, latitude, 90, distance)
+        bottom = g.fwd(longitude, latitude, 180, distance)
+        left = g.fwd(longitude, latitude, 270, distance)
+
+        return "%.8f" % bottom[1], "%.8f" % left[0], "%.8f" % top[1], "%.8f" % right[0]
+
+    def nearest_spots(self, query, chain, count, longitude, latitude, distance, after=None):
+        """ Returns the count spots in query nearest to a point, closest
+        first. A circle of distance metres is searched first, and doubled
+        until it holds enough spots, so every step is an indexed box
+        search. Past NEAREST_MAX_DISTANCE every located spot is ranked.
+        If after is a (distance, id) pair, only spots ranked after it
+        are returned.
+        """
+        query = query.filter(longitude__isnull=False, latitude__isnull=False)
+        while True:
+            if distance < self.NEAREST_MAX_DISTANCE:
+                radius = distance
+                candidates = self.filter_box(query, *self.box(longitude, latitude, distance))
+            else:
+                radius = float('inf')
+                candidates = query
+
+            spots = list(chain.filter_results(set(candidates)))
+            ranked = [(dist, spot) for dist, spot in zip(self.distances(spots, longitude, latitude), spots) if dist <= radius]
+            if after is not None:
+                ranked = [(dist, spot) for dist, spot in ranked if (dist, spot.pk) > after]
+            if len(ranked) >= count or radius == float('inf'):
+                return [spot for dist, spot in heapq.nsmallest(count, ranked, key=lambda ranked_spot: (ranked_spot[0], ranked_spot[1].pk))]
+            distance *= 2
+
+    def filter_box(self, query, south, west, north, east):
+        """ Narrows query to the spots inside a latitude/longitude box.
+        The indexed geohash column is first limited to the cells covering
+        the box, then the exact latitude and longitude limits are applied.
+        """
+        cells = Q()
+        for start, stop in geohash.ranges(geohash.cover(south, west, north, east)):
+            cells |= Q(geohash__gte=start, geohash__lt=stop)
+        query = query.filter(cells)
+
+        if float(west) > float(east):
+            # The box crosses the antimeridian
+            query = query.filter(Q(longitude__gte=west) | Q(longitude__lte=east))
+        else:
+            query = query.filter(longitude__gte=west, longitude__lte=east)
+        return query.filter(latitude__gte=south, latitude__lte=north)
+
+    def parse_bbox(self, value):
+        """ Returns the (south, west, north, east) of a bbox parameter.
+        A west greater than east is a box that crosses the antimeridian.
+        """
+        try:
+            south, west, north, east = [Decimal(part.strip()) for part in value.split(',')]
+            in_limits = -90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180
+        except (ValueError, InvalidOperation):
+            raise RESTException("bbox must be south,west,north,east", 400)
+
+        if not in_limits:
+            raise RESTException("bbox is outside of the latitude and longitude limits", 400)
+        return south, west, north, east
+
+    def bbox_center(self, south, west, north, east):
+        """ Returns the (longitude, latitude) at the middle of a box."""
+        if west > east:
+            east += 360
+        longitude = (west + east) / 2
+        if longitude > 180:
+            longitude -= 360
+        return longitude, (south + north) / 2
+
+    def distances(self, spots, longitude, latitude):
+        """ Returns the distance of each spot from a point, computed in
+        one pass over arrays of coordinates. Spots without a location
+        are infinitely far away.
+        """
+        located = [i for i, spot in enumerate(spots) if spot.longitude is not None and spot.latitude is not None]
+        result = [float('inf')] * len(spots)
+        if not located:
+            return result
+
+        spot_longitudes = array('d', [spots[i].longitude for i in located])
+        spot_latitudes = array('d', [spots[i].latitude for i in located])
+        longitudes = array('d', [float(longitude)]) * len(located)
+        latitudes = array('d', [float(latitude)]) * len(located)
 
-    def distance(self, spot, longitude, latitude):
         g = Geod(ellps='clrk66')
-        az12, az21, dist = g.inv(spot.longitude, spot.latitude, longitude, latitude)
-        return dist
+        az12, az21, dist = g.inv(spot_longitudes, spot_latitudes, longitudes, latitudes)
+        for i, d in zip(located, dist):
+            result[i] = d
+        return result
 
     def get_days_in_range(self, start_day, until_day):
         day_lookup = ["su", "m", "t", "w", "th", "f", "sa", "su", "m", "t", "w", "th", "f", "sa"]
@@ -21,7 +21,7 @@
         add external_id support.
 """
 
-from spotseeker_server.views.rest_dispatch import RESTDispatch, RESTException, RESTFormInvalidError, JSONResponse
+from spotseeker_server.views.rest_dispatch import RESTDispatch, RESTException, RESTFormInvalidError, JSONResponse, EncodedJSONResponse, spot_response
 from spotseeker_server.forms.spot import SpotForm, SpotExtendedInfoForm
 from spotseeker_server.models import *
 from django.http import HttpResponse
@@ -145,8 +145,13 @@ class SpotView(RESTDispatch):
     @app_auth_required
     def GET(self, request, spot_id):
         spot = Spot.get_with_external(spot_id)
-        response = JSONResponse(spot.json_data_structure())
-        response["ETag"] = spot.etag
+        fields = self.spot_fields(request)
+
+        etag = self.fields_etag(spot.etag, fields)
+        response = self.not_modified(request, etag, spot.last_modified)
+        if response is None:
+            response = self.cached_compressed_response(request, etag, lambda: spot_response(spot, fields))
+            self.set_validators(response, etag, spot.last_modified)
         return response
 
     @user_auth_required
@@ -171,13 +176,23 @@ class SpotView(RESTDispatch):
         self.validate_etag(request, spot)
 
         spot.delete()
+        spot.changes_committed()
         response = HttpResponse()
         response.status_code = 200
         return response
 
     # These are utility methods for the HTTP methods
-    @transaction.commit_on_success
     def build_and_save_from_input(self, request, spot):
+        response, spot, spot_json = self._build_and_save_from_input(request, spot)
+
+        # Write through only once the changes are committed, so the
+        # cache never holds data that could still be rolled back.
+        spot.changes_committed({spot.pk: spot_json})
+
+        return response
+
+    @transaction.commit_on_success
+    def _build_and_save_from_input(self, request, spot):
         body = request.read()
         try:
             json_values = json.loads(body)
@@ -243,12 +258,13 @@ class SpotView(RESTDispatch):
 
         # gets the current etag
         spot = Spot.get_with_external(spot.pk)
+        spot_json = Spot.objects.build_encoded_json([spot])[spot.pk]
 
         if is_new:
             response = HttpResponse(status=201)
             response['Location'] = spot.rest_url()
         else:
-            response = JSONResponse(spot.json_data_structure(), status=200)
+            response = EncodedJSONResponse(spot_json, status=200)
         response["ETag"] = spot.etag
 
         spot_post_build.send(
@@ -260,7 +276,7 @@ class SpotView(RESTDispatch):
             stash=stash
         )
 
-        return response
+        return response, spot, spot_json
 
     def _build_spot_location(self, json_values):
         """Unnest the location JSON object"""